@@ -1,32 +1,52 @@
-import pickle
 import uuid
 
-import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
-from dash import Dash, Input, dcc, Output, State, callback, page_container, _dash_renderer
+from dash import Dash, Input, dcc, Output, State, callback, no_update, page_container, _dash_renderer
 _dash_renderer._set_react_version("18.2.0")
 from flask import request
 
+import data_api
+import figures
+import gallery
+import llm
+import metrics
+import profiler
+import retrieval
+import scheduler
+import static_assets
 import utils
-from constants import redis_instance
+import workspace
+
+# The Plotly bundle and the assets/ scripts and stylesheets, Bootstrap included, are served
+# fingerprinted from /bundles
+static_assets.build()
 
 app = Dash(
     __name__,
     suppress_callback_exceptions=True,
-    external_scripts=["https://cdn.plot.ly/plotly-latest.min.js"],
-    external_stylesheets=[dbc.themes.BOOTSTRAP],
+    external_scripts=static_assets.scripts(),
+    external_stylesheets=static_assets.stylesheets(),
+    assets_ignore=r"\.(css|js)$",
     title="AI Data Insights",
     use_pages=True,
 )
 
 
 server = app.server
+server.register_blueprint(data_api.blueprint)
+server.register_blueprint(figures.blueprint)
+server.register_blueprint(static_assets.blueprint)
+static_assets.compress(server)
+server.add_url_rule("/metrics", "metrics", metrics.export)
+metrics.instrument_callbacks(app)
+profiler.install(app)
 
 
 def layout():
     return dmc.MantineProvider(
         [
             dcc.Location(id="url", refresh=False),
+            dcc.Store(id="session-id", storage_type="session"),
             #utils.jumbotron(),
             page_container,
         ],
@@ -36,17 +56,49 @@ def layout():
 app.layout = layout()
 
 
+@callback(
+    Output("session-id", "data"),
+    Input("session-id", "modified_timestamp"),
+    State("session-id", "data"),
+)
+def init_session(ts, session_id):
+    new = not session_id
+    session_id = session_id or str(uuid.uuid4())
+    # Only this browser may then read the session's uploads through /api
+    workspace.claim(session_id, request.cookies.get(data_api.BROWSER_COOKIE))
+    return session_id if new else no_update
+
+
+@callback(
+    Input("_pages_location", "pathname"),
+    Input("session-id", "data"),
+)
+def track_navigation(pathname, session_id):
+    # Leaving a page abandons the model requests it started. The first page of a visit
+    # is recorded once init_session has given the browser its session id.
+    if session_id and pathname:
+        scheduler.navigate(session_id, pathname)
+
+
 @callback(
     Output("save-clip", "content"),
     Input("save-clip", "n_clicks"),
-    State("current-charts", "children"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def copy_link_to_view(n, current):
-    figure_id = str(uuid.uuid4())
-    redis_instance.set(figure_id, pickle.dumps(current))
-    return request.host_url[:-1] + app.get_relative_path(f"/view?layout={figure_id}")
+def copy_link_to_view(n, session_id):
+    if not session_id:
+        return no_update
+    # The link references the stored figures by id, nothing is uploaded
+    share_id = gallery.share(session_id)
+    return request.host_url[:-1] + app.get_relative_path(f"/view?layout={share_id}")
 
 
 if __name__ == "__main__":
+    # Load the model and the vector index in the background now rather than on the first
+    # user's request. Under gunicorn each worker does this in post_worker_init: started here,
+    # the threads would run in the master when the app is preloaded and be forked into every
+    # worker mid-request.
+    llm.gateway.start_health_checks()
+    retrieval.index.start()
     app.run(debug=False)
\ No newline at end of file
@@ -0,0 +1,192 @@
+import json
+import re
+
+import pandas as pd
+import plotly.graph_objects as go
+
+# Leading number and optional unit, e.g. "35.9 gram", "8.5 RINe", "92435321 read"
+NUMBER_WITH_UNIT = r"^\s*(-?\d+(?:\.\d+)?)\s*([^\d\s-].*)?$"
+ISA_PREFIX = re.compile(r"^(Factor Value|Parameter Value|Characteristics|Comment):\s*")
+
+MIN_NUMERIC_SHARE = 0.8  # share of non-null values that must parse for a column to count as numeric
+MAX_GROUPS = 12  # more categories than this do not make a readable box or bar chart
+
+# Chart specs written by the model: trace types it may use and the keys that name a column
+SPEC_TRACE_TYPES = {"bar", "box", "heatmap", "histogram", "pie", "scatter", "scattergl", "violin"}
+SPEC_COLUMN_KEYS = ("x", "y", "z", "values", "labels", "text")
+SPEC_MAX_TRACES = 10
+
+
+class ChartSpecError(ValueError):
+    """Raised when a model's chart spec is not a figure we can draw from the table."""
+
+
+def label(column):
+    """Strips the ISA-Tab prefix, 'Parameter Value: QA Score' -> 'QA Score'."""
+    return ISA_PREFIX.sub("", column)
+
+
+def parse_numeric(series):
+    """Parses values such as '35.9 gram' into numbers, anything else becomes NaN."""
+    return pd.to_numeric(series.astype("string").str.extract(NUMBER_WITH_UNIT)[0], errors="coerce")
+
+
+def profile_columns(df):
+    """Classifies every column of a sample table as numeric, group, identifier or constant.
+
+    Values such as '35.9 gram' are parsed for all text columns at once by
+    stacking them into a single series, and the unit is kept for the axis
+    labels. Returns the profile as a DataFrame indexed by column name and the
+    parsed numeric columns.
+    """
+    nunique = df.nunique()
+    text_columns = [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])]
+
+    parsed = pd.DataFrame(index=df.index, columns=text_columns, dtype=float)
+    units = pd.Series(dtype=object)
+    if text_columns:
+        parts = df[text_columns].stack().astype("string").str.extract(NUMBER_WITH_UNIT)
+        parsed = pd.to_numeric(parts[0], errors="coerce").unstack().reindex(index=df.index, columns=text_columns)
+        unit_groups = parts[1].str.strip().groupby(level=1)
+        units = unit_groups.first().where(unit_groups.nunique() == 1)
+
+    values = pd.concat([df.drop(columns=text_columns), parsed], axis=1)[df.columns]
+    parsed_share = values.notna().sum() / df.notna().sum().clip(lower=1)
+    numeric = (parsed_share >= MIN_NUMERIC_SHARE) & values.notna().any()
+    factor = df.columns.str.startswith("Factor Value:")
+
+    kind = pd.Series("identifier", index=df.columns)
+    groupable = (nunique <= MAX_GROUPS) & (nunique < len(df))
+    kind[numeric] = "numeric"
+    kind[groupable & (~numeric | factor)] = "group"  # a factor such as '32 week' is still a group
+    kind[nunique <= 1] = "constant"
+
+    profile = pd.DataFrame({
+        "kind": kind,
+        "unique": nunique,
+        "unit": units.reindex(df.columns),
+        "factor": factor,
+    })
+    return profile, values.loc[:, kind == "numeric"]
+
+
+def _axis_title(column, profile):
+    unit = profile.at[column, "unit"]
+    return f"{label(column)} ({unit})" if pd.notna(unit) and unit else label(column)
+
+
+def separation(numeric, groups):
+    """Share of each numeric column's variance explained by the groups (eta squared), in one pass."""
+    group_means = numeric.groupby(groups.values, observed=True).transform("mean")
+    total = numeric.var(ddof=0)
+    between = group_means.var(ddof=0)
+    return (between / total.where(total > 0)).fillna(0)
+
+
+def auto_chart(df):
+    """Builds a sensible default figure for a table without calling the model.
+
+    Experimental factors are preferred as groups, and the measured parameter
+    that differs most between those groups as the metric. This gives the
+    same kind of chart as the hand-made violin of body weight by spaceflight
+    condition: group x numeric -> violin, numeric x numeric -> scatter,
+    numeric -> histogram, group -> bar of counts. Figures are built from
+    graph objects directly, which is several times faster than plotly
+    express for these small tables.
+    """
+    profile, numeric = profile_columns(df)
+    groups = profile[profile["kind"] == "group"]
+    groups = groups.sort_values(["factor", "unique"], ascending=[False, True]).index
+    # Prefer measured parameters over identifiers and dates that happen to be numbers
+    parameters = [c for c in numeric.columns if c.startswith("Parameter Value:")]
+    metrics = numeric[parameters] if parameters else numeric
+
+    if metrics.shape[1] and len(groups):
+        group = groups[0]
+        metric = separation(metrics, df[group]).idxmax()
+        fig = go.Figure([
+            go.Violin(
+                x=values[group],
+                y=values[metric],
+                name=str(name),
+                box_visible=True,
+                points="all",
+            )
+            for name, values in pd.DataFrame({group: df[group], metric: metrics[metric]}).groupby(group, observed=True)
+        ])
+        fig.update_layout(
+            title={"text": f"{label(metric)} by {label(group)}"},
+            xaxis={"title": {"text": label(group)}},
+            yaxis={"title": {"text": _axis_title(metric, profile)}},
+        )
+    elif metrics.shape[1] >= 2:
+        x, y = metrics.columns[:2]
+        fig = go.Figure(go.Scattergl(x=metrics[x], y=metrics[y], mode="markers"))
+        fig.update_layout(
+            title={"text": f"{label(y)} vs {label(x)}"},
+            xaxis={"title": {"text": _axis_title(x, profile)}},
+            yaxis={"title": {"text": _axis_title(y, profile)}},
+        )
+    elif metrics.shape[1]:
+        metric = metrics.columns[0]
+        fig = go.Figure(go.Histogram(x=metrics[metric]))
+        fig.update_layout(
+            title={"text": f"Distribution of {label(metric)}"},
+            xaxis={"title": {"text": _axis_title(metric, profile)}},
+        )
+    elif len(groups):
+        group = groups[0]
+        counts = df[group].value_counts()
+        fig = go.Figure(go.Bar(x=counts.index.astype(str), y=counts.values))
+        fig.update_layout(
+            title={"text": f"Samples by {label(group)}"},
+            xaxis={"title": {"text": label(group)}},
+            yaxis={"title": {"text": "count"}},
+        )
+    else:
+        fig = go.Figure(layout={"title": {"text": "No chartable columns found"}})
+
+    fig.update_layout(legend={"orientation": "h"})
+    return fig
+
+
+def _spec_column(df, column):
+    if not isinstance(column, str) or column not in df.columns:
+        raise ChartSpecError(f"The chart refers to an unknown column: {column!r}.")
+    parsed = parse_numeric(df[column])
+    # '35.9 gram' columns are drawn as numbers, like profile_columns counts them
+    if parsed.notna().any() and parsed.notna().sum() >= MIN_NUMERIC_SHARE * df[column].notna().sum():
+        return parsed
+    return df[column]
+
+
+def figure_from_spec(reply, df):
+    """Builds the figure a model described as JSON, with column names of df where the data goes.
+
+    Nothing of the reply is run: it is parsed with json.loads, only the trace
+    types of SPEC_TRACE_TYPES and existing columns are accepted, and plotly
+    validates every other property when the figure is built. Raises
+    ChartSpecError otherwise.
+    """
+    # Models like to wrap JSON in a code fence or a sentence
+    start, end = reply.find("{"), reply.rfind("}")
+    try:
+        spec = json.loads(reply[start:end + 1]) if start != -1 else None
+    except json.JSONDecodeError as e:
+        raise ChartSpecError(f"The chart is not valid JSON: {e}")
+    if not isinstance(spec, dict) or not isinstance(spec.get("data"), list) or not spec["data"]:
+        raise ChartSpecError("The chart has no list of traces under 'data'.")
+    layout = spec.get("layout", {})
+    if not isinstance(layout, dict):
+        raise ChartSpecError("The chart layout is not an object.")
+
+    traces = []
+    for trace in spec["data"][:SPEC_MAX_TRACES]:
+        if not isinstance(trace, dict) or trace.get("type") not in SPEC_TRACE_TYPES:
+            raise ChartSpecError(f"Unsupported trace: {trace!r:.100}.")
+        trace = {**trace, **{k: _spec_column(df, trace[k]) for k in SPEC_COLUMN_KEYS if k in trace}}
+        traces.append(trace)
+    try:
+        return go.Figure({"data": traces, "layout": layout})
+    except ValueError as e:
+        raise ChartSpecError(f"Invalid chart properties: {e}")
@@ -0,0 +1,162 @@
+"""A deterministic stand-in for the Ollama HTTP API.
+
+Serves /api/chat (streamed or not), /api/generate, /api/embed and /api/ps
+with canned answers, so the app and the benchmarks can run without a GPU.
+The delay before the first token and between tokens is configurable to
+model a slow or fast backend.
+
+    python -m bench.fake_ollama --port 11500 --first-token 0.5 --per-token 0.02
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBEDDING_SIZE = 64
+
+SUMMARY = {
+    "experiment_name": "Synthetic Rodent Research",
+    "experiment_overview": "Mice were flown on the International Space Station to study tissue changes.",
+    "goals": ["Measure the effect of spaceflight", "Compare flight and ground controls"],
+    "significance": "It helps keep astronauts healthy on long missions.",
+    "protocol": [{"name": "Animal Husbandry", "description": "Mice were housed in rodent habitats."}],
+}
+# Models tend to wrap the JSON in prose, which the summary page has to clean up
+SUMMARY_ANSWER = f"Here is the summary you asked for:\n{json.dumps(SUMMARY, indent=2)}\nI hope it helps!"
+CHAT_ANSWER = (
+    "The **Space Flight** group has a slightly higher mean QA score than the ground controls, "
+    "which a box plot of QA Score by Spaceflight shows best."
+)
+PLOT_ANSWER = json.dumps({
+    "data": [{"type": "box", "x": "Factor Value: Spaceflight", "y": "Parameter Value: QA Score", "name": "QA Score"}],
+    "layout": {"title": {"text": "QA Score by Spaceflight"}},
+})
+
+
+def answer_for(messages):
+    prompt = messages[-1].get("content", "") if messages else ""
+    if "JSON structure" in prompt:
+        return SUMMARY_ANSWER
+    if "Plotly figure as JSON" in prompt:
+        return PLOT_ANSWER
+    return CHAT_ANSWER
+
+
+def embedding(text):
+    seed = int(hashlib.sha1(text.encode()).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).normal(size=EMBEDDING_SIZE).round(6).tolist()
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    first_token = 0.0
+    per_token = 0.0
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # otherwise every streamed token waits for a delayed ACK
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _timings(self, tokens, started):
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": 100,
+            "prompt_eval_duration": int(self.first_token * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(self.per_token * tokens * 1e9),
+        }
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            self._send_json({"models": []})
+        elif self.path == "/api/tags":
+            self._send_json({"models": []})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc).isoformat()
+        model = request.get("model", "")
+
+        if self.path == "/api/embed":
+            texts = request.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            self._send_json({"model": model, "embeddings": [embedding(t) for t in texts]})
+        elif self.path == "/api/generate":
+            self._send_json({"model": model, "created_at": now, "response": "", **self._timings(0, started)})
+        elif self.path == "/api/chat":
+            self._chat(request, model, now, started)
+        else:
+            self.send_error(404)
+
+    def _chat(self, request, model, now, started):
+        words = answer_for(request.get("messages", [])).split(" ")
+        time.sleep(self.first_token)
+        if not request.get("stream", True):
+            time.sleep(self.per_token * len(words))
+            message = {"role": "assistant", "content": " ".join(words)}
+            self._send_json({"model": model, "created_at": now, "message": message, **self._timings(len(words), started)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words):
+            time.sleep(self.per_token)
+            content = word if i == 0 else f" {word}"
+            self._write_chunk({"model": model, "created_at": now, "message": {"role": "assistant", "content": content}, "done": False})
+        self._write_chunk({
+            "model": model, "created_at": now, "message": {"role": "assistant", "content": ""},
+            **self._timings(len(words), started),
+        })
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(port=0, first_token=0.0, per_token=0.0):
+    """Starts the fake server on a background thread and returns it; port 0 picks a free port."""
+    handler = type("ConfiguredFakeOllama", (FakeOllama,), {"first_token": first_token, "per_token": per_token})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-ollama").start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--first-token", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--per-token", type=float, default=0.0, help="seconds between tokens")
+    args = parser.parse_args()
+    server = serve(args.port, args.first_token, args.per_token)
+    print(f"Fake Ollama listening on 127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
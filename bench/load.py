@@ -0,0 +1,297 @@
+"""Replays user journeys against a running app through its Dash callback endpoint.
+
+Each virtual user walks home -> summary -> /ai question -> save a chart ->
+share -> view, POSTing to /_dash-update-component exactly like the browser
+does, with its own session id. The callbacks are looked up from
+/_dash-dependencies, so the payloads follow the app as it changes.
+
+Against an app that is already running:
+
+    python -m bench.load --url http://127.0.0.1:8050 --users 16 --duration 60 --workers 4
+
+or let the harness start gunicorn with a fake Ollama of the given latency
+(Redis must be running at REDIS_URL):
+
+    python -m bench.load --start-server --workers 4 --users 16 --first-token 0.5 --per-token 0.02
+
+Reports throughput, p50/p95/p99 latency per callback and, from the app's
+/metrics, how busy the workers were.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench import fake_ollama
+
+CALLBACK_SUM = re.compile(r'^dash_callback_seconds_sum\{[^}]*\} ([0-9.e+-]+)$', re.M)
+
+EDITOR_FIGURE = {
+    "data": [{"type": "box", "xsrc": "Factor Value: Spaceflight", "ysrc": "Parameter Value: QA Score"}],
+    "layout": {"title": {"text": "QA Score by Spaceflight"}},
+}
+
+
+class DashClient:
+    """Builds callback requests from the app's dependency list."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.callbacks = requests.get(f"{self.url}/_dash-dependencies", timeout=30).json()
+
+    def find(self, trigger, output=None):
+        for callback in self.callbacks:
+            inputs = [f"{i['id']}.{i['property']}" for i in callback["inputs"]]
+            if trigger in inputs and (output is None or output in callback["output"]):
+                return callback
+        raise LookupError(f"No callback is triggered by {trigger} (output {output}).")
+
+    @staticmethod
+    def _outputs(output):
+        if not output.startswith(".."):
+            component, prop = output.split(".", 1)
+            return {"id": component, "property": prop}
+        return [
+            {"id": component, "property": prop}
+            for component, prop in (o.split(".", 1) for o in output.strip(".").split("..."))
+        ]
+
+    def call(self, http, trigger, values, output=None):
+        """Fires the callback `trigger` starts with the given {'id.prop': value} and returns its response."""
+        callback = self.find(trigger, output)
+        payload = {
+            "output": callback["output"],
+            "outputs": self._outputs(callback["output"]),
+            "inputs": [{**i, "value": values.get(f"{i['id']}.{i['property']}")} for i in callback["inputs"]],
+            "state": [{**s, "value": values.get(f"{s['id']}.{s['property']}")} for s in callback["state"]],
+            "changedPropIds": [trigger],
+        }
+        response = http.post(f"{self.url}/_dash-update-component", json=payload, timeout=600)
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+
+    def call_match(self, http, output_type, index, value):
+        """Fires the MATCH callback writing the component {'type': output_type, 'index': index}.
+
+        Its one input is the component of the same index, given `value`.
+        """
+        callback = next(c for c in self.callbacks if f'"type":"{output_type}"' in c["output"])
+        prop = callback["output"].rsplit(".", 1)[1]
+        (trigger,) = callback["inputs"]
+        trigger_id = {**json.loads(trigger["id"]), "index": index}
+        payload = {
+            "output": callback["output"],
+            "outputs": {"id": {"index": index, "type": output_type}, "property": prop},
+            "inputs": [{"id": trigger_id, "property": trigger["property"], "value": value}],
+            "state": [],
+            "changedPropIds": [f"{json.dumps(trigger_id, separators=(',', ':'), sort_keys=True)}.{trigger['property']}"],
+        }
+        response = http.post(f"{self.url}/_dash-update-component", json=payload, timeout=600)
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.flows = 0
+        self.lock = threading.Lock()
+
+    def timed(self, step, fn):
+        started = time.perf_counter()
+        try:
+            return fn()
+        except Exception:
+            with self.lock:
+                self.errors[step] += 1
+            raise
+        finally:
+            with self.lock:
+                self.latencies[step].append((time.perf_counter() - started) * 1000)
+
+
+def journey(client, recorder, experiment, question):
+    """One user's visit; steps are named after the callbacks they hit."""
+    http = requests.Session()
+    session = str(uuid.uuid4())
+
+    def page(path, search=""):
+        values = {"_pages_location.pathname": path, "_pages_location.search": search}
+        return client.call(http, "_pages_location.pathname", values, output="_pages_content")
+
+    recorder.timed("page:/", lambda: page("/"))
+    recorder.timed("search_experiments", lambda: client.call(
+        http, "experiment-dropdown.search_value", {"experiment-dropdown.search_value": experiment[:5]}))
+
+    recorder.timed("page:/summary", lambda: page("/summary", f"?id={experiment}"))
+    recorder.timed("show_catalog", lambda: client.call(
+        http, "url.search", {"url.search": f"?id={experiment}"}, output="summary-text"))
+    charts = recorder.timed("show_charts", lambda: client.call(
+        http, "url.search", {"url.search": f"?id={experiment}"}, output="summary-charts"))
+    # The browser fetches the chart slots in parallel; one after the other here, as the worst case
+    slots = (charts["response"]["summary-charts"]["children"] or {}).get("props", {}).get("children", [])
+    for i in range(len(slots)):
+        recorder.timed("build_chart", lambda: client.call_match(
+            http, "summary-chart", f"{experiment}:{i}", [experiment, i]))
+
+    recorder.timed("page:/ai", lambda: page("/ai"))
+    recorder.timed("chat_window", lambda: client.call(http, "chat-submit.n_clicks", {
+        "chat-submit.n_clicks": 1,
+        "question.value": question,
+        "session-id.data": session,
+        "compute-mode.checked": False,
+        "chat-history-loaded.data": 0,
+    }))
+    recorder.timed("save_figure", lambda: client.call(
+        http, "chart-editor.figure", {"chart-editor.figure": EDITOR_FIGURE, "session-id.data": session}))
+    shared = recorder.timed("copy_link_to_view", lambda: client.call(
+        http, "save-clip.n_clicks", {"save-clip.n_clicks": 1, "session-id.data": session}))
+
+    link = shared["response"]["save-clip"]["content"]
+    recorder.timed("page:/view", lambda: page("/view", link[link.index("?"):]))
+    with recorder.lock:
+        recorder.flows += 1
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 else values[0]
+
+
+def busy_seconds(url):
+    """Total time the app's workers spent in callbacks so far, or None without /metrics."""
+    try:
+        text = requests.get(f"{url}/metrics", timeout=10).text
+    except requests.RequestException:
+        return None
+    return sum(float(v) for v in CALLBACK_SUM.findall(text))
+
+
+def start_server(port, workers, first_token, per_token):
+    """Starts a fake Ollama and gunicorn serving the app, returning the gunicorn process."""
+    ollama = fake_ollama.serve(first_token=first_token, per_token=per_token)
+    metrics_dir = tempfile.mkdtemp(prefix="prometheus-")
+    env = {
+        **os.environ,
+        "OLLAMA_HOSTS": f"127.0.0.1:{ollama.server_address[1]}",
+        "PROMETHEUS_MULTIPROC_DIR": metrics_dir,
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:server", "--workers", str(workers), "--bind", f"127.0.0.1:{port}"],
+        env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_dash-dependencies", timeout=2).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("gunicorn did not come up within 2 minutes.")
+
+
+def run(url, users, duration, iterations, workers, experiment, question):
+    client = DashClient(url)
+    recorder = Recorder()
+    busy_before = busy_seconds(url)
+    stop_at = time.monotonic() + duration if duration else None
+
+    def user(_):
+        done = 0
+        while (stop_at is None and done < iterations) or (stop_at is not None and time.monotonic() < stop_at):
+            try:
+                journey(client, recorder, experiment, question)
+            except Exception as e:
+                print(f"Journey failed: {e}", file=sys.stderr)
+            done += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(user, range(users)))
+    wall = time.perf_counter() - started
+    busy_after = busy_seconds(url)
+
+    report = {
+        "users": users,
+        "wall_seconds": round(wall, 2),
+        "flows": recorder.flows,
+        "flows_per_second": round(recorder.flows / wall, 3),
+        "requests_per_second": round(sum(len(v) for v in recorder.latencies.values()) / wall, 2),
+        "steps": {
+            step: {
+                "count": len(values),
+                "errors": recorder.errors[step],
+                "p50_ms": round(percentile(values, 50), 1),
+                "p95_ms": round(percentile(values, 95), 1),
+                "p99_ms": round(percentile(values, 99), 1),
+            }
+            for step, values in recorder.latencies.items()
+        },
+    }
+    if busy_before is not None and busy_after is not None and workers:
+        # Share of the workers' time spent inside callbacks; near 1 means requests are queueing
+        report["worker_saturation"] = round((busy_after - busy_before) / (wall * workers), 3)
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['flows']} journeys by {report['users']} users in {report['wall_seconds']}s: "
+          f"{report['flows_per_second']} journeys/s, {report['requests_per_second']} requests/s")
+    if "worker_saturation" in report:
+        print(f"Worker saturation: {report['worker_saturation']:.0%}")
+    print(f"\n{'callback':<28}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, s in report["steps"].items():
+        print(f"{step:<28}{s['count']:>8}{s['errors']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, help="seconds to run; otherwise each user runs --iterations journeys")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--workers", type=int, help="gunicorn workers of the app, for the saturation figure")
+    parser.add_argument("--experiment", default="OSD-665")
+    parser.add_argument("--question", default="Which spaceflight group has the highest QA score?")
+    parser.add_argument("--start-server", action="store_true", help="start gunicorn and a fake Ollama first")
+    parser.add_argument("--port", type=int, default=8060, help="port for --start-server")
+    parser.add_argument("--first-token", type=float, default=0.5, help="fake Ollama seconds before the first token")
+    parser.add_argument("--per-token", type=float, default=0.02, help="fake Ollama seconds between tokens")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    server = None
+    if args.start_server:
+        args.workers = args.workers or 2
+        server = start_server(args.port, args.workers, args.first_token, args.per_token)
+        args.url = f"http://127.0.0.1:{args.port}"
+    try:
+        report = run(args.url, args.users, args.duration, args.iterations, args.workers,
+                     args.experiment, args.question)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Times the data-heavy code paths of the app on synthetic ISA tables of growing size.
+
+Model calls go to a deterministic fake Ollama server started in-process, so
+the numbers measure this app rather than the model. Results are written to
+JSON and compared against a stored baseline:
+
+    python -m bench.run                      # run, compare with bench/baseline.json
+    python -m bench.run --save-baseline      # run and store the results as the new baseline
+    python -m bench.run --sizes 100x30 --output results.json
+
+Timings depend on the machine, so the baseline is kept out of git; save one
+on the machine you compare on before making a change. The command exits
+with status 1 when a benchmark's fastest run is slower than the baseline's
+by more than the tolerance.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from bench import fake_ollama, synthetic
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_SIZES = ["100x30", "1000x50", "10000x100"]  # rows x columns of each table
+MIN_SECONDS = 0.2  # keep repeating a benchmark until it ran this long...
+MIN_REPEATS = 3
+MAX_REPEATS = 50  # ...but no more often than this
+
+
+def measure(fn):
+    """Runs fn repeatedly and returns timing statistics in milliseconds."""
+    fn()  # warm caches and lazy imports outside the measurement
+    times = []
+    started = time.perf_counter()
+    while len(times) < MIN_REPEATS or (time.perf_counter() - started < MIN_SECONDS and len(times) < MAX_REPEATS):
+        t = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t) * 1000)
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "repeats": len(times),
+    }
+
+
+def _summary_frames(assays, samples):
+    """Cleans the synthetic tables the way pages/summary.py cleans the experiment tables."""
+    import pandas as pd
+
+    assays = assays.copy()
+    assays["Parameter Value: rRNA Contamination"] = pd.to_numeric(
+        assays["Parameter Value: rRNA Contamination"].str.replace("percent", "", regex=False).str.strip(),
+        errors="coerce",
+    )
+    merged = pd.merge(assays, samples, on="Sample Name")
+    merged["Parameter Value: Body Weight upon Euthanasia"] = pd.to_numeric(
+        merged["Parameter Value: Body Weight upon Euthanasia"].str.replace("gram", "").str.strip(),
+        errors="coerce",
+    )
+    return assays, merged
+
+
+def benchmarks(rows, columns):
+    """The benchmarks for one table size as {name: zero-argument callable}."""
+    import dash_chart_editor as dce
+    import numpy as np
+    import pandas as pd
+
+    import figures
+    import group_stats
+    import llm
+    import scheduler
+    import utils
+    from autochart import NUMBER_WITH_UNIT
+    from pages import summary
+    from prompts import NASAExperimentSummary
+
+    assays = synthetic.assays(rows, columns)
+    samples = synthetic.samples(rows, columns)
+    merged = synthetic.merged(rows, columns)
+    clean_assays, clean_merged = _summary_frames(assays, samples)
+    upload = "data:text/csv;base64," + base64.b64encode(merged.to_csv(index=False).encode()).decode()
+    editor_figure = {
+        "data": [{
+            "type": "box",
+            "xsrc": "Factor Value: Spaceflight",
+            "ysrc": "Parameter Value: QA Score",
+            "x": merged["Factor Value: Spaceflight"].tolist(),
+            "y": merged["Parameter Value: QA Score"].tolist(),
+        }],
+        "layout": {"title": {"text": "QA Score by Spaceflight"}},
+    }
+    # A model answer wrapped in prose, with a protocol list that grows with the table
+    protocols = fake_ollama.SUMMARY["protocol"] * max(rows // 10, 1)
+    model_answer = fake_ollama.SUMMARY_ANSWER.replace(
+        json.dumps(fake_ollama.SUMMARY, indent=2), json.dumps({**fake_ollama.SUMMARY, "protocol": protocols}, indent=2)
+    )
+
+    scatter = summary.create_rrna_contamination_chart_665(clean_merged)
+    parameters = [c for c in merged.columns if c.startswith("Parameter Value:")]
+    numbers = np.column_stack([
+        pd.to_numeric(merged[c].str.extract(NUMBER_WITH_UNIT)[0], errors="coerce") for c in parameters
+    ])
+    flight = (merged["Factor Value: Spaceflight"] == "Space Flight").to_numpy()
+
+    def save_figure():
+        figure = dce.cleanDataFromFigure(json.loads(json.dumps(editor_figure)))
+        dce.chartToPython(figure, merged)
+
+    def parse_upload():
+        df = utils.parse_upload(upload)
+        df.to_dict("records"), df.to_dict("list")
+
+    return {
+        "generate_prompt": lambda: utils.generate_prompt(merged, "Which group has the highest QA score?"),
+        "update_output.parse": parse_upload,
+        "summary.create_body_weight_chart": lambda: summary.create_body_weight_chart(clean_merged),
+        "summary.create_rrna_contamination_chart_665": lambda: summary.create_rrna_contamination_chart_665(clean_merged),
+        "summary.create_habitat_chart": lambda: summary.create_habitat_chart(clean_merged),
+        "summary.create_violin": lambda: summary.create_violin(clean_merged),
+        "summary.create_avg_qa_score_chart": lambda: summary.create_avg_qa_score_chart(assays, samples),
+        "summary.create_rrna_contamination_chart": lambda: summary.create_rrna_contamination_chart(clean_assays, samples),
+        "summary.create_qa_score_by_age_chart": lambda: summary.create_qa_score_by_age_chart(assays, samples),
+        "figures.encode": lambda: figures.encode(scatter),
+        "group_stats.compare_groups": lambda: group_stats.compare_groups(numbers[flight], numbers[~flight]),
+        "save_figure.chartToPython": save_figure,
+        "clean_and_parse_json": lambda: NASAExperimentSummary("OSD-0").clean_and_parse_json(model_answer),
+        "llm.chat": lambda: llm.chat([{"role": "user", "content": "hello"}], priority=scheduler.INTERACTIVE),
+    }
+
+
+def run(sizes):
+    results = {}
+    for size in sizes:
+        rows, columns = (int(n) for n in size.split("x"))
+        for name, fn in benchmarks(rows, columns).items():
+            key = f"{name}[{size}]"
+            results[key] = measure(fn)
+            print(f"{key:<60} {results[key]['median_ms']:>10.2f} ms", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change of every benchmark against the baseline and returns the regressions."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        # The fastest run is the least disturbed by other load on the machine
+        ratio = result["min_ms"] / max(baseline[key]["min_ms"], 1e-6)
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        elif ratio < 1 - tolerance:
+            flag = "  faster"
+        print(f"{key:<60} {baseline[key]['min_ms']:>10.2f} -> {result['min_ms']:>10.2f} ms ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="table sizes as ROWSxCOLUMNS")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    # The app reads the Ollama hosts when its modules are imported
+    server = fake_ollama.serve()
+    os.environ["OLLAMA_HOSTS"] = f"127.0.0.1:{server.server_address[1]}"
+    import app  # noqa: F401, registers the pages the chart builders live in
+
+    results = run(args.sizes)
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+        },
+        "results": results,
+    }
+    with open(args.baseline if args.save_baseline else args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, store one with --save-baseline.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    print(f"\nCompared with {args.baseline}:")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
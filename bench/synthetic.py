@@ -0,0 +1,67 @@
+"""Synthetic OSD-style ISA tables for the benchmarks.
+
+The tables follow the layout of the OSD-665 assay and sample CSVs: a shared
+'Sample Name', experimental factors, protocol references, values with units
+such as '35.9 gram' and comma separated raw file lists. Extra 'Comment:'
+columns pad a table to the requested width. The same seed always gives the
+same tables.
+"""
+import numpy as np
+import pandas as pd
+
+SPACEFLIGHT = ["Space Flight", "Ground Control", "Vivarium Control", "Basal Control"]
+AGES = ["10 to 12 week", "32 week"]
+HABITATS = ["Rodent Flight Hardware (Transporter and Habitat)", "Vivarium Cage"]
+INSTRUMENTS = ["Agilent 4200 TapeStation", "Agilent 2100 Bioanalyzer"]
+SEQUENCERS = ["Illumina NovaSeq 6000", "Illumina HiSeq 4000"]
+
+
+def sample_names(rows):
+    return [f"RR_SYN_{SPACEFLIGHT[i % 4].split()[0].upper()}_S{i}" for i in range(rows)]
+
+
+def _pad(df, columns, rng):
+    for i in range(columns - len(df.columns)):
+        df[f"Comment: Extra {i}"] = rng.choice([f"value {j}" for j in range(8)], len(df))
+    return df
+
+
+def samples(rows, columns=27, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Source Name": [f"RR_SYN_{i // 2}" for i in range(rows)],
+        "Sample Name": sample_names(rows),
+        "Characteristics: Organism": "Mus musculus",
+        "Characteristics: Strain": "C57BL/6J",
+        "Factor Value: Spaceflight": [SPACEFLIGHT[i % 4] for i in range(rows)],
+        "Factor Value: Age": rng.choice(AGES, rows),
+        "Protocol REF": "Animal Husbandry",
+        "Parameter Value: habitat": rng.choice(HABITATS, rows),
+        "Parameter Value: duration": "38 day",
+        "Protocol REF.1": "sample collection",
+        "Parameter Value: Body Weight upon Euthanasia": [f"{w:.1f} gram" for w in rng.normal(30, 3, rows)],
+        "Comment: Euthanasia Date": rng.choice(["14-Jan-2021", "15-Jan-2021", "16-Jan-2021"], rows),
+    })
+    return _pad(df, columns, rng)
+
+
+def assays(rows, columns=27, seed=1):
+    rng = np.random.default_rng(seed)
+    names = sample_names(rows)
+    df = pd.DataFrame({
+        "Sample Name": names,
+        "Protocol REF": "nucleic acid extraction",
+        "Parameter Value: QA Instrument": rng.choice(INSTRUMENTS, rows),
+        "Parameter Value: QA Score": [f"{s:.1f} RINe" for s in rng.uniform(5, 10, rows)],
+        "Extract Name": names,
+        "Parameter Value: Library Batch Number": [f"LIB-BATCH-{b:03d}" for b in rng.integers(0, 40, rows)],
+        "Parameter Value: Sequencing Instrument": rng.choice(SEQUENCERS, rows),
+        "Raw Data File": [f"{n}_R1_raw.fastq.gz, {n}_R2_raw.fastq.gz" for n in names],
+        "Parameter Value: Read Depth": [f"{d} read" for d in rng.integers(20_000_000, 120_000_000, rows)],
+        "Parameter Value: rRNA Contamination": [f"{c:.2f} percent" for c in rng.uniform(0, 5, rows)],
+    })
+    return _pad(df, columns, rng)
+
+
+def merged(rows, columns=27):
+    return pd.merge(assays(rows, columns), samples(rows, columns), on="Sample Name")
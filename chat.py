@@ -0,0 +1,189 @@
+import json
+import logging
+import pickle
+
+import llm
+import query
+import scheduler
+from constants import (
+    chat_keep_alive,
+    chat_keep_recent,
+    chat_max_messages,
+    chat_session_ttl,
+    redis_instance,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+SESSION_KEY = "chat-session:{}"
+TRANSCRIPT_KEY = "chat-transcript:{}"
+MAX_TOOL_ROUNDS = 3  # queries the model may run before it has to answer
+
+SYSTEM_PROMPT = (
+    "You are a data analyst and chart design expert helping users build charts and answer "
+    "questions about arbitrary datasets. The user's questions will follow. Ensure you "
+    "answer each question accurately and given the context of the dataset. The user "
+    "will use the results of your commentary to work on a chart or to research the data "
+    "using Dash Chart Editor, a product built by Plotly. If the user's question doesn't "
+    " make sense, feel free to make a witty remark about Plotly and Dash. Your responses "
+    "should use Markdown markup. Limit each response to only 1-3 sentences. Address the "
+    "user directly as they can see your response."
+)
+
+DOCUMENTATION_PROMPT = (
+    "Excerpts from the experiment's documentation that may help with the question, "
+    "use them only if they are relevant:\n\n"
+)
+
+COMPACTION_PROMPT = (
+    "Summarize the following conversation between a user and a data analyst in a few "
+    "sentences. Keep every fact, number and column name that was mentioned, as the "
+    "summary will replace the conversation in the analyst's memory.\n\n"
+)
+
+
+class ChatSession:
+    """Server-side conversation for one user of the /ai page.
+
+    The dataset context is sent once as the leading system message and never
+    rewritten while the dataset stays the same, so Ollama can reuse the
+    evaluated prompt prefix and only process the newest question.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.data_version = None
+        self.context = ""
+        self.summary = None
+        self.messages = []
+
+    @classmethod
+    def load(cls, session_id):
+        """Loads a session from Redis, or starts an empty one."""
+        try:
+            stored = redis_instance.get(SESSION_KEY.format(session_id))
+        except Exception as e:
+            logging.error(f"Error loading chat session {session_id}: {e}")
+            stored = None
+        if stored:
+            return pickle.loads(stored)
+        return cls(session_id)
+
+    def save(self):
+        try:
+            redis_instance.set(
+                SESSION_KEY.format(self.session_id), pickle.dumps(self), ex=chat_session_ttl
+            )
+        except Exception as e:
+            logging.error(f"Error saving chat session {self.session_id}: {e}")
+
+    def set_context(self, context, data_version):
+        """Starts a fresh conversation when the dataset behind the session changed."""
+        if data_version == self.data_version:
+            return
+        self.data_version = data_version
+        self.context = context
+        self.summary = None
+        self.messages = []
+
+    def build_messages(self):
+        messages = [{"role": "system", "content": f"{SYSTEM_PROMPT}\n\nContext:\n\n{self.context}"}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Conversation so far: {self.summary}"})
+        return messages + self.messages
+
+    def ask(self, question, cancel=None, data=None, passages=()):
+        """Sends the question with the session history and records the answer.
+
+        When `data` is given the model may call the query tool, whose queries
+        run on that DataFrame. `passages` are retrieved documentation chunks
+        for this question. Like the tool calls and their results they are
+        only sent for this question and are not kept in the history.
+        """
+        self.messages.append({"role": "user", "content": question})
+        messages = self.build_messages()
+        if passages:
+            documentation = "\n\n".join(f"[{p['experiment']}, {p['source']}] {p['text']}" for p in passages)
+            messages[-1] = {"role": "user", "content": f"{question}\n\n{DOCUMENTATION_PROMPT}{documentation}"}
+        try:
+            for round_ in range(MAX_TOOL_ROUNDS + 1):
+                # The last round has no tools so the model has to answer
+                tools = [query.QUERY_TOOL] if data is not None and round_ < MAX_TOOL_ROUNDS else None
+                completion = llm.chat(
+                    messages=messages,
+                    priority=scheduler.INTERACTIVE,
+                    cancel=cancel,
+                    keep_alive=chat_keep_alive,
+                    tools=tools,
+                )
+                tool_calls = completion["message"].get("tool_calls")
+                if not tools or not tool_calls:
+                    break
+
+                messages.append(completion["message"])
+                for call in tool_calls:
+                    arguments = call.function.arguments
+                    if isinstance(arguments, str):
+                        arguments = json.loads(arguments)
+                    logging.info(f"Running query for chat session {self.session_id}: {arguments}")
+                    messages.append({
+                        "role": "tool",
+                        "tool_name": call.function.name,
+                        "content": query.run_tool_call(data, arguments),
+                    })
+        except Exception:
+            self.messages.pop()
+            raise
+        answer = completion["message"]["content"]
+        self.messages.append({"role": "assistant", "content": answer})
+
+        if len(self.messages) > chat_max_messages:
+            self.compact()
+        return answer
+
+    def compact(self):
+        """Folds the oldest messages into a running summary to bound the history."""
+        older = self.messages[:-chat_keep_recent]
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in older)
+        if self.summary:
+            transcript = f"Earlier summary: {self.summary}\n{transcript}"
+
+        try:
+            completion = llm.chat(
+                messages=[{"role": "user", "content": COMPACTION_PROMPT + transcript}],
+                priority=scheduler.INTERACTIVE,
+                keep_alive=chat_keep_alive,
+            )
+        except Exception as e:
+            # Keep the full history and try again after the next question
+            logging.error(f"Error while compacting chat session {self.session_id}: {e}")
+            return
+
+        self.summary = completion["message"]["content"]
+        self.messages = self.messages[-chat_keep_recent:]
+        logging.info(f"Compacted chat session {self.session_id} to {len(self.messages)} messages.")
+
+
+def record_exchange(session_id, question, answer):
+    """Appends a question and its answer to the transcript shown in the chat window."""
+    key = TRANSCRIPT_KEY.format(session_id)
+    try:
+        redis_instance.rpush(key, json.dumps([question, answer]))
+        redis_instance.expire(key, chat_session_ttl)
+    except Exception as e:
+        logging.error(f"Error saving chat transcript {session_id}: {e}")
+
+
+def load_exchanges(session_id, skip, count):
+    """Returns up to `count` exchanges, newest first, after skipping the `skip` newest ones.
+
+    Also returns whether older exchanges remain.
+    """
+    key = TRANSCRIPT_KEY.format(session_id)
+    try:
+        total = redis_instance.llen(key)
+        stored = redis_instance.lrange(key, -(skip + count), -(skip + 1)) if skip < total else []
+    except Exception as e:
+        logging.error(f"Error loading chat transcript {session_id}: {e}")
+        return [], False
+    return [json.loads(exchange) for exchange in reversed(stored)], skip + count < total
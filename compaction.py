@@ -0,0 +1,58 @@
+import pandas as pd
+
+MAX_CATEGORY_SHARE = 0.5  # text columns with at most this share of distinct values become categoricals
+MULTI_VALUE_SEPARATOR = ","
+FILE_COLUMN_MARKER = "File"  # 'Raw Data File', 'Parameter Value: MultiQC File Names', ...
+
+
+def memory_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def compact(df):
+    """Returns a copy of a table with repetitive text as categoricals and integers downcast.
+
+    ISA tables repeat the same protocol, instrument and batch names on every
+    row, so a categorical stores each of them once. Floats are left as they
+    are, since float32 would change the values shown to users.
+    """
+    df = df.copy()
+    limit = MAX_CATEGORY_SHARE * len(df)
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_integer_dtype(series):
+            df[column] = pd.to_numeric(series, downcast="integer")
+        elif not pd.api.types.is_numeric_dtype(series) and series.nunique() <= limit:
+            df[column] = series.astype("category")
+    return df
+
+
+def split_multi_value(df, key="Sample Name"):
+    """Moves file columns holding comma separated lists into a long (key, column, file) table.
+
+    Returns the table with each of those columns replaced by the number of
+    files it listed ('Raw Data File' becomes 'Raw Data File count'), and the
+    file table, which has one row per file instead of one long string per
+    sample.
+    """
+    columns = [
+        c for c in df.columns
+        if FILE_COLUMN_MARKER in c and df[c].astype("string").str.contains(MULTI_VALUE_SEPARATOR, regex=False).any()
+    ]
+    if not columns or key not in df.columns:
+        return df, pd.DataFrame({key: pd.Series(dtype="string"), "Column": [], "File": []})
+
+    files = (
+        df[[key] + columns]
+        .melt(id_vars=key, var_name="Column", value_name="File")
+        .dropna(subset=["File"])
+    )
+    files["File"] = files["File"].astype("string").str.split(MULTI_VALUE_SEPARATOR)
+    files = files.explode("File", ignore_index=True)
+    files["File"] = files["File"].str.strip()
+    files["Column"] = files["Column"].astype("category")
+
+    df = df.copy()
+    for column in columns:
+        df[column] = (df[column].astype("string").str.count(MULTI_VALUE_SEPARATOR) + 1).fillna(0).astype(int)
+    return df.rename(columns={c: f"{c} count" for c in columns}), files
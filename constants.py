@@ -1,11 +1,64 @@
 import os
 
-import redis
+from metrics import InstrumentedRedis
 
-redis_instance = redis.StrictRedis.from_url(
+redis_instance = InstrumentedRedis.from_url(
     os.environ.get("REDIS_URL", "redis://127.0.0.1:6379")
 )
 
 ollama_port = "11434"
 ollama_url = "127.0.0.1:11434"
-ollama_model = "llama3.1"
\ No newline at end of file
+ollama_model = "llama3.1"
+
+# LLM gateway, OLLAMA_HOSTS is a comma separated list of backends to balance across
+ollama_hosts = os.environ.get("OLLAMA_HOSTS", ollama_url).split(",")
+llm_backend_concurrency = int(os.environ.get("OLLAMA_BACKEND_CONCURRENCY", "2"))  # requests per backend, all workers together
+llm_timeout = float(os.environ.get("OLLAMA_TIMEOUT", "120"))
+llm_health_interval = 15
+llm_eject_seconds = 30
+
+# Model residency: the model is preloaded at startup and kept loaded while users are active
+llm_keep_alive = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+llm_warm_interval = 240  # seconds between keep-alive refreshes
+llm_traffic_window = int(os.environ.get("OLLAMA_TRAFFIC_WINDOW", "1800"))  # seconds a call counts as recent traffic
+
+# LLM scheduling, indexed by priority class (interactive chat, view summary, batch)
+llm_queue_limits = [16, 8, 4]  # queued requests of the same or higher priority before answering busy
+llm_deadlines = [60, 120, 600]  # seconds
+
+# Single-flight coalescing of identical concurrent calls
+singleflight_lock_ttl = 600  # longest a computation may hold its key, in seconds
+singleflight_result_ttl = 30  # how long waiters can still pick up a finished result
+
+# Retrieval of experiment descriptions and protocols for the chat
+embedding_model = os.environ.get("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+vector_index_dir = os.environ.get("VECTOR_INDEX_DIR", "data/cache/vectors")
+retrieval_top_k = 4
+retrieval_min_score = 0.3  # cosine similarity below which a chunk is not worth the prompt space
+retrieval_refresh_interval = 60  # seconds between checks of the catalog and investigation files for changes
+
+# Chat sessions
+chat_keep_alive = llm_keep_alive
+chat_max_messages = 20  # compact the history once it grows past this many messages
+chat_keep_recent = 6  # messages left verbatim after a compaction
+chat_session_ttl = 60 * 60 * 24
+
+# Dataset workspace
+workspace_dir = os.environ.get("WORKSPACE_DIR", "data/cache/workspace")
+workspace_memory_budget = int(os.environ.get("WORKSPACE_MEMORY_BUDGET", 512 * 1024 * 1024))  # bytes per process
+
+# Arrow copies of the ISA tables, memory-mapped and shared by all workers
+arrow_cache_dir = os.environ.get("ARROW_CACHE_DIR", "data/cache/arrow")
+
+# Serialized figures, shared by the workers through Redis
+figure_cache_ttl = int(os.environ.get("FIGURE_CACHE_TTL", 60 * 60 * 24))  # seconds an unused figure is kept
+# Saved figures and shared links, kept while they are used
+shared_view_ttl = int(os.environ.get("SHARED_VIEW_TTL", 60 * 60 * 24 * 30))  # seconds since a link was last opened
+
+# Fingerprinted and precompressed front-end files
+static_dir = os.environ.get("STATIC_DIR", "data/cache/static")
+
+# Request profiling, off unless a token is set to switch it on and read the reports
+profile_token = os.environ.get("PROFILE_TOKEN")
+profile_ttl = int(os.environ.get("PROFILE_TTL", 60 * 60 * 24))  # seconds a profile is kept
+profile_keep = 100  # profiles listed by /admin/profiles
@@ -0,0 +1,234 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import secrets
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+import experiments
+import query
+import workspace
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10_000
+CHUNK_ROWS = 500  # rows per NDJSON write or Arrow record batch
+BROWSER_COOKIE = "browser"  # proves a ?session= belongs to the caller, see workspace.claim
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+blueprint = Blueprint("data_api", __name__, url_prefix="/api")
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+@blueprint.errorhandler(ApiError)
+def api_error(e):
+    return jsonify({"error": str(e)}), e.status
+
+
+@blueprint.errorhandler(query.QueryError)
+def query_error(e):
+    return jsonify({"error": str(e)}), 400
+
+
+@blueprint.after_app_request
+def issue_browser_cookie(response):
+    # Given with the page, before the app's callbacks claim the session for this browser
+    if BROWSER_COOKIE not in request.cookies and response.mimetype == "text/html":
+        response.set_cookie(
+            BROWSER_COOKIE, secrets.token_urlsafe(32), httponly=True, samesite="Lax", secure=request.is_secure,
+        )
+    return response
+
+
+def _session():
+    """The ?session= whose uploads the caller may read, which must have been claimed by the caller's browser."""
+    session_id = request.args.get("session")
+    if session_id and not workspace.owns(session_id, request.cookies.get(BROWSER_COOKIE)):
+        raise ApiError("The session belongs to a different browser.", status=403)
+    return session_id
+
+
+def _dataset_id(name):
+    """Looks up a dataset by name among the experiments and the caller's session uploads."""
+    dataset_id = workspace.datasets(_session()).get(name)
+    if dataset_id is None:
+        raise ApiError(f"Unknown dataset: {name!r}.", status=404)
+    return dataset_id
+
+
+def _dataset(name):
+    dataset_id = _dataset_id(name)
+    return dataset_id, workspace.load(dataset_id)
+
+
+def _format():
+    output = request.args.get("format", "ndjson")
+    if output not in FORMATS:
+        raise ApiError(f"Unknown format: {output!r}, use one of {', '.join(FORMATS)}.")
+    return output
+
+
+def _spec(df):
+    """Reads the projection, filter and sort from the query string, validated like a chat query."""
+    try:
+        filters = json.loads(request.args.get("filter", "[]"))
+    except json.JSONDecodeError:
+        filters = None
+    if not isinstance(filters, list) or not all(isinstance(condition, dict) for condition in filters):
+        raise ApiError("The filter must be a JSON list of {column, op, value} conditions.")
+    columns = [c for c in request.args.get("columns", "").split(",") if c]
+    sort = request.args.get("sort")
+    spec = query.validate({
+        "filter": filters,
+        "columns": columns,
+        "sort": {"column": sort, "descending": request.args.get("descending") == "true"} if sort else None,
+    }, set(df.columns))
+    if spec["sort"] and spec["sort"]["column"] not in df.columns:
+        raise ApiError(f"Unknown sort column: {spec['sort']['column']!r}.")
+    return spec
+
+
+def _fingerprint(dataset_id, spec):
+    # A cursor is only valid for the dataset and query it was issued for
+    return hashlib.sha1(json.dumps([dataset_id, spec], sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _encode_cursor(fingerprint, offset):
+    return base64.urlsafe_b64encode(json.dumps({"q": fingerprint, "o": offset}).encode()).decode()
+
+
+def _decode_cursor(cursor, fingerprint):
+    if not cursor:
+        return 0
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        offset = int(decoded["o"])
+    except (ValueError, KeyError, TypeError):
+        raise ApiError("Invalid cursor.")
+    if decoded.get("q") != fingerprint or offset < 0:
+        raise ApiError("The cursor belongs to a different dataset or query.")
+    return offset
+
+
+def _page_size():
+    try:
+        size = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ApiError("The limit must be an integer.")
+    if size < 1:
+        raise ApiError("The limit must be a positive integer.")
+    return min(size, MAX_PAGE_SIZE)
+
+
+def _ndjson(page):
+    for start in range(0, len(page), CHUNK_ROWS):
+        yield page.iloc[start:start + CHUNK_ROWS].to_json(orient="records", lines=True, date_format="iso")
+
+
+class _Chunks(io.RawIOBase):
+    """Write target that hands the Arrow stream out in pieces as it is written."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def _arrow(page):
+    table = pa.Table.from_pandas(page, preserve_index=False)
+    sink = _Chunks()
+    with pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=CHUNK_ROWS):
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+@blueprint.route("/datasets")
+def list_datasets():
+    """Datasets the caller can read: the experiments plus the uploads of ?session=."""
+    return jsonify([{"name": name, "id": dataset_id} for name, dataset_id in workspace.datasets(_session()).items()])
+
+
+@blueprint.route("/datasets/<name>/schema")
+def dataset_schema(name):
+    _, df = _dataset(name)
+    return jsonify({
+        "rows": len(df),
+        "columns": [{"name": c, "dtype": str(t)} for c, t in df.dtypes.items()],
+    })
+
+
+@blueprint.route("/datasets/<name>/rows")
+def dataset_rows(name):
+    """Streams one page of a dataset as NDJSON (default) or an Arrow IPC stream.
+
+    Query parameters: columns (comma separated), filter (JSON list of
+    {column, op, value} with the chat query operators), sort, descending,
+    limit and cursor. The cursor of the next page, if any, is returned in the
+    X-Next-Cursor header along with the total in X-Total-Rows.
+    """
+    output = _format()
+    dataset_id, df = _dataset(name)
+    spec = _spec(df)
+    fingerprint = _fingerprint(dataset_id, spec)
+    offset = _decode_cursor(request.args.get("cursor"), fingerprint)
+    size = _page_size()
+
+    rows = query.filter_rows(df, spec["filter"])
+    if spec["sort"]:
+        rows = rows.sort_values(spec["sort"]["column"], ascending=not spec["sort"]["descending"], kind="stable")
+    page = rows.iloc[offset:offset + size]
+    if spec["columns"]:
+        page = page[spec["columns"]]
+
+    headers = {"X-Total-Rows": str(len(rows))}
+    if offset + size < len(rows):
+        headers["X-Next-Cursor"] = _encode_cursor(fingerprint, offset + size)
+    body = _arrow(page) if output == "arrow" else _ndjson(page)
+    return Response(stream_with_context(body), mimetype=FORMATS[output], headers=headers)
+
+
+@blueprint.route("/datasets/<name>/files")
+def dataset_files(name):
+    """Streams the files listed in an experiment's ISA tables as NDJSON (default) or an Arrow IPC stream.
+
+    One {Sample Name, Column, File} row per file of the multi-value columns
+    such as 'Raw Data File', which the rows only give as per-sample counts.
+    ?sample= keeps the files of one sample. Uploads list no files.
+    """
+    output = _format()
+    dataset_id = _dataset_id(name)
+    if dataset_id.startswith(workspace.EXPERIMENT_PREFIX):
+        files = experiments.load_files(dataset_id[len(workspace.EXPERIMENT_PREFIX):])
+    else:
+        files = pd.DataFrame({"Sample Name": [], "Column": [], "File": []}, dtype="string")
+    sample = request.args.get("sample")
+    if sample is not None:
+        files = files[files["Sample Name"].astype("string") == sample]
+    body = _arrow(files) if output == "arrow" else _ndjson(files)
+    return Response(stream_with_context(body), mimetype=FORMATS[output], headers={"X-Total-Rows": str(len(files))})
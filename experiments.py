@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+
+import compaction
+from constants import arrow_cache_dir
+
+logging.basicConfig(level=logging.INFO)
+
+JSON_FILE_PATH = os.getenv('DATA_JSON_PATH', 'data/data.json')  # Use environment variable for the JSON file path
+CACHE_VERSION = 3  # bump when the stored layout changes, so stale conversions are rebuilt
+
+
+def load_catalog():
+    """Loads the experiment catalog, keyed by 'Experiment <OSD id>'."""
+    with open(JSON_FILE_PATH) as json_file:
+        return json.load(json_file)
+
+
+def table_paths(experiment_id, catalog=None):
+    """Returns the (assays, samples) CSV paths of an experiment, or None when it has no local tables."""
+    catalog = catalog or load_catalog()
+    experiment = catalog.get(f"Experiment {experiment_id}", {})
+    assays = experiment.get("csv_path")
+    if not assays:
+        return None
+    samples = assays.replace("-assays.csv", "-samples.csv")
+    if not (os.path.exists(assays) and os.path.exists(samples)):
+        return None
+    return assays, samples
+
+
+def available_experiments():
+    """OSD ids of the catalog experiments whose ISA tables are on disk."""
+    catalog = load_catalog()
+    return [e["value"] for e in catalog.values() if table_paths(e["value"], catalog)]
+
+
+def _arrow_path(csv_path, suffix=""):
+    name = os.path.basename(csv_path).replace(".csv", f"{suffix}.v{CACHE_VERSION}.arrow")
+    return os.path.join(arrow_cache_dir, name)
+
+
+def write_arrow(df, arrow_path, metadata):
+    """Writes a frame as an uncompressed Arrow IPC file, renamed into place so readers never see half a file."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, **metadata})
+    tmp_path = f"{arrow_path}.{os.getpid()}.tmp"
+    with pa.ipc.new_file(tmp_path, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, arrow_path)
+
+
+def _convert(csv_path):
+    """Parses a CSV, compacts it and stores the table and its file list as Arrow files."""
+    df = pd.read_csv(csv_path)
+    before = compaction.memory_bytes(df)
+    df, files = compaction.split_multi_value(df)
+    df, files = compaction.compact(df), compaction.compact(files)
+    after = compaction.memory_bytes(df) + compaction.memory_bytes(files)
+    metadata = {"before_bytes": str(before), "after_bytes": str(after)}
+
+    os.makedirs(arrow_cache_dir, exist_ok=True)
+    write_arrow(files, _arrow_path(csv_path, "-files"), metadata)
+    write_arrow(df, _arrow_path(csv_path), metadata)
+    logging.info(f"Converted {csv_path}, {before / 1e3:.1f} KB -> {after / 1e3:.1f} KB in memory.")
+
+
+def map_arrow(arrow_path):
+    # The mapping stays open for as long as the returned table references it
+    return pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+
+
+def read_arrow(csv_path, suffix=""):
+    """Returns the memory-mapped Arrow table of an ISA CSV, converting it first when needed."""
+    arrow_path = _arrow_path(csv_path, suffix)
+    if not os.path.exists(arrow_path) or os.path.getmtime(arrow_path) < os.path.getmtime(csv_path):
+        _convert(csv_path)
+    return map_arrow(arrow_path)
+
+
+def read_table(csv_path):
+    """Reads an ISA table through its memory-mapped Arrow copy.
+
+    The CSV is parsed once and converted, again whenever it is newer than the
+    Arrow file. The Arrow file is mapped rather than read, so numeric columns
+    point into the OS page cache, which every worker process shares, instead
+    of each worker holding its own parsed copy. Repetitive text comes back as
+    categoricals, and multi-value file columns as per-sample file counts, the
+    files themselves being in read_files.
+    """
+    return read_arrow(csv_path).to_pandas(split_blocks=True)
+
+
+def read_files(csv_path):
+    """Returns the files listed in an ISA table, one (Sample Name, Column, File) row per file."""
+    return read_arrow(csv_path, "-files").to_pandas(split_blocks=True)
+
+
+def load_assays(experiment_id):
+    return read_table(table_paths(experiment_id)[0])
+
+
+def load_samples(experiment_id):
+    return read_table(table_paths(experiment_id)[1])
+
+
+def load_files(experiment_id):
+    return pd.concat([read_files(path) for path in table_paths(experiment_id)], ignore_index=True)
+
+
+def describe_files(experiment_id, examples=3):
+    """The files listed in an experiment's ISA tables, summarized per column as text for the model's context."""
+    files = load_files(experiment_id)
+    if files.empty:
+        return ""
+    lines = [f"Files listed in the ISA tables of {experiment_id} (the tables only count them per sample):"]
+    for column, listed in files.groupby("Column", observed=True):
+        names = ", ".join(listed["File"].head(examples))
+        lines.append(
+            f"- {column}: {len(listed)} files for {listed['Sample Name'].nunique()} samples, e.g. {names}"
+        )
+    return "\n".join(lines)
+
+
+def version(experiment_id):
+    """A string that changes whenever the ISA tables of an experiment do."""
+    return "-".join(f"{os.stat(path).st_mtime_ns:x}" for path in table_paths(experiment_id))
+
+
+def load_merged(experiment_id):
+    """Joins the assay and sample tables of an experiment on 'Sample Name', through a cached Arrow file.
+
+    The join is stored as its own Arrow file, rebuilt when either table
+    changes, and mapped like the tables themselves, so the numeric columns
+    of the frame the app works on point into the shared page cache.
+    Categorical and text columns are still copied into each process by
+    to_pandas; those pages are shared only when the frame was loaded before
+    the workers forked (see workspace.preload).
+    """
+    arrow_path = os.path.join(arrow_cache_dir, f"{experiment_id}-merged.v{CACHE_VERSION}.arrow")
+    current = version(experiment_id)
+    if os.path.exists(arrow_path):
+        table = map_arrow(arrow_path)
+        if table.schema.metadata.get(b"version", b"").decode() == current:
+            return table.to_pandas(split_blocks=True)
+    merged = pd.merge(load_assays(experiment_id), load_samples(experiment_id), on='Sample Name')
+    os.makedirs(arrow_cache_dir, exist_ok=True)
+    write_arrow(merged, arrow_path, {"version": current})
+    return map_arrow(arrow_path).to_pandas(split_blocks=True)
+
+
+def memory_report():
+    """Memory of every ISA table as parsed from CSV and after compaction, in bytes."""
+    rows = []
+    for experiment_id in available_experiments():
+        for csv_path in table_paths(experiment_id):
+            metadata = read_arrow(csv_path).schema.metadata
+            rows.append({
+                "experiment": experiment_id,
+                "table": os.path.basename(csv_path),
+                "before_bytes": int(metadata[b"before_bytes"]),
+                "after_bytes": int(metadata[b"after_bytes"]),
+            })
+    return pd.DataFrame(rows)
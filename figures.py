@@ -0,0 +1,182 @@
+"""Figures encoded once, with binary typed arrays, and served as stored bytes.
+
+Plotly.js reads numeric arrays sent as base64 typed arrays
+({"dtype": "f8", "bdata": ...}), which are a fraction of the size of JSON
+lists of floats and far quicker to encode. encode() turns a figure into
+such JSON with orjson. store() keeps the bytes in Redis under an id derived
+from their content, /figures/<id> serves them as they are, and graph()
+renders a dcc.Graph that fetches its figure from there, so a callback
+response carries a URL instead of the figure and browsers cache the figure
+like any static file.
+"""
+import base64
+import functools
+import hashlib
+import logging
+import marshal
+import uuid
+
+import numpy as np
+import orjson
+import pandas as pd
+from dash import MATCH, Input, Output, clientside_callback, dcc, html
+from flask import Blueprint, Response, abort, request
+from plotly.utils import PlotlyJSONEncoder
+
+from constants import figure_cache_ttl, redis_instance
+
+logging.basicConfig(level=logging.INFO)
+
+FIGURE_KEY = "figure:{}"
+BUILT_KEY = "figure:built:{}"
+MIN_TYPED_LENGTH = 8  # shorter numeric lists stay plain, base64 would not make them smaller
+SKIPPED_KEYS = {"geojson", "layer", "layers", "range"}  # plotly.js does not accept typed arrays there
+TYPED_DTYPES = {
+    "int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2",
+    "int32": "i4", "uint32": "u4", "float32": "f4", "float64": "f8",
+}
+
+blueprint = Blueprint("figures", __name__, url_prefix="/figures")
+
+# Local memo of build keys to figure ids, checked against Redis before use
+_built = {}
+
+
+def _typed(values):
+    """A numeric array as a plotly.js typed array spec, anything else as a list."""
+    array = np.asarray(values)
+    if array.dtype.kind in "iu" and array.dtype.itemsize == 8 and array.size:
+        # plotly.js has no 64-bit integer arrays
+        fits = np.iinfo(np.int32).min <= array.min() and array.max() <= np.iinfo(np.int32).max
+        array = array.astype(np.int32 if fits else np.float64)
+    dtype = TYPED_DTYPES.get(str(array.dtype))
+    if dtype is None or not array.size:
+        return array.tolist()
+    spec = {"dtype": dtype, "bdata": base64.b64encode(np.ascontiguousarray(array)).decode("ascii")}
+    if array.ndim > 1:
+        spec["shape"] = ", ".join(str(n) for n in array.shape)
+    return spec
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _prepare(obj):
+    if isinstance(obj, dict):
+        return {k: v if k in SKIPPED_KEYS else _prepare(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        if len(obj) >= MIN_TYPED_LENGTH and _is_number(obj[0]):
+            array = np.asarray(obj)
+            if array.dtype.kind in "iuf":
+                return _typed(array)
+        return [_prepare(v) for v in obj]
+    if isinstance(obj, (pd.Series, pd.Index)):
+        obj = obj.to_numpy()
+    if isinstance(obj, np.ndarray):
+        return _typed(obj) if obj.dtype.kind in "iuf" else _prepare(obj.tolist())
+    return obj
+
+
+def _default(obj):
+    # Timestamps, decimals and the other values plotly knows how to write
+    return PlotlyJSONEncoder().default(obj)
+
+
+def encode(figure):
+    """Serializes a figure (a plotly Figure or a figure dict) to JSON bytes with typed arrays."""
+    if hasattr(figure, "to_plotly_json"):
+        figure = figure.to_plotly_json()
+    return orjson.dumps(
+        _prepare(figure), default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def _decode(obj):
+    if isinstance(obj, dict):
+        if "bdata" in obj and "dtype" in obj:
+            array = np.frombuffer(base64.b64decode(obj["bdata"]), dtype=np.dtype(obj["dtype"]))
+            if "shape" in obj:
+                array = array.reshape([int(n) for n in str(obj["shape"]).split(",")])
+            return array.tolist()
+        return {k: _decode(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_decode(v) for v in obj]
+    return obj
+
+
+def plain(figure):
+    """A figure dict with its typed arrays turned back into lists, for reading rather than drawing."""
+    return _decode(figure)
+
+
+def store(figure, ttl=figure_cache_ttl):
+    """Encodes and stores a figure, returning its id; the same figure always gets the same id."""
+    data = encode(figure)
+    figure_id = hashlib.sha1(data).hexdigest()
+    redis_instance.set(FIGURE_KEY.format(figure_id), data, ex=ttl)
+    return figure_id
+
+
+@functools.cache
+def _code_version(build):
+    # Editing a builder changes its code object, so its old figures are not reused
+    return hashlib.sha1(marshal.dumps(build.__code__)).hexdigest()[:12]
+
+
+def cached(key, build, *args, **kwargs):
+    """Returns the id of the stored figure build(*args, **kwargs), building it only when needed.
+
+    `key` must change whenever the data behind the figure does. The figure is
+    shared by all workers through Redis and rebuilt once it has expired.
+    """
+    key = f"{build.__module__}.{build.__qualname__}:{_code_version(build)}:{key}"
+    figure_id = _built.get(key) or redis_instance.get(BUILT_KEY.format(key))
+    if isinstance(figure_id, bytes):
+        figure_id = figure_id.decode()
+    if figure_id and redis_instance.expire(FIGURE_KEY.format(figure_id), figure_cache_ttl):
+        _built[key] = figure_id
+        return figure_id
+
+    figure_id = store(build(*args, **kwargs))
+    redis_instance.set(BUILT_KEY.format(key), figure_id, ex=figure_cache_ttl)
+    _built[key] = figure_id
+    return figure_id
+
+
+def graph(figure_id, **props):
+    """A dcc.Graph that loads the stored figure from /figures/<id> once it is on the page."""
+    index = str(uuid.uuid4())
+    return html.Div([
+        dcc.Store(id={"type": "figure-source", "index": index}, data=f"{blueprint.url_prefix}/{figure_id}"),
+        dcc.Graph(id={"type": "figure-graph", "index": index}, **props),
+    ])
+
+
+clientside_callback(
+    """
+    function(url) {
+        if (!url) {
+            return window.dash_clientside.no_update;
+        }
+        return fetch(url).then(function(response) {
+            return response.ok ? response.json() : window.dash_clientside.no_update;
+        });
+    }
+    """,
+    Output({"type": "figure-graph", "index": MATCH}, "figure"),
+    Input({"type": "figure-source", "index": MATCH}, "data"),
+)
+
+
+@blueprint.route("/<figure_id>")
+def serve(figure_id):
+    # An id always names the same bytes, so a browser that has them may keep them forever
+    headers = {"ETag": f'"{figure_id}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    # Compression appends the encoding to the ETag, as in "<id>:br"
+    if any(tag.split(":")[0] == figure_id for tag in request.if_none_match):
+        return Response(status=304, headers=headers)
+    data = redis_instance.get(FIGURE_KEY.format(figure_id))
+    if data is None:
+        abort(404)
+    return Response(data, mimetype="application/json", headers=headers)
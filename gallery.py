@@ -0,0 +1,92 @@
+import json
+import logging
+import pickle
+import uuid
+
+import orjson
+
+import figures
+from constants import chat_session_ttl, redis_instance, shared_view_ttl
+
+logging.basicConfig(level=logging.INFO)
+
+FIGURE_KEY = figures.FIGURE_KEY
+GALLERY_KEY = "gallery:{}"  # a session's saved figures, kept as long as the session
+SHARE_KEY = "share:{}"  # a shared link and its figures, kept until it goes unopened for shared_view_ttl
+
+
+def add_figure(session_id, figure):
+    """Stores a saved figure and appends it to the session's gallery, returning its id and the gallery size."""
+    figure_id = str(uuid.uuid4())
+    pipe = redis_instance.pipeline()
+    pipe.set(FIGURE_KEY.format(figure_id), figures.encode(figure), ex=shared_view_ttl)
+    pipe.rpush(GALLERY_KEY.format(session_id), figure_id)
+    pipe.expire(GALLERY_KEY.format(session_id), chat_session_ttl)
+    return figure_id, pipe.execute()[1]
+
+
+def share(session_id):
+    """Snapshots the ids of the session's saved figures under a new share id."""
+    figure_ids = [i.decode() for i in redis_instance.lrange(GALLERY_KEY.format(session_id), 0, -1)]
+    share_id = str(uuid.uuid4())
+    redis_instance.set(SHARE_KEY.format(share_id), json.dumps(figure_ids), ex=shared_view_ttl)
+    _renew(share_id, figure_ids)
+    return share_id
+
+
+def _renew(share_id, figure_ids):
+    # The figures of a link have to live as long as the link itself
+    pipe = redis_instance.pipeline()
+    pipe.expire(SHARE_KEY.format(share_id), shared_view_ttl)
+    for figure_id in figure_ids:
+        pipe.expire(FIGURE_KEY.format(figure_id), shared_view_ttl)
+    pipe.execute()
+
+
+def session_figure_ids(session_id):
+    """Returns the ids of the session's saved figures, which /figures/<id> serves."""
+    redis_instance.expire(GALLERY_KEY.format(session_id), chat_session_ttl)
+    return [i.decode() for i in redis_instance.lrange(GALLERY_KEY.format(session_id), 0, -1)]
+
+
+def session_figures(session_id):
+    """Returns the session's saved figures as Plotly figure dicts."""
+    return load_figures(session_figure_ids(session_id))
+
+
+def shared_figure_ids(share_id):
+    """Returns the ids of the figures behind a shared link, or None for a link from before the gallery.
+
+    Opening a link keeps it and its figures for another shared_view_ttl.
+    """
+    figure_ids = redis_instance.get(SHARE_KEY.format(share_id))
+    if figure_ids is None:
+        return None
+    figure_ids = json.loads(figure_ids)
+    _renew(share_id, figure_ids)
+    return figure_ids
+
+
+def shared_figures(share_id):
+    """Returns the figures behind a shared link as Plotly figure dicts."""
+    figure_ids = shared_figure_ids(share_id)
+    if figure_ids is None:
+        return _legacy_shared_figures(share_id)
+    return load_figures(figure_ids)
+
+
+def load_figures(figure_ids):
+    if not figure_ids:
+        return []
+    stored = redis_instance.mget([FIGURE_KEY.format(i) for i in figure_ids])
+    return [orjson.loads(figure) for figure in stored if figure is not None]
+
+
+def _legacy_shared_figures(share_id):
+    """Reads links created before the gallery, which pickled the whole rendered layout."""
+    layout = redis_instance.get(share_id)
+    if layout is None:
+        logging.error(f"Shared layout {share_id} not found.")
+        return []
+    layout = pickle.loads(layout)
+    return [i["props"]["children"][0]["props"]["figure"] for i in layout[1:]]
@@ -0,0 +1,197 @@
+import glob
+import itertools
+import logging
+import os
+import re
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import experiments
+from constants import arrow_cache_dir
+from sample_store import store
+
+logging.basicConfig(level=logging.INFO)
+
+STATS_VERSION = 1  # bump when the tests change, so stored results are recomputed
+MIN_GROUP_SIZE = 3  # samples with a value each group needs before it is compared
+FDR_LEVEL = 0.05
+FLIGHT_LEVEL = re.compile(r"flight", re.IGNORECASE)  # compared first, so differences read flight - ground
+COLUMNS = [
+    "experiment", "factor", "parameter", "unit", "group_a", "group_b", "n_a", "n_b",
+    "mean_a", "mean_b", "difference", "hedges_g", "rank_biserial",
+    "welch_p", "mannwhitney_p", "welch_q", "mannwhitney_q",
+]
+
+
+def compare_groups(a, b):
+    """Welch's t-test, the Mann-Whitney U test and effect sizes of every column of a against b.
+
+    `a` and `b` are (samples, parameters) arrays with NaN where a sample has
+    no value; all parameters are tested at once. Mann-Whitney p-values use
+    the normal approximation with tie and continuity corrections, as
+    scipy.stats.mannwhitneyu(method="asymptotic") does.
+    """
+    # Columns without values in a group come out as NaN, which later drops them
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        n_a, n_b = np.sum(~np.isnan(a), axis=0), np.sum(~np.isnan(b), axis=0)
+        mean_a, mean_b = np.nanmean(a, axis=0), np.nanmean(b, axis=0)
+        var_a, var_b = np.nanvar(a, axis=0, ddof=1), np.nanvar(b, axis=0, ddof=1)
+
+        se_a, se_b = var_a / n_a, var_b / n_b
+        t = (mean_a - mean_b) / np.sqrt(se_a + se_b)
+        df = (se_a + se_b) ** 2 / (se_a ** 2 / (n_a - 1) + se_b ** 2 / (n_b - 1))
+        welch_p = 2 * stats.t.sf(np.abs(t), df)
+
+        pooled = np.sqrt(((n_a - 1) * var_a + (n_b - 1) * var_b) / (n_a + n_b - 2))
+        hedges_g = (mean_a - mean_b) / pooled * (1 - 3 / (4 * (n_a + n_b) - 9))
+
+        both = np.vstack([a, b])
+        ranks = stats.rankdata(both, axis=0, nan_policy="omit")
+        u = np.nansum(ranks[:len(a)], axis=0) - n_a * (n_a + 1) / 2
+        n = n_a + n_b
+        # Sum of t^3 - t over the groups of t tied values: runs of equal values once sorted,
+        # numbered per column so one bincount sizes the runs of all columns
+        ordered = np.sort(both, axis=0)
+        starts = np.ones(ordered.shape, dtype=bool)
+        starts[1:] = ordered[1:] != ordered[:-1]
+        runs = np.cumsum(starts, axis=0) - 1 + np.arange(ordered.shape[1]) * len(ordered)
+        sizes = np.bincount(runs[~np.isnan(ordered)], minlength=ordered.size).astype(float)
+        ties = (sizes ** 3 - sizes).reshape(ordered.shape[1], len(ordered)).sum(axis=1)
+        sigma = np.sqrt(n_a * n_b / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = (np.abs(u - n_a * n_b / 2) - 0.5) / sigma
+        mannwhitney_p = np.minimum(2 * stats.norm.sf(z), 1)
+        rank_biserial = 2 * u / (n_a * n_b) - 1
+
+    return pd.DataFrame({
+        "n_a": n_a, "n_b": n_b, "mean_a": mean_a, "mean_b": mean_b, "difference": mean_a - mean_b,
+        "hedges_g": hedges_g, "rank_biserial": rank_biserial, "welch_p": welch_p, "mannwhitney_p": mannwhitney_p,
+    })
+
+
+def _fdr(p):
+    """Benjamini-Hochberg adjusted p-values, NaN where there was no test."""
+    q = np.full(len(p), np.nan)
+    tested = np.isfinite(p)
+    if tested.any():
+        q[tested] = stats.false_discovery_control(p[tested])
+    return q
+
+
+def _levels(groups):
+    return sorted(groups.dropna().unique(), key=lambda level: (not FLIGHT_LEVEL.search(level), level))
+
+
+def compare_experiment(experiment_id):
+    """Every numeric parameter of an experiment compared between every two levels of each of its factors."""
+    rows = store.values.iloc[store.by_experiment[experiment_id]]
+    numeric = rows[(rows["kind"] == "parameter") & rows["value"].notna()].astype({"sample": str, "name": str})
+    if numeric.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    values = numeric.pivot_table(index="sample", columns="name", values="value", aggfunc="first")
+    factors = store.factors.xs(experiment_id, level="experiment")
+    factors = factors.set_axis(factors.index.astype(str)).reindex(values.index)
+    matrix = values.to_numpy(dtype=float)
+
+    results = []
+    for factor in factors.columns:
+        groups = factors[factor].astype(object)
+        for level_a, level_b in itertools.combinations(_levels(groups), 2):
+            result = compare_groups(matrix[(groups == level_a).to_numpy()], matrix[(groups == level_b).to_numpy()])
+            results.append(result.assign(
+                factor=factor, parameter=values.columns, group_a=level_a, group_b=level_b,
+            ))
+    if not results:
+        return pd.DataFrame(columns=COLUMNS)
+    result = pd.concat(results, ignore_index=True)
+    result = result[(result["n_a"] >= MIN_GROUP_SIZE) & (result["n_b"] >= MIN_GROUP_SIZE)]
+    result = result.assign(
+        experiment=experiment_id,
+        unit=result["parameter"].map(store.catalog["unit"]),
+        # Corrected over all the tests of the experiment, every factor and parameter
+        welch_q=_fdr(result["welch_p"].to_numpy()),
+        mannwhitney_q=_fdr(result["mannwhitney_p"].to_numpy()),
+    )
+    return result[COLUMNS].sort_values(["welch_q", "welch_p"], ignore_index=True)
+
+
+class GroupComparisons:
+    """Group comparisons of all experiments, computed once per version of the experiment tables.
+
+    The results are stored as an Arrow file next to the sample store, under
+    the store's signature, so workers and restarts reuse them until an
+    experiment's tables change.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.signature = None
+        self.results = None
+        self.lock = threading.Lock()
+
+    def _path(self, signature):
+        return os.path.join(self.directory, f"group-stats.{signature}.arrow")
+
+    def refresh(self):
+        store.refresh()
+        signature = f"v{STATS_VERSION}-{store.signature}"
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature == self.signature:
+                return
+            path = self._path(signature)
+            if not os.path.exists(path):
+                results = pd.concat(
+                    [compare_experiment(e) for e in store.experiments()], ignore_index=True
+                ).astype({"n_a": int, "n_b": int})
+                experiments.write_arrow(results, path, {"signature": signature})
+                for stale in set(glob.glob(self._path("*"))) - {path}:
+                    os.remove(stale)
+                logging.info(f"Computed {len(results)} group comparisons.")
+            self.results = experiments.map_arrow(path).to_pandas()
+            self.signature = signature
+
+    def for_experiment(self, experiment_id):
+        """The comparisons of one experiment, the most significant first."""
+        self.refresh()
+        return self.results[self.results["experiment"] == experiment_id]
+
+    def findings(self, experiment_id, limit=10):
+        """The comparisons significant at FDR_LEVEL by either test, at most `limit`."""
+        results = self.for_experiment(experiment_id)
+        significant = (results["welch_q"] < FDR_LEVEL) | (results["mannwhitney_q"] < FDR_LEVEL)
+        return results[significant].head(limit)
+
+    def describe(self, experiment_id, limit=10):
+        """The findings of an experiment as text for the model's context."""
+        results = self.for_experiment(experiment_id)
+        findings = self.findings(experiment_id, limit)
+        lines = [
+            f"Group comparisons of experiment {experiment_id}: {len(results)} tests of numeric parameters "
+            f"between factor levels (Welch's t-test and Mann-Whitney U, Benjamini-Hochberg corrected), "
+            f"{len(findings)} significant at q < {FDR_LEVEL}."
+        ]
+        if findings.empty and not results.empty:
+            lines.append("The largest differences, none of them significant:")
+            findings = results.head(3)
+        for row in findings.itertuples():
+            unit = f" {row.unit}" if row.unit else ""
+            lines.append(
+                f"- {row.parameter} by {row.factor}, {row.group_a} vs {row.group_b}: "
+                f"mean {row.mean_a:.4g}{unit} vs {row.mean_b:.4g}{unit} (n={row.n_a}, {row.n_b}), "
+                f"Hedges' g {row.hedges_g:.2f}, Welch p={row.welch_p:.2g} (q={row.welch_q:.2g}), "
+                f"Mann-Whitney p={row.mannwhitney_p:.2g} (q={row.mannwhitney_q:.2g})"
+            )
+        return "\n".join(lines)
+
+
+comparisons = GroupComparisons(arrow_cache_dir)
+
+
+if __name__ == "__main__":
+    comparisons.refresh()
@@ -0,0 +1,81 @@
+"""Gunicorn settings, run with `gunicorn -c gunicorn.conf.py`.
+
+By default the app is imported once in the master (preload) together with
+the experiment tables, the catalog search index and the workspace cache,
+and the forked workers share those pages copy-on-write instead of each
+importing and parsing everything again. Set GUNICORN_PRELOAD=0 to import
+the app in every worker, e.g. to reload code by restarting workers.
+"""
+import glob
+import os
+import time
+
+booted = time.monotonic()
+
+wsgi_app = "app:server"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "600"))  # chat and summary callbacks wait for the model
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# Workers write their metrics here and /metrics adds them up; it has to be
+# set before the app imports prometheus_client. on_starting empties it.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "data/cache/prometheus")
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def memory_mb():
+    """(resident, shared) memory of this process in MB, shared counting pages still shared with the master."""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, value = line.split(":", 1)
+                fields[name] = int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        return None, None
+    return fields.get("Rss"), fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+
+
+def on_starting(server):
+    # Metrics of the workers of a previous run. Only prometheus_client's own files are removed,
+    # and only once per start: this file is read again on every reload (SIGHUP).
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        # With preload the master has imported the app already and may have files of its own
+        if not path.endswith(f"_{os.getpid()}.db"):
+            os.remove(path)
+
+
+def when_ready(server):
+    if preload_app:
+        import search
+        import workspace
+
+        workspace.preload()
+        search.index.refresh()
+    rss, _ = memory_mb()
+    server.log.info(f"Master ready in {time.monotonic() - booted:.2f}s, RSS {rss or 0:.0f} MB.")
+
+
+def pre_fork(server, worker):
+    worker.spawn_started = time.monotonic()
+
+
+def post_worker_init(worker):
+    import llm
+    import retrieval
+
+    # Threads do not survive the fork, start this worker's health checks and index refresh now
+    llm.gateway.start_health_checks()
+    retrieval.index.start()
+    rss, shared = memory_mb()
+    worker.log.info(
+        f"Worker {worker.pid} ready in {(time.monotonic() - worker.spawn_started) * 1000:.0f} ms, "
+        f"RSS {rss or 0:.0f} MB of which {shared or 0:.0f} MB shared."
+    )
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,316 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+import httpx
+import redis
+
+import metrics
+
+from constants import (
+    embedding_model,
+    llm_backend_concurrency,
+    llm_deadlines,
+    llm_eject_seconds,
+    llm_health_interval,
+    llm_keep_alive,
+    llm_timeout,
+    llm_traffic_window,
+    llm_warm_interval,
+    ollama_hosts,
+    ollama_model,
+    redis_instance,
+)
+from scheduler import BATCH, DeadlineExceeded, Scheduler
+
+logging.basicConfig(level=logging.INFO)
+
+# Errors that mean the backend itself is unreachable rather than the request being bad. A
+# timeout only means the backend is slow (loading the model, busy with a long prompt), so it
+# fails that one call and the backend stays in rotation; the health checks eject dead ones.
+BACKEND_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)
+CALL_ERRORS = (httpx.TimeoutException, httpx.TransportError)
+
+NANOSECONDS = 1e9
+
+# Requests in flight on a backend, shared by all workers: a sorted set of reservation ids
+# scored by the time their lease runs out, so a crashed worker cannot hold a slot for good
+OUTSTANDING_KEY = "llm-outstanding:{}"
+LEASE_SLACK = 30  # seconds a reservation outlives its call's timeout
+POLL_SECONDS = 0.05
+MAX_POLL_SECONDS = 0.5
+
+# Reserves a slot on the backend with the fewest outstanding requests that has one free
+ACQUIRE_SCRIPT = redis_instance.register_script(
+    """
+    local best, fewest = 0, nil
+    for i, key in ipairs(KEYS) do
+        redis.call("zremrangebyscore", key, "-inf", ARGV[1])
+        local count = redis.call("zcard", key)
+        if count < tonumber(ARGV[4]) and (fewest == nil or count < fewest) then
+            best, fewest = i, count
+        end
+    end
+    if best > 0 then
+        redis.call("zadd", KEYS[best], ARGV[2], ARGV[3])
+        redis.call("expire", KEYS[best], ARGV[5])
+    end
+    return best
+    """
+)
+
+# The deadline of the call a thread is making, read by the request hook of the clients
+_call = threading.local()
+
+
+class LLMUnavailable(Exception):
+    """Raised when no healthy Ollama backend could take the request in time."""
+
+
+def _apply_deadline(request):
+    """Shortens a request's timeouts to what is left of its call's deadline.
+
+    Otherwise the client would wait up to OLLAMA_TIMEOUT for the first chunk
+    of an answer whose deadline has long passed.
+    """
+    deadline = getattr(_call, "deadline", None)
+    if deadline is not None:
+        remaining = min(max(deadline - time.monotonic(), 0.001), llm_timeout)
+        request.extensions["timeout"] = httpx.Timeout(remaining).as_dict()
+
+
+class Backend:
+    """One Ollama endpoint with a pooled client.
+
+    Its concurrency limit is counted in Redis (see OUTSTANDING_KEY), so it
+    holds across all the workers, not per process.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.key = OUTSTANDING_KEY.format(host)
+        self._client = None
+        self._client_pid = None
+        self.ejected_until = 0.0
+
+    @property
+    def client(self):
+        # A forked worker must not reuse the connections the master's client opened
+        if self._client_pid != os.getpid():
+            import ollama
+
+            self._client = ollama.Client(
+                host=self.host, timeout=llm_timeout, event_hooks={"request": [_apply_deadline]},
+            )
+            self._client_pid = os.getpid()
+        return self._client
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.ejected_until
+
+    def eject(self, reason):
+        self.ejected_until = time.monotonic() + llm_eject_seconds
+        logging.warning(f"Ejecting Ollama backend {self.host} for {llm_eject_seconds}s: {reason}")
+
+    def readmit(self):
+        if not self.healthy:
+            logging.info(f"Ollama backend {self.host} is healthy again.")
+        self.ejected_until = 0.0
+
+
+class LLMGateway:
+    """Routes model calls to the backend with the fewest outstanding requests across all workers."""
+
+    def __init__(self, hosts):
+        self.backends = [Backend(host) for host in hosts]
+        self._health_pid = None
+        self.last_call = 0.0
+        self.last_warm_up = 0.0
+
+    def _reserve(self, candidates, lease):
+        """Reserves a slot on the least loaded candidate with one free, returning (backend, reservation)."""
+        reservation = str(uuid.uuid4())
+        now = time.time()
+        try:
+            chosen = ACQUIRE_SCRIPT(
+                keys=[b.key for b in candidates],
+                args=[now, now + lease, reservation, llm_backend_concurrency, int(lease) + 1],
+            )
+        except redis.RedisError as e:
+            logging.error(f"Backend slots unavailable, routing without a concurrency limit: {e}")
+            return random.choice(candidates), None
+        return (candidates[chosen - 1], reservation) if chosen else (None, None)
+
+    def acquire(self, timeout, exclude=()):
+        """Waits until a healthy backend has a free slot and reserves it, returning (backend, reservation)."""
+        deadline = time.monotonic() + timeout
+        poll = POLL_SECONDS
+        while True:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+            if candidates:
+                backend, reservation = self._reserve(candidates, timeout + LEASE_SLACK)
+                if backend is not None:
+                    return backend, reservation
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMUnavailable("No Ollama backend available, please try again later.")
+            time.sleep(min(poll, remaining))
+            poll = min(poll * 2, MAX_POLL_SECONDS)
+
+    def release(self, backend, reservation):
+        if reservation is None:
+            return
+        try:
+            redis_instance.zrem(backend.key, reservation)
+        except redis.RedisError as e:
+            # The lease runs out on its own
+            logging.error(f"Error releasing a slot of {backend.host}: {e}")
+
+    def call(self, method, ticket=None, **kwargs):
+        """Runs `method` on a client, failing over once per backend on connection errors.
+
+        With a scheduler ticket the call is streamed, so a cancelled or late
+        request closes its connection and Ollama stops generating, and the
+        client's timeouts are cut to the ticket's deadline. A backend that
+        times out is kept: the call fails, nothing is sent again.
+        """
+        self.start_health_checks()
+        self.last_call = time.monotonic()
+        tried = []
+
+        while True:
+            timeout = llm_timeout
+            if ticket is not None and ticket.deadline is not None:
+                timeout = max(ticket.deadline - time.monotonic(), 0)
+            backend, reservation = self.acquire(timeout, exclude=tried)
+            start = time.perf_counter()
+            _call.deadline = ticket.deadline if ticket is not None else None
+            try:
+                if ticket is None:
+                    response = getattr(backend.client, method)(**kwargs)
+                else:
+                    response = self._consume(getattr(backend.client, method)(stream=True, **kwargs), ticket)
+                log_timings(backend, method, response)
+                metrics.observe_llm(method, backend.host, time.perf_counter() - start, response)
+                return response
+            except BACKEND_ERRORS as e:
+                metrics.LLM_ERRORS.labels(backend.host).inc()
+                backend.eject(e)
+                tried.append(backend)
+                if len(tried) == len(self.backends):
+                    raise LLMUnavailable(f"All Ollama backends failed: {e}") from e
+            except CALL_ERRORS as e:
+                metrics.LLM_ERRORS.labels(backend.host).inc()
+                if isinstance(e, httpx.TimeoutException) and ticket is not None and ticket.deadline is not None:
+                    raise DeadlineExceeded(f"Ollama on {backend.host} did not answer in time.") from e
+                raise LLMUnavailable(f"Ollama on {backend.host} failed to answer: {e}") from e
+            finally:
+                _call.deadline = None
+                self.release(backend, reservation)
+
+    @staticmethod
+    def _consume(stream, ticket):
+        """Joins streamed chat chunks into a single response, checking the ticket between chunks."""
+        parts = []
+        tool_calls = []
+        chunk = None
+        try:
+            for chunk in stream:
+                ticket.check()
+                parts.append(chunk["message"].get("content") or "")
+                tool_calls.extend(chunk["message"].get("tool_calls") or [])
+        finally:
+            stream.close()
+        if chunk is None:
+            # Counted as a failure of the backend, so the call fails over to the next one
+            raise ConnectionError("The Ollama backend closed the stream without a response.")
+        chunk["message"]["content"] = "".join(parts)
+        chunk["message"]["tool_calls"] = tool_calls or None
+        return chunk
+
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                backend.client.ps()
+                backend.readmit()
+            except Exception as e:
+                backend.eject(e)
+
+    def warm_up(self):
+        """Loads the model on every healthy backend, so no user request waits for it.
+
+        An empty generate request only loads the model and sets how long it
+        stays resident, so this costs nothing once the model is loaded.
+        """
+        self.last_warm_up = time.monotonic()
+        for backend in self.backends:
+            if not backend.healthy:
+                continue
+            try:
+                response = backend.client.generate(model=ollama_model, prompt="", keep_alive=llm_keep_alive)
+                log_timings(backend, "warm-up", response)
+            except Exception as e:
+                logging.warning(f"Could not warm up {ollama_model} on {backend.host}: {e}")
+
+    def start_health_checks(self):
+        """Starts the health-check thread once per process (threads do not survive a fork)."""
+        if self._health_pid == os.getpid():
+            return
+        self._health_pid = os.getpid()
+        threading.Thread(target=self._health_loop, daemon=True, name="llm-health").start()
+
+    def _health_loop(self):
+        self.warm_up()
+        while True:
+            time.sleep(llm_health_interval)
+            self.check_health()
+            # Refresh the keep-alive only while there is traffic, an idle server lets the model unload
+            now = time.monotonic()
+            if now - self.last_call < llm_traffic_window and now - self.last_warm_up >= llm_warm_interval:
+                self.warm_up()
+
+
+def log_timings(backend, method, response):
+    """Logs model load time separately from prompt evaluation and generation time."""
+    get = getattr(response, "get", None)
+    if get is None:
+        return
+    load, prompt_eval, generation = (
+        (get(key) or 0) / NANOSECONDS for key in ("load_duration", "prompt_eval_duration", "eval_duration")
+    )
+    logging.info(
+        f"Ollama {method} on {backend.host}: load {load:.2f}s, prompt eval {prompt_eval:.2f}s, "
+        f"generation {generation:.2f}s ({get('eval_count') or 0} tokens)"
+    )
+
+
+gateway = LLMGateway(ollama_hosts)
+scheduler = Scheduler(len(ollama_hosts) * llm_backend_concurrency)
+
+
+def chat(messages, model=ollama_model, priority=BATCH, cancel=None, **kwargs):
+    """Replacement for `ollama.chat` that is scheduled and goes through the gateway.
+
+    `priority` is one of the scheduler classes and sets the request deadline,
+    `cancel` is an optional scheduler.CancelToken for the originating callback.
+    Every call renews the model's keep-alive, so it defaults to the
+    configured one instead of Ollama's five minutes.
+    """
+    kwargs.setdefault("keep_alive", llm_keep_alive)
+    deadline = time.monotonic() + llm_deadlines[priority]
+    with scheduler.slot(priority, deadline, cancel) as ticket:
+        return gateway.call("chat", ticket=ticket, model=model, messages=messages, **kwargs)
+
+
+def embed(texts, model=embedding_model, priority=BATCH, cancel=None):
+    """Embeds a list of texts in one request, returning one vector per text."""
+    deadline = time.monotonic() + llm_deadlines[priority]
+    with scheduler.slot(priority, deadline, cancel) as ticket:
+        ticket.check()
+        # Embeddings come back in one piece, there is nothing to stream
+        return gateway.call("embed", model=model, input=texts)["embeddings"]
@@ -0,0 +1,106 @@
+import os
+import time
+
+import redis
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Model calls and chat callbacks take seconds to minutes, the default buckets stop at 10s
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+CALLBACK_SECONDS = Histogram(
+    "dash_callback_seconds", "Time spent serving a Dash callback.", ["callback"], buckets=SLOW_BUCKETS
+)
+CALLBACK_ERRORS = Counter("dash_callback_errors_total", "Dash callbacks answered with an error status.", ["callback"])
+
+LLM_SECONDS = Histogram(
+    "llm_request_seconds", "Wall time of Ollama calls, queueing excluded.", ["method", "backend"], buckets=SLOW_BUCKETS
+)
+LLM_LOAD_SECONDS = Histogram(
+    "llm_model_load_seconds", "Time Ollama spent loading the model for a call.", ["backend"], buckets=SLOW_BUCKETS
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens processed by Ollama.", ["kind"])
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_generation_tokens_per_second", "Generation speed of Ollama calls.",
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200),
+)
+LLM_ERRORS = Counter("llm_backend_errors_total", "Ollama calls that failed on a backend.", ["backend"])
+
+OSDR_SECONDS = Histogram("osdr_fetch_seconds", "Time spent fetching study data from OSDR.", buckets=SLOW_BUCKETS)
+OSDR_ERRORS = Counter("osdr_fetch_errors_total", "Failed OSDR fetches.")
+
+REDIS_SECONDS = Histogram("redis_command_seconds", "Redis command latency.", ["command"], buckets=FAST_BUCKETS)
+REDIS_ERRORS = Counter("redis_command_errors_total", "Redis commands that raised.", ["command"])
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    """Redis client that times every command it sends (pipelines are timed as one EXECUTE)."""
+
+    def execute_command(self, *args, **options):
+        command = str(args[0]).split(" ")[0].upper()
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        except redis.RedisError:
+            REDIS_ERRORS.labels(command).inc()
+            raise
+        finally:
+            REDIS_SECONDS.labels(command).observe(time.perf_counter() - start)
+
+
+def observe_llm(method, backend, seconds, response):
+    """Records an Ollama call's wall time and the load, token and speed figures it reported."""
+    LLM_SECONDS.labels(method, backend).observe(seconds)
+    get = getattr(response, "get", None)
+    if get is None:
+        return
+    LLM_LOAD_SECONDS.labels(backend).observe((get("load_duration") or 0) / 1e9)
+    LLM_TOKENS.labels("prompt").inc(get("prompt_eval_count") or 0)
+    LLM_TOKENS.labels("completion").inc(get("eval_count") or 0)
+    if get("eval_count") and get("eval_duration"):
+        LLM_TOKENS_PER_SECOND.observe(get("eval_count") / (get("eval_duration") / 1e9))
+
+
+def callback_name(app):
+    """The Python function behind a /_dash-update-component request, or its output id."""
+    payload = request.get_json(silent=True) or {}
+    output = payload.get("output", "unknown")
+    entry = app.callback_map.get(output, {})
+    return getattr(entry.get("callback"), "__name__", None) or output
+
+
+def instrument_callbacks(app):
+    """Times every Dash callback request of the app by the name of its function."""
+    server = app.server
+
+    @server.before_request
+    def start_callback_timer():
+        if request.path.endswith("/_dash-update-component"):
+            g.callback_started = time.perf_counter()
+
+    @server.after_request
+    def observe_callback(response):
+        started = g.pop("callback_started", None)
+        if started is not None:
+            name = callback_name(app)
+            CALLBACK_SECONDS.labels(name).observe(time.perf_counter() - started)
+            if response.status_code >= 400:
+                CALLBACK_ERRORS.labels(name).inc()
+        return response
+
+
+def export():
+    """Prometheus text exposition of the metrics of all workers.
+
+    Under gunicorn, PROMETHEUS_MULTIPROC_DIR must point to an empty directory
+    shared by the workers; each worker then writes its samples to files
+    there and any worker answering /metrics aggregates all of them.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
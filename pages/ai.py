@@ -3,23 +3,28 @@ import random
 import dash_chart_editor as dce
 import dash_mantine_components as dmc
 import dash_bootstrap_components as dbc
-import ollama
-import pandas as pd
-from dash import Input, Output, State, callback, dcc, html, no_update, register_page
+from dash import Input, Output, Patch, State, callback, dcc, html, no_update, register_page
 from urllib.parse import parse_qs
+import autochart
+import experiments
+import figures
+import gallery
+import retrieval
+import scheduler
 import utils
+import workspace
+from chat import ChatSession, load_exchanges, record_exchange
+from group_stats import comparisons
 import json
 import logging
 import os
 
 logging.basicConfig(level=logging.INFO)
-from constants import ollama_model
 
 JSON_FILE_PATH = os.getenv('DATA_JSON_PATH', 'data/data.json')  # Use environment variable for the JSON file path
 
-utils.data.update(pd.read_csv("/home/theo/NASA/NasaSpaceAppChallenge2024/data/OSD-665_metadata_OSD-665-ISA/OSD-665-assays.csv"))
-
-df = utils.data.df
+# Layout defaults, each session then works on its own active dataset
+df = workspace.active(None)[2]
 
 register_page(__name__, path="/ai")
 
@@ -30,47 +35,146 @@ loading_overlay = dmc.LoadingOverlay(
     zIndex=10,
 )
 
-code, default_code, part1, part2 = utils.most_interesting_plot(df)
+# The first render uses a heuristic chart, the model's suggestion is only asked for on demand
+auto_figure = autochart.auto_chart(df)
+default_code, part1, part2 = utils.plot_layout_parts()
+code = """html.Div(id='workbench', children=[
+    html.Div(id='generated-plot', children=[
+        dcc.Graph(id='auto-chart', figure=auto_figure),
+        dmc.Button('Suggest a chart with AI', id='refine-chart', variant='outline'),
+        html.Div(id='suggested-plot'),
+    ]),
+    """ + default_code + """,
+])"""
 
 try:
     exec("layout = " + part1 + code + part2)
 except Exception as e:
     exec("layout = " + part1 + default_code + part2) 
 
+CHAT_HISTORY_PAGE = 10  # exchanges loaded at a time when the chat is reopened
+
+
+def render_exchange(question, answer):
+    return [
+        dcc.Markdown(question, className="chat-item question"),
+        dcc.Markdown(answer, className="chat-item answer"),
+    ]
+
+
 @callback(
     Output("chat-output", "children", True),
     Output("question", "value", True),
     Output("loading-overlay", "visible", True),
+    Output("chat-history-loaded", "data", True),
     Input("chat-submit", "n_clicks"),
     State("question", "value"),
-    State("chat-output", "children"),
+    State("session-id", "data"),
+    State("compute-mode", "checked"),
+    State("chat-history-loaded", "data"),
     prevent_initial_call=True,
     )
-def chat_window(n_clicks, question, cur):
+def chat_window(n_clicks, question, session_id, compute, loaded):
     if not question:
-        return no_update, no_update, False
+        return no_update, no_update, False, no_update
 
-    data = utils.data.df.to_dict("list")
-    print(data)
-
-    df = pd.DataFrame(data)
-    prompt = utils.generate_prompt(df, question)
+    name, dataset_id, df = workspace.active(session_id)
+    # Uploads are searched against every experiment's documentation
+    experiment = name if dataset_id.startswith(workspace.EXPERIMENT_PREFIX) else None
+    session = ChatSession.load(session_id)
+    if session.data_version != dataset_id:
+        context = utils.generate_insights(df)
+        if experiment:
+            context += "\n\n" + comparisons.describe(experiment)
+            files = experiments.describe_files(experiment)
+            if files:
+                context += "\n\n" + files
+        session.set_context(context, dataset_id)
 
     try:
-        completion = ollama.chat(
-            model=ollama_model, messages=[{"role": "user", "content": prompt}]
+        answer = session.ask(
+            question,
+            scheduler.CancelToken(session_id, "chat", "/ai"),
+            data=df if compute else None,
+            passages=retrieval.relevant_passages(question, experiment=experiment),
         )
-        answer = completion["message"]["content"]
+        session.save()
+        record_exchange(session_id, question, answer)
+        loaded += 1
+    except scheduler.LLMCancelled:
+        return no_update, no_update, False, no_update
+    except scheduler.LLMBusy as e:
+        answer = str(e)
     except Exception as e:
         answer = f"Error: {str(e)}"
 
-    question_markdown = dcc.Markdown(question, className="chat-item question")
-    answer_markdown = dcc.Markdown(answer, className="chat-item answer")
+    # Only the new exchange travels, the conversation itself stays in the browser and on the server
+    new_content = Patch()
+    for item in reversed(render_exchange(question, answer)):
+        new_content.prepend(item)
+
+    return new_content, "", False, loaded
+
+
+@callback(
+    Output("chat-output", "children", True),
+    Output("chat-history-more", "style"),
+    Output("chat-history-loaded", "data", True),
+    Input("chat-history-more", "n_clicks"),
+    State("session-id", "data"),
+    State("chat-history-loaded", "data"),
+    prevent_initial_call="initial_duplicate",
+)
+def load_chat_history(n_clicks, session_id, loaded):
+    if not session_id:
+        return no_update, no_update, no_update
+
+    exchanges, more = load_exchanges(session_id, loaded, CHAT_HISTORY_PAGE)
+    older = Patch()
+    older.extend([item for question, answer in exchanges for item in render_exchange(question, answer)])
+
+    return older, {"display": "block" if more else "none"}, loaded + len(exchanges)
+
+
+@callback(
+    Output("suggested-plot", "children"),
+    Input("refine-chart", "n_clicks"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def refine_chart(n, session_id):
+    df = workspace.active(session_id)[2]
+    try:
+        figure = utils.most_interesting_plot(df)
+        return figures.graph(figures.store(figure))
+    except Exception as e:
+        logging.error(f"Error rendering the suggested chart: {e}")
+        return no_update
+
 
-    new_content = [question_markdown, answer_markdown]
+@callback(
+    Output("dataset-switcher", "options"),
+    Output("dataset-switcher", "value"),
+    Input("session-id", "data"),
+)
+def load_datasets(session_id):
+    return workspace.describe(session_id), workspace.active(session_id)[0]
 
 
-    return (new_content + cur if cur else new_content), "", False
+@callback(
+    Output("chart-editor", "dataSources", True),
+    Output("auto-chart", "figure"),
+    Output("dataset-switcher", "options", True),
+    Input("dataset-switcher", "value"),
+    State("session-id", "data"),
+    prevent_initial_call=True,
+)
+def switch_dataset(name, session_id):
+    if not name or not session_id:
+        return no_update, no_update, no_update
+    workspace.activate(session_id, name)
+    df = workspace.active(session_id)[2]
+    return df.to_dict("list"), autochart.auto_chart(df), workspace.describe(session_id)
 
 
 @callback(
@@ -86,40 +190,67 @@ def save_figure_to_chart_editor(n):
 @callback(
     Output("current-charts", "children", True),
     Input("chart-editor", "figure"),
-    State("chart-editor", "dataSources"),
-    State("current-charts", "children"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def save_figure(figure, data, cur):
+def save_figure(figure, session_id):
+    # Without a session yet, the figure would land in a gallery shared by everyone
+    if not session_id:
+        return no_update
     # cleaning data output for unnecessary columns
     figure = dce.cleanDataFromFigure(
         figure,
     )
-    df = pd.DataFrame(data)
+    # the editor's data source is the session dataset, no need to upload it again
+    df = workspace.active(session_id)[2]
     # create Figure object from dash-chart-editor figure
     figure = dce.chartToPython(figure, df)
 
     # Validate there's something to save
     if figure.data:
-        item = [dmc.Paper([dcc.Graph(figure=figure)])]
-
-        header = [
-            html.Div(
-                [
-                    html.H2("Saved figures"),
-                    dcc.Clipboard(
-                        id="save-clip",
-                        title="Copy link",
-                        style={"margin-left": "10px"},
-                    ),
-                ],
-                style={"display": "flex"},
-            )
-        ]
-        return cur + item if cur else header + item
+        figure_id, saved = gallery.add_figure(session_id, figure)
+        item = [dmc.Paper([figures.graph(figure_id)])]
+
+        if saved > 1:
+            # Only the new figure travels, the earlier ones are already on the page
+            new_item = Patch()
+            new_item.extend(item)
+            return new_item
+        return gallery_header() + item
 
     return no_update
 
+
+@callback(
+    Output("current-charts", "children", True),
+    Input("session-id", "data"),
+    prevent_initial_call="initial_duplicate",
+)
+def load_gallery(session_id):
+    if not session_id:
+        return no_update
+    figure_ids = gallery.session_figure_ids(session_id)
+    if not figure_ids:
+        return no_update
+    # The browser fetches the stored figures itself, they are not encoded into this response
+    return gallery_header() + [dmc.Paper([figures.graph(figure_id)]) for figure_id in figure_ids]
+
+
+def gallery_header():
+    return [
+        html.Div(
+            [
+                html.H2("Saved figures"),
+                dcc.Clipboard(
+                    id="save-clip",
+                    title="Copy link",
+                    style={"margin-left": "10px"},
+                ),
+            ],
+            style={"display": "flex"},
+        )
+    ]
+
 @callback(
     Output("csv-path", "children", True),
     Input("url", "search"),
@@ -0,0 +1,100 @@
+import dash_bootstrap_components as dbc
+from dash import Input, Output, callback, dcc, html, register_page
+import plotly.express as px
+
+import figures
+from sample_store import store
+
+register_page(__name__, path="/compare")
+
+CONTENT_STYLE = {
+    'background-color': '#FFFFFF',
+    'border-radius': '10px',
+    'box-shadow': '0 4px 6px rgba(0,0,0,0.1)',
+    'padding': '30px',
+    'margin-bottom': '40px',
+}
+
+
+def layout():
+    experiment_ids = store.experiments()
+    return dbc.Container([
+        html.H1("Compare Experiments", className="text-center my-4", style={'color': '#0B3D91'}),
+        html.Div([
+            dbc.Row([
+                dbc.Col([
+                    dbc.Label("Experiments", html_for='compare-experiments'),
+                    dcc.Dropdown(
+                        id='compare-experiments',
+                        options=experiment_ids,
+                        value=experiment_ids,
+                        multi=True,
+                    ),
+                ], md=5),
+                dbc.Col([
+                    dbc.Label("Parameter", html_for='compare-parameter'),
+                    dcc.Dropdown(id='compare-parameter', value='QA Score', clearable=False),
+                ], md=4),
+                dbc.Col([
+                    dbc.Label("Group by factor", html_for='compare-by'),
+                    dcc.Dropdown(id='compare-by', placeholder="Experiment only"),
+                ], md=3),
+            ], className="mb-4"),
+            dcc.Loading(html.Div(id='compare-results')),
+        ], style=CONTENT_STYLE),
+    ], style={'max-width': '1200px', 'padding': '30px 15px'})
+
+
+@callback(
+    Output('compare-parameter', 'options'),
+    Output('compare-by', 'options'),
+    Input('compare-experiments', 'value'),
+)
+def update_choices(experiment_ids):
+    # Parameters recorded by the most of the chosen experiments come first
+    parameters = store.parameters(experiment_ids)
+    options = [
+        {
+            "label": f"{name} ({row.unit}), {len(row.experiments)} experiments" if row.unit
+            else f"{name}, {len(row.experiments)} experiments",
+            "value": name,
+        }
+        for name, row in parameters.iterrows()
+    ]
+    return options, store.factor_names(experiment_ids)
+
+
+def comparison_chart(rows, parameter, by, unit):
+    title = f"{parameter} across experiments"
+    label = f"{parameter} ({unit})" if unit else parameter
+    if rows["value"].notna().any():
+        rows = rows.assign(value=rows["value"].astype(float))
+        fig = px.box(rows, x="experiment", y="value", color=by, points="all", title=title,
+                     labels={"value": label, "experiment": "Experiment"})
+    else:
+        counts = rows.groupby(["experiment", "text"], observed=True).size().reset_index(name="samples")
+        fig = px.bar(counts, x="experiment", y="samples", color="text", title=title,
+                     labels={"text": parameter, "experiment": "Experiment"})
+    return fig
+
+
+@callback(
+    Output('compare-results', 'children'),
+    Input('compare-parameter', 'value'),
+    Input('compare-experiments', 'value'),
+    Input('compare-by', 'value'),
+)
+def compare_experiments(parameter, experiment_ids, by):
+    if not parameter or not experiment_ids:
+        return html.P("Choose a parameter and at least one experiment.")
+    try:
+        summary = store.compare(parameter, experiment_ids, by)
+    except KeyError as e:
+        return html.P(str(e.args[0]))
+
+    rows = store.observations(parameter, experiment_ids, by)
+    unit = store.catalog.at[parameter, "unit"]
+    key = f"{store.signature}:{parameter}:{','.join(sorted(experiment_ids))}:{by}"
+    chart = figures.graph(figures.cached(key, comparison_chart, rows, parameter, by, unit))
+    table = dbc.Table.from_dataframe(summary.round(3).astype(str), striped=True, bordered=False, hover=True, size="sm")
+    return [chart, table]
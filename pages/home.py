@@ -1,17 +1,13 @@
 import dash_bootstrap_components as dbc
 from dash import dcc, html, register_page, Input, Output, callback, State
+from dash.exceptions import PreventUpdate
 import urllib.parse
-import json
 
-# Load json data from data folder (data.json)
-experiments = json.load(open("data/data.json"))
+from search import index
 
 # Register the page
 register_page(__name__, path="/")
 
-# Prepare dropdown options from experiments data
-experiment_options = [{"label": exp, "value": experiments[exp]["value"]} for exp in experiments]
-
 # Define the layout with production-ready design for web and mobile
 layout = html.Div([
     dbc.Container([
@@ -39,7 +35,7 @@ layout = html.Div([
                                          "color": "#34495e"}),
                         dcc.Dropdown(
                             id='experiment-dropdown',
-                            options=experiment_options,
+                            options=index.search(""),  # first page only, the rest is searched on the server
                             placeholder="Choose an experiment",
                             style={"border": "1px solid #bdc3c7", 
                                    "border-radius": "5px", 
@@ -62,6 +58,9 @@ layout = html.Div([
                     ], xs=12, sm=8, md=6, lg=4, xl=4, className="mx-auto")  # Center the button
                 ], className="mb-4"),
 
+                html.P(dcc.Link("or compare experiments side by side", href="/compare"),
+                       className="text-center"),
+
                 # Hidden div to trigger page navigation
                 dcc.Location(id='url', refresh=True)
             ], width=12)
@@ -69,6 +68,24 @@ layout = html.Div([
     ], fluid=True, style={"max-width": "100%", "padding": "30px 15px"})  # Responsive padding for mobile
 ])
 
+# Typeahead: the dropdown only ever holds the current top matches
+@callback(
+    Output('experiment-dropdown', 'options'),
+    Input('experiment-dropdown', 'search_value'),
+    State('experiment-dropdown', 'value'),
+    prevent_initial_call=True,
+)
+def search_experiments(search_value, value):
+    if not search_value:
+        raise PreventUpdate
+    options = index.search(search_value)
+    selected = index.option(value) if value else None
+    if selected and selected not in options:
+        options.append(selected)
+    # The dropdown filters options by label again in the browser, so let them match the words typed
+    return [{**o, "search": f"{o['label']} {search_value}"} for o in options]
+
+
 # Callback for button click and navigation
 @callback(
     Output('url', 'href'),
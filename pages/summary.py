@@ -1,7 +1,13 @@
 import dash_bootstrap_components as dbc
-from dash import dcc, html, register_page, Input, Output, callback
+from dash import dcc, html, register_page, Input, Output, State, MATCH, callback, no_update
 from urllib.parse import parse_qs
 from prompts import NASAExperimentSummary  # Import your class
+from scheduler import CancelToken, LLMCancelled
+import experiments
+import figures
+from group_stats import FDR_LEVEL, comparisons
+from sample_store import store
+import singleflight
 import json
 import os
 import logging
@@ -69,11 +75,11 @@ def display_error_message(title, message):
         dbc.Row(dbc.Col(html.P(message), width=12))
     ], fluid=True)
 
-def fetch_experiment_data(experiment_id, fallback_data):
+def fetch_experiment_data(experiment_id, fallback_data, cancel=None):
     """Fetch the experiment summary data using NASAExperimentSummary class or fallback JSON."""
     try:
         experiment_summary = NASAExperimentSummary(experiment_id)
-        summary_json = experiment_summary.prompt()
+        summary_json = experiment_summary.prompt(cancel)
         if summary_json is not None:
             logging.info(f"Successfully fetched data for experiment ID: {experiment_id}")
             return summary_json
@@ -111,152 +117,202 @@ CONTENT_STYLE = {
     'flex-direction': 'column',
 }
 
-# Loader spinner to display while fetching data
-loader_spinner = dbc.Spinner(color="primary", size="lg")
+def section(title, children):
+    """A content card with a title, the building block of the summary page."""
+    return html.Div([
+        dbc.Row(dbc.Col(html.H2(title, className="mb-4", style={'color': '#0B3D91'}), width=12)),
+        dbc.Row(dbc.Col(children, width=12))
+    ], style=CONTENT_STYLE)
 
+# Each part of the page has its own callback and fills in as soon as it is ready:
+# the catalog text at once, generated text and every chart when they are built
 layout = html.Div([
     dcc.Location(id='url', refresh=False),
+    dcc.Store(id='summary-pending'),  # experiment id whose summary still has to be generated
 
-    # Full-screen loader while waiting for content
-    html.Div(id='loader', children=loader_spinner, style={'position': 'fixed', 'top': '0', 'left': '0', 'width': '100%', 'height': '100%', 'display': 'flex', 'justify-content': 'center', 'align-items': 'center', 'background-color': 'rgba(255, 255, 255, 0.8)', 'z-index': '9999'}),
+    # Header section with experiment name
+    html.Div(id='experiment-name', style=HEADER_STYLE),
 
-    # Header section with experiment name, initially empty
-    html.Div(id='experiment-name', hidden=True, style=HEADER_STYLE),  # Hidden by default
-
-    # Placeholder for dynamically loaded content based on the URL
-    html.Div(id='summary-content', hidden=True, style=SECTION_STYLE)  # Hidden by default
+    html.Div([
+        dcc.Loading(html.Div(id='summary-text'), type='default'),
+        dcc.Loading(html.Div(id='summary-statistics'), type='default'),
+        html.Div(id='summary-charts'),
+        html.Div(id='summary-footer'),
+    ], style=SECTION_STYLE)
 ])
 
-### Callback ###
+def text_sections(summary_json):
+    """Overview, goals, significance and protocol of a catalog entry or generated summary."""
+    return html.Div([
+        section("🧪 Experiment Overview", html.P(summary_json.get("experiment_overview", "No Overview Provided"))),
+        section("🎯 Mission Goals", html.Ul([html.Li(goal) for goal in summary_json.get('goals', [])])),
+        section("🌟 Significance", html.P(summary_json.get('significance', "No Significance Provided"))),
+        section("📝 Protocol", create_protocol_accordion(summary_json.get('protocol', []))),
+    ])
 
-@callback(
-    [Output('summary-content', 'children'),
-     Output('experiment-name', 'children'),
-     Output('loader', 'style'),  # Hide loader after content is loaded
-     Output('summary-content', 'hidden'),  # Show content when ready
-     Output('experiment-name', 'hidden')],  # Show experiment name when ready
-    Input('url', 'search')
-)
+def footer(experiment_id):
+    return section("Further Analysis", [
+        html.P("Explore the comprehensive analysis derived from the experiment data. "
+               "This includes graphical representations, interpretations, and "
+               "potential implications of the findings.", style={'font-size': '16px'}),
+        dbc.Row(dbc.Col(dbc.Button("View Full Analysis", color="primary", href=f'/ai?id={experiment_id}', style={
+            "background-color": '#0B3D91',  # Match header color
+            "border": "none",
+            "margin": "10px auto",
+            "display": "block",
+            "padding": "10px 20px",
+            "border-radius": "5px",
+        }), width={"size": 6, "offset": 3})),  # Center button
+    ])
+
+def experiment_id_from(search):
+    params = parse_qs((search or '').lstrip('?'))
+    return params.get('id', [None])[0]
 
-def update_summary_content(search):
-    # Parse the query parameters from the URL
-    params = parse_qs(search.lstrip('?'))  
-    experiment_id = params.get('id', [None])[0]
-    charts_content = None
+### Callbacks ###
 
+@callback(
+    Output('experiment-name', 'children'),
+    Output('summary-text', 'children'),
+    Output('summary-footer', 'children'),
+    Output('summary-pending', 'data'),
+    Input('url', 'search'),
+)
+def show_catalog(search):
+    """Renders what the catalog already has; a summary still to be generated is handed to show_generated."""
+    experiment_id = experiment_id_from(search)
     if not experiment_id:
         logging.error("No experiment ID provided in URL.")
-        return (display_error_message("Experiment Not Found", "No experiment ID was provided in the URL."), None, {'display': 'flex'}, True, True)
-
-    # If specific experiment ID 'OSD-665', generate and return charts
-    if experiment_id == 'OSD-665':
-        logging.info("Displaying summary for experiment OSD-665")
-        
-        body_weight_chart = create_body_weight_chart(merged_df_665)
-        rrna_contamination_chart = create_rrna_contamination_chart_665(merged_rna_df_665)
-        habitat_chart = create_habitat_chart(merged_df_665)
-        violin_chart = create_violin(merged_df_665)
-        
-        charts_content = html.Div([
-            html.H2("Violin Plot of Body Weight"),
-            violin_chart,
-            html.H2("Body Weight Chart"),
-            body_weight_chart,
-            html.H2("rRNA Contamination Chart"),
-            rrna_contamination_chart,
-            html.H2("Habitat Chart"),
-            habitat_chart,
-        ], style=CONTENT_STYLE)
-    
-    if experiment_id == 'OSD-379':
-        logging.info("Displaying summary for experiment OSD-379")
-
-        avg_qa_chart = create_avg_qa_score_chart(df_379, samples_379)
-        rrna_contamination_chart = create_rrna_contamination_chart(df_rrna_filtered, samples_379)
-        qa_score_by_age = create_qa_score_by_age_chart(df_379, samples_379)
-        
-        charts_content = html.Div([
-            html.H2("Average QA Score Chart"),
-            avg_qa_chart,
-            html.H2("rRNA Contamination Chart"),
-            rrna_contamination_chart,
-            html.H2("Read Depth Chart"),
-            qa_score_by_age,
-        ], style=CONTENT_STYLE)
-
+        return None, display_error_message("Experiment Not Found", "No experiment ID was provided in the URL."), None, None
 
-
-    # Load experiment data from JSON if experiment ID is not 'OSD-665'
     experiment_data = load_experiment_data()
     if not experiment_data:
-        return (display_error_message("Data Loading Error", "Failed to load experiment data. Please try again later."), None, {'display': 'flex'}, True, True)
+        return None, display_error_message("Data Loading Error", "Failed to load experiment data. Please try again later."), None, None
 
-    # Find the experiment by ID in the JSON file
     experiment = find_experiment_by_id(experiment_id, experiment_data)
     if not experiment:
-        return (display_error_message("Experiment Not Found", f"Experiment with ID {experiment_id} was not found."), None, {'display': 'flex'}, True, True)
+        return None, display_error_message("Experiment Not Found", f"Experiment with ID {experiment_id} was not found."), None, None
 
     if experiment.get('experiment_name') == "N/A":
-        summary_json = fetch_experiment_data(experiment_id, experiment)
-        logging.info(f"Updating JSON data for experiment ID: {experiment_id}")
-        NASAExperimentSummary.update_json(experiment_id, summary_json)
-    else:
-        summary_json = experiment
+        pending = html.P("Generating the experiment summary...", className="text-center text-muted")
+        return html.H1(experiment_id), pending, footer(experiment_id), experiment_id
 
     logging.info(f"Displaying summary for experiment ID: {experiment_id}")
-    
-    # Build the page content dynamically
-    experiment_name = summary_json.get("experiment_name", "Experiment Overview")
-    content = html.Div([
+    name = experiment.get("experiment_name", "Experiment Overview")
+    return html.H1(name), text_sections(experiment), footer(experiment_id), None
 
-        html.Div([
-            dbc.Row(dbc.Col(html.H2("🧪 Experiment Overview", className="mb-4", style={'color': '#0B3D91'}), width=12)),
-            dbc.Row(dbc.Col(html.P(summary_json.get("experiment_overview", "No Overview Provided")), width=12))
-        ], style=CONTENT_STYLE),
 
-        html.Div([
-            dbc.Row(dbc.Col(html.H2("🎯 Mission Goals", className="mb-4", style={'color': '#0B3D91'}), width=12)),
-            dbc.Row(dbc.Col(html.Ul([html.Li(goal) for goal in summary_json.get('goals', [])]), width=12))
-        ], style=CONTENT_STYLE),
+@callback(
+    Output('experiment-name', 'children', allow_duplicate=True),
+    Output('summary-text', 'children', allow_duplicate=True),
+    Input('summary-pending', 'data'),
+    State('session-id', 'data'),
+    prevent_initial_call=True,
+)
+def show_generated(experiment_id, session_id):
+    """Generates the summary of an experiment the catalog has no text for, and stores it there."""
+    if not experiment_id:
+        return no_update, no_update
+    experiment = find_experiment_by_id(experiment_id, load_experiment_data() or {})
+    cancel = CancelToken(session_id, 'summary', '/summary') if session_id else None
 
-        html.Div([
-            dbc.Row(dbc.Col(html.H2("🌟 Significance", className="mb-4", style={'color': '#0B3D91'}), width=12)),
-            dbc.Row(dbc.Col(html.P(summary_json.get('significance', "No Significance Provided")), width=12))
-        ], style=CONTENT_STYLE),
+    def refresh_summary():
+        # Shared by every visitor waiting on this experiment, so no one visitor's token cancels it
+        summary_json = fetch_experiment_data(experiment_id, experiment or {})
+        logging.info(f"Updating JSON data for experiment ID: {experiment_id}")
+        NASAExperimentSummary.update_json(experiment_id, summary_json)
+        return summary_json
 
-        html.Div([
-            dbc.Row(dbc.Col(html.H2("📝 Protocol", className="mb-4", style={'color': '#0B3D91'}), width=12)),
-            dbc.Row(dbc.Col(create_protocol_accordion(summary_json.get('protocol', [])), width=12))
-        ], style=CONTENT_STYLE),
+    # Concurrent visitors of the same experiment share one OSDR fetch and generation
+    try:
+        summary_json = singleflight.do(f"summary:{experiment_id}", refresh_summary, cancel=cancel)
+    except LLMCancelled:
+        return no_update, no_update
+    except singleflight.SingleFlightError:
+        logging.error(f"Generating the summary of {experiment_id} failed, showing the catalog entry.")
+        summary_json = experiment or {}
+    name = summary_json.get("experiment_name", "Experiment Overview")
+    return html.H1(name), text_sections(summary_json)
 
-        charts_content,
 
-        html.Div([
-            dbc.Row(dbc.Col(html.H2("Further Analysis", className="mb-4", style={'color': '#0B3D91'}), width=12)),
-            dbc.Row(dbc.Col(html.P("Explore the comprehensive analysis derived from the experiment data. "
-                                    "This includes graphical representations, interpretations, and "
-                                    "potential implications of the findings.", style={'font-size': '16px'}), width=12)),
-            dbc.Row(dbc.Col(dbc.Button("View Full Analysis", color="primary", href=f'/ai?id={experiment_id}', style={
-                "background-color": '#0B3D91',  # Match header color
-                "border": "none",
-                "margin": "10px auto",
-                "display": "block",
-                "padding": "10px 20px",
-                "border-radius": "5px",
-            }), width={"size": 6, "offset": 3})),  # Center button
-        ], style=CONTENT_STYLE)
+@callback(
+    Output('summary-statistics', 'children'),
+    Input('url', 'search'),
+)
+def show_statistics(search):
+    """The significant differences between the factor levels of the experiment, from the precomputed tests."""
+    experiment_id = experiment_id_from(search)
+    if experiment_id not in store.experiments():
+        return None
+    results = comparisons.for_experiment(experiment_id)
+    findings = comparisons.findings(experiment_id)
+    if findings.empty:
+        text = (f"None of the {len(results)} comparisons of numeric parameters between factor levels "
+                f"is significant at a {FDR_LEVEL:.0%} false discovery rate.")
+        return section("📊 Group Differences", html.P(text))
+
+    table = pd.DataFrame({
+        "Parameter": findings["parameter"] + findings["unit"].map(lambda u: f" ({u})" if u else ""),
+        "Factor": findings["factor"],
+        "Groups": findings["group_a"] + " vs " + findings["group_b"],
+        "Means": [f"{a:.4g} vs {b:.4g}" for a, b in zip(findings["mean_a"], findings["mean_b"])],
+        "n": findings["n_a"].astype(str) + " / " + findings["n_b"].astype(str),
+        "Hedges' g": findings["hedges_g"].map("{:.2f}".format),
+        "Welch q": findings["welch_q"].map("{:.2g}".format),
+        "Mann-Whitney q": findings["mannwhitney_q"].map("{:.2g}".format),
+    })
+    return section("📊 Group Differences", [
+        html.P(f"{len(findings)} of {len(results)} comparisons of numeric parameters between factor levels "
+               f"are significant at a {FDR_LEVEL:.0%} false discovery rate (Welch's t-test and Mann-Whitney U, "
+               f"Benjamini-Hochberg corrected)."),
+        dbc.Table.from_dataframe(table, striped=True, bordered=False, hover=True, size="sm"),
     ])
 
-    return content, html.H1(experiment_name), {'display': 'none'}, False, False
+
+@callback(
+    Output('summary-charts', 'children'),
+    Input('url', 'search'),
+)
+def show_charts(search):
+    """Lays out a slot per chart of the experiment; each slot is built by its own build_chart call."""
+    experiment_id = experiment_id_from(search)
+    charts = CHARTS.get(experiment_id)
+    if not charts:
+        return None
+    logging.info(f"Displaying charts for experiment {experiment_id}")
+    return html.Div([
+        html.Div([
+            html.H2(title),
+            dcc.Store(id={"type": "summary-chart-source", "index": f"{experiment_id}:{i}"}, data=[experiment_id, i]),
+            dcc.Loading(html.Div(id={"type": "summary-chart", "index": f"{experiment_id}:{i}"}, style={'min-height': '450px'})),
+        ])
+        for i, (title, _, _) in enumerate(charts)
+    ], style=CONTENT_STYLE)
+
+
+@callback(
+    Output({"type": "summary-chart", "index": MATCH}, 'children'),
+    Input({"type": "summary-chart-source", "index": MATCH}, 'data'),
+)
+def build_chart(source):
+    # Slots are separate requests, so the charts of a page are built side by side
+    experiment_id, i = source
+    _, build, frames = CHARTS[experiment_id][i]
+    return cached_chart(build, experiment_id, *frames)
 
 
 ###-###-### GRAPHS PLOTTING ###-###-###
 
+def cached_chart(build, experiment_id, *frames):
+    """A graph of build(*frames), built once per version of the experiment's tables and served as stored bytes."""
+    figure_id = figures.cached(f"{experiment_id}:{experiments.version(experiment_id)}", build, *frames)
+    return figures.graph(figure_id)
+
 ### Imports ###
-df_665 = pd.read_csv("data/OSD-665_metadata_OSD-665-ISA/OSD-665-assays.csv")
-samples_665 = pd.read_csv("data/OSD-665_metadata_OSD-665-ISA/OSD-665-samples.csv")
-df_379 = pd.read_csv("data/OSD-379_metadata_OSD-379-ISA/OSD-379-assays.csv")
-samples_379 = pd.read_csv("data/OSD-379_metadata_OSD-379-ISA/OSD-379-samples.csv")
+df_665 = experiments.load_assays("OSD-665")
+samples_665 = experiments.load_samples("OSD-665")
+df_379 = experiments.load_assays("OSD-379")
+samples_379 = experiments.load_samples("OSD-379")
 ###---------###
 
 merged_df_665 = pd.merge(df_665, samples_665, on='Sample Name')
@@ -278,7 +334,7 @@ def create_body_weight_chart(merged_df):
             'Factor Value: Spaceflight': 'Spaceflight Condition'
         },
     )
-    return dcc.Graph(figure=fig)
+    return fig
 
 
 df_665['Parameter Value: rRNA Contamination'] = df_665['Parameter Value: rRNA Contamination'].astype(str)
@@ -304,7 +360,7 @@ def create_rrna_contamination_chart_665(merged_df):
         color='Parameter Value: rRNA Contamination'
     )
     
-    return dcc.Graph(figure=fig)
+    return fig
 
 # Create a histogram for 'Habitat' by 'Spaceflight' condition
 def create_habitat_chart(merged_df):
@@ -318,7 +374,7 @@ def create_habitat_chart(merged_df):
             'Factor Value: Spaceflight': 'Spaceflight Condition'
         },
     )
-    return dcc.Graph(figure=fig)
+    return fig
 
 def create_violin(merged_df):
 
@@ -332,7 +388,7 @@ def create_violin(merged_df):
         title='Body Weight Distribution by Spaceflight Condition'
     )
 
-    return dcc.Graph(figure=fig)
+    return fig
 
 
 
@@ -348,7 +404,7 @@ def create_avg_qa_score_chart(df_assays, df_samples):
     merged_df['Parameter Value: QA Score'] = merged_df['Parameter Value: QA Score'].apply(extract_numeric_value)
     
     # Group by age and calculate average QA score
-    avg_qa_df = merged_df.groupby('Factor Value: Age').agg(
+    avg_qa_df = merged_df.groupby('Factor Value: Age', observed=True).agg(
         avg_qa=('Parameter Value: QA Score', 'mean')
     ).reset_index()
     
@@ -363,7 +419,7 @@ def create_avg_qa_score_chart(df_assays, df_samples):
             'Factor Value: Age': 'Age Group'
         },
     )
-    return dcc.Graph(figure=fig)
+    return fig
 
 df_379['Parameter Value: rRNA Contamination'] = df_379['Parameter Value: rRNA Contamination'].astype(str)
 df_379['Parameter Value: rRNA Contamination'] = df_379['Parameter Value: rRNA Contamination'].str.replace('percent', '', regex=False).str.strip()
@@ -388,7 +444,7 @@ def create_rrna_contamination_chart(df_assays, df_samples):
         color='Parameter Value: rRNA Contamination'
     )
     
-    return dcc.Graph(figure=fig)
+    return fig
 
 def create_qa_score_by_age_chart(df_assays, df_samples):
     # Fusionner les deux dataframes sur le nom de l'échantillon
@@ -405,5 +461,20 @@ def create_qa_score_by_age_chart(df_assays, df_samples):
             'Parameter Value: QA Score': 'QA Score',
         },
     )
-    return dcc.Graph(figure=fig)
-
+    return fig
+
+
+# Charts of the experiments that have them: (title, builder, frames it is built from)
+CHARTS = {
+    'OSD-665': [
+        ("Violin Plot of Body Weight", create_violin, [merged_df_665]),
+        ("Body Weight Chart", create_body_weight_chart, [merged_df_665]),
+        ("rRNA Contamination Chart", create_rrna_contamination_chart_665, [merged_rna_df_665]),
+        ("Habitat Chart", create_habitat_chart, [merged_df_665]),
+    ],
+    'OSD-379': [
+        ("Average QA Score Chart", create_avg_qa_score_chart, [df_379, samples_379]),
+        ("rRNA Contamination Chart", create_rrna_contamination_chart, [df_rrna_filtered, samples_379]),
+        ("Read Depth Chart", create_qa_score_by_age_chart, [df_379, samples_379]),
+    ],
+}
@@ -1,37 +1,53 @@
 import json
-import pickle
 
 import dash
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
-import ollama
 from dash import dcc, html
 
-from constants import redis_instance, ollama_model
+import figures
+import gallery
+import llm
+import scheduler
+import singleflight
 
 dash.register_page(__name__)
 
 
 def layout(layout=None):
-    layout = redis_instance.get(layout)
-    layout = pickle.loads(layout)
-
-    figures = [i["props"]["children"][0]["props"]["figure"] for i in layout[1:]]
+    figure_ids = gallery.shared_figure_ids(layout)
+    if figure_ids is None:
+        saved = gallery.shared_figures(layout)
+        graphs = [dcc.Graph(figure=figure) for figure in saved]
+    else:
+        saved = gallery.load_figures(figure_ids)
+        # The browser fetches the stored figures itself, they are not encoded into this page
+        graphs = [figures.graph(figure_id) for figure_id in figure_ids]
 
     question = (
         "The following is a Plotly Dash layout with several charts. Summarize "
         "the charts for me and provide some maximums, mimumuns, trends, "
         "notable outliers, etc. Describe the data and content as the user doesn't know it's a layout."
         "The data may be truncated to comply with a max character count. "
-        f"There should be {len(figures)} charts to follow:\n\n\n"
+        f"There should be {len(saved)} charts to follow:\n\n\n"
     )
 
-    completion = ollama.chat(
-        model=ollama_model,
-        messages=[{"role": "user", "content": question + json.dumps(figures)[0:3900]}],
-    )
+    def summarize():
+        # The model has to read the numbers, not their base64 encoding
+        charts = json.dumps([figures.plain(figure) for figure in saved])
+        completion = llm.chat(
+            messages=[{"role": "user", "content": question + charts[0:3900]}],
+            priority=scheduler.VIEW,
+        )
+        return completion["message"]["content"]
 
-    response = dcc.Markdown(completion["message"]["content"])
+    # A shared link is often opened by many people at once, summarize it only once
+    try:
+        response = dcc.Markdown(singleflight.do(f"view:{layout}", summarize))
+    except (scheduler.LLMBusy, llm.LLMUnavailable) as e:
+        response = dcc.Markdown(str(e))
+    except (scheduler.DeadlineExceeded, singleflight.SingleFlightError):
+        response = dcc.Markdown("The summary of these charts could not be generated.")
 
     return dmc.LoadingOverlay(
         [
@@ -40,6 +56,9 @@ def layout(layout=None):
                 href="/",
                 style={"background-color": "#238BE6", "margin": "10px"},
             ),
-            html.Div([response, html.Div(layout[1:])], style={"padding": "40px"}),
+            html.Div(
+                [response, html.Div([dmc.Paper([graph]) for graph in graphs])],
+                style={"padding": "40px"},
+            ),
         ]
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,185 @@
+"""Opt-in cProfile reports of single requests, for finding where a slow page spends its time.
+
+Nothing is installed unless PROFILE_TOKEN is set, so the app runs without
+any profiling hook by default. With a token, a request is profiled when
+
+- it carries the header "X-Profile: <token>", or
+- profiling was switched on for everyone with
+  POST /admin/profiles/toggle?seconds=60 (header "X-Admin-Token: <token>").
+
+The profile covers the whole Flask request, the Dash callback dispatch
+included. Its pstats are kept in Redis under the request id, which comes
+back in the X-Profile-Id response header, and the admin routes list them:
+
+    GET /admin/profiles              recent profiles, newest first
+    GET /admin/profiles/<id>         the top functions by cumulative time, as text
+    GET /admin/profiles/<id>.prof    the pstats file, for snakeviz or flameprof
+
+Streamed responses are profiled up to their first byte.
+"""
+import cProfile
+import hmac
+import io
+import json
+import logging
+import marshal
+import pstats
+import time
+import uuid
+
+from flask import Blueprint, Response, abort, g, jsonify, request
+
+import metrics
+from constants import profile_keep, profile_token, profile_ttl, redis_instance
+
+logging.basicConfig(level=logging.INFO)
+
+PROFILE_KEY = "profile:{}"
+RECENT_KEY = "profile:recent"
+TOGGLE_KEY = "profile:toggle"
+TOGGLE_REFRESH = 1.0  # seconds a worker trusts its last look at the toggle
+REPORT_LINES = 80
+
+blueprint = Blueprint("profiler", __name__, url_prefix="/admin/profiles")
+
+# Whether the toggle was on when this worker last looked, and when that was
+_toggle = {"on": False, "checked": 0.0}
+
+
+def _authorized(value):
+    return bool(value) and hmac.compare_digest(value, profile_token)
+
+
+def _toggled():
+    now = time.monotonic()
+    if now - _toggle["checked"] > TOGGLE_REFRESH:
+        _toggle["on"] = bool(redis_instance.exists(TOGGLE_KEY))
+        _toggle["checked"] = now
+    return _toggle["on"]
+
+
+def _wanted():
+    if request.blueprint == blueprint.name:
+        return False
+    return _authorized(request.headers.get("X-Profile")) or _toggled()
+
+
+def _save(profile, app, seconds, status):
+    profile_id = uuid.uuid4().hex
+    stats = pstats.Stats(profile)
+    entry = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.path,
+        "callback": metrics.callback_name(app) if request.path.endswith("/_dash-update-component") else None,
+        "status": status,
+        "seconds": round(seconds, 4),
+        "calls": stats.total_calls,
+        "time": time.time(),
+    }
+    pipe = redis_instance.pipeline()
+    # The same layout as pstats.Stats.dump_stats, so the file loads in any pstats tool
+    pipe.set(PROFILE_KEY.format(profile_id), marshal.dumps(stats.stats), ex=profile_ttl)
+    pipe.lpush(RECENT_KEY, json.dumps(entry))
+    pipe.ltrim(RECENT_KEY, 0, profile_keep - 1)
+    pipe.execute()
+    return profile_id
+
+
+def install(app):
+    """Adds the profiling hooks and admin routes to the app's server, if PROFILE_TOKEN is set."""
+    if not profile_token:
+        return
+    server = app.server
+    server.register_blueprint(blueprint)
+
+    @server.before_request
+    def start_profile():
+        if not _wanted():
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another request of this thread is being profiled already
+            return
+        g.profile = profile
+        g.profile_started = time.perf_counter()
+
+    @server.after_request
+    def save_profile(response):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        profile.disable()
+        try:
+            seconds = time.perf_counter() - g.pop("profile_started")
+            response.headers["X-Profile-Id"] = _save(profile, app, seconds, response.status_code)
+        except Exception as e:
+            logging.error(f"Error saving the profile of {request.path}: {e}")
+        return response
+
+    @server.teardown_request
+    def stop_profile(exc):
+        # after_request is skipped when the request raised
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile.disable()
+
+    logging.info("Request profiling is available, see /admin/profiles.")
+
+
+@blueprint.before_request
+def check_token():
+    if not _authorized(request.headers.get("X-Admin-Token")):
+        abort(403)
+
+
+@blueprint.route("")
+def recent():
+    return jsonify([json.loads(entry) for entry in redis_instance.lrange(RECENT_KEY, 0, -1)])
+
+
+@blueprint.route("/toggle", methods=["POST"])
+def toggle():
+    """Profiles every request for the next `seconds` (0 switches it off)."""
+    seconds = request.args.get("seconds", 60, type=int)
+    if seconds > 0:
+        redis_instance.set(TOGGLE_KEY, 1, ex=seconds)
+    else:
+        redis_instance.delete(TOGGLE_KEY)
+    _toggle["checked"] = 0.0
+    return jsonify({"profiling": seconds > 0, "seconds": max(seconds, 0)})
+
+
+class _Stored:
+    """A stored profile in the shape pstats.Stats loads from a profiler."""
+
+    def __init__(self, data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+
+def _stats(profile_id):
+    data = redis_instance.get(PROFILE_KEY.format(profile_id))
+    if data is None:
+        abort(404)
+    return data
+
+
+@blueprint.route("/<profile_id>.prof")
+def download(profile_id):
+    return Response(
+        _stats(profile_id), mimetype="application/octet-stream",
+        headers={"Content-Disposition": f"attachment; filename={profile_id}.prof"},
+    )
+
+
+@blueprint.route("/<profile_id>")
+def report(profile_id):
+    out = io.StringIO()
+    stats = pstats.Stats(_Stored(_stats(profile_id)), stream=out)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(REPORT_LINES)
+    return Response(out.getvalue(), mimetype="text/plain")
@@ -1,10 +1,11 @@
 import requests
 import textwrap
-import ollama
+import llm
+import metrics
+import scheduler
 import json
 import re
 import logging
-from constants import ollama_model
 
 # Constants for error messages and JSON structure
 DEFAULT_DESCRIPTION = "No description available."
@@ -24,8 +25,13 @@ class NASAExperimentSummary:
     def fetch_data(self):
         """Fetches experiment data from NASA API."""
         try:
-            response = requests.get(self.url, timeout=10)
-            response.raise_for_status()
+            try:
+                with metrics.OSDR_SECONDS.time():
+                    response = requests.get(self.url, timeout=10)
+                response.raise_for_status()
+            except requests.exceptions.RequestException:
+                metrics.OSDR_ERRORS.inc()
+                raise
             data = response.json()
             self.description = data.get("description", DEFAULT_DESCRIPTION)
             self.protocols = data.get("protocols", [])
@@ -59,19 +65,20 @@ class NASAExperimentSummary:
             for protocol in self.protocols
         ]
 
-    def prompt_summary(self, summary_output):
+    def prompt_summary(self, summary_output, cancel=None):
         """Generates a summary using the Ollama API."""
         try:
-            completion = ollama.chat(
-                model=ollama_model,
+            completion = llm.chat(
                 messages=[{"role": "user", "content": summary_output}],
+                priority=scheduler.BATCH,
+                cancel=cancel,
             )
             return completion["message"]["content"]
         except Exception as e:
             logging.error(f"Error while calling Ollama API: {e}")
             return None
 
-    def prompt(self):
+    def prompt(self, cancel=None):
         """Main method to execute the fetching and summarizing process."""
         try:
             self.fetch_data()
@@ -80,7 +87,7 @@ class NASAExperimentSummary:
                 return None
             
             summary_output = self.generate_summary()
-            final_json_string = self.prompt_summary(summary_output)
+            final_json_string = self.prompt_summary(summary_output, cancel)
 
             # Format final_json to be a valid JSON string
             final_json = self.clean_and_parse_json(final_json_string)
@@ -0,0 +1,254 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+import autochart
+
+logging.basicConfig(level=logging.INFO)
+
+# A query's cost is bounded before it runs, as a thread cannot be stopped once it does:
+# every step is one pass over the rows of the columns the query names
+MAX_INPUT_ROWS = 1_000_000
+MAX_QUERY_CELLS = 1_000_000  # rows times the columns a query names
+MAX_QUERY_TERMS = 8  # filter conditions, group keys and aggregates, each
+MAX_OUTPUT_ROWS = 50
+
+OPERATORS = {
+    "==": lambda s, v: s == v,
+    "!=": lambda s, v: s != v,
+    "<": lambda s, v: s < v,
+    "<=": lambda s, v: s <= v,
+    ">": lambda s, v: s > v,
+    ">=": lambda s, v: s >= v,
+    "in": lambda s, v: s.isin(v),
+    "contains": lambda s, v: s.astype("string").str.contains(str(v), case=False, regex=False),
+}
+NUMERIC_OPERATORS = {"<", "<=", ">", ">="}
+AGGREGATIONS = {"mean", "median", "min", "max", "sum", "count", "std", "nunique"}
+
+# Ollama tool definition the chat model uses to ask for a query
+QUERY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "query_data",
+        "description": (
+            "Runs a query on the user's dataset and returns the resulting table. Use it "
+            "whenever the answer depends on specific rows, groups or exact numbers. "
+            "Numbers with units such as '35.9 gram' are compared and aggregated as numbers."
+        ),
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "filter": {
+                    "type": "array",
+                    "description": "Conditions that must all hold.",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "column": {"type": "string"},
+                            "op": {"type": "string", "enum": list(OPERATORS)},
+                            "value": {"description": "A value, or a list of values for 'in'."},
+                        },
+                        "required": ["column", "op", "value"],
+                    },
+                },
+                "groupby": {"type": "array", "items": {"type": "string"}},
+                "aggregate": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "column": {"type": "string"},
+                            "func": {"type": "string", "enum": sorted(AGGREGATIONS)},
+                        },
+                        "required": ["column", "func"],
+                    },
+                },
+                "columns": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Columns to return when nothing is aggregated.",
+                },
+                "sort": {
+                    "type": "object",
+                    "properties": {
+                        "column": {"type": "string"},
+                        "descending": {"type": "boolean"},
+                    },
+                },
+                "limit": {"type": "integer"},
+            },
+        },
+    },
+}
+
+class QueryError(Exception):
+    """Raised when a query is invalid or exceeds the sandbox limits."""
+
+
+def validate(spec, columns):
+    """Checks a query against the dataset's columns and returns it in normalized form."""
+    if not isinstance(spec, dict):
+        raise QueryError("The query must be an object.")
+    unknown = set(spec) - {"filter", "groupby", "aggregate", "columns", "sort", "limit"}
+    if unknown:
+        raise QueryError(f"Unknown query keys: {', '.join(sorted(unknown))}.")
+
+    def column(name):
+        if isinstance(name, (dict, list)) or name not in columns:
+            raise QueryError(f"Unknown column: {name!r}.")
+        return name
+
+    def terms(key, kind):
+        value = spec.get(key) or []
+        if not isinstance(value, list) or not all(isinstance(term, kind) for term in value):
+            noun = "objects" if kind is dict else "column names"
+            raise QueryError(f"The {key} must be a list of {noun}.")
+        return value
+
+    filters = []
+    for condition in terms("filter", dict):
+        op = condition.get("op")
+        if op not in OPERATORS:
+            raise QueryError(f"Unknown operator: {op!r}.")
+        value = condition.get("value")
+        if op == "in" and not isinstance(value, list):
+            value = [value]
+        if isinstance(value, (dict, list)) and op != "in":
+            raise QueryError(f"Operator {op!r} needs a single value.")
+        filters.append({"column": column(condition.get("column")), "op": op, "value": value})
+
+    aggregates = []
+    for aggregate in terms("aggregate", dict):
+        func = aggregate.get("func")
+        if func not in AGGREGATIONS:
+            raise QueryError(f"Unknown aggregation: {func!r}.")
+        aggregates.append({"column": column(aggregate.get("column")), "func": func})
+
+    sort = spec.get("sort") or None
+    if sort and not isinstance(sort, dict):
+        raise QueryError("The sort must be an object.")
+    if sort:
+        sort = {"column": sort.get("column"), "descending": bool(sort.get("descending", False))}
+
+    limit = spec.get("limit") or MAX_OUTPUT_ROWS
+    if not isinstance(limit, int) or limit < 1:
+        raise QueryError("The limit must be a positive integer.")
+
+    groupby = terms("groupby", str)
+    for key, given in (("filter", filters), ("aggregate", aggregates), ("groupby", groupby)):
+        if len(given) > MAX_QUERY_TERMS:
+            raise QueryError(f"A query may have at most {MAX_QUERY_TERMS} {key} terms.")
+
+    return {
+        "filter": filters,
+        "groupby": [column(c) for c in groupby],
+        "aggregate": aggregates,
+        "columns": [column(c) for c in terms("columns", str)],
+        "sort": sort,
+        "limit": min(limit, MAX_OUTPUT_ROWS),
+    }
+
+
+def _as_number(series):
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    # Parsing is the slow part of a query, and ISA columns repeat a few values many times
+    codes, uniques = pd.factorize(series)
+    parsed = np.append(autochart.parse_numeric(pd.Series(uniques)).to_numpy(dtype=float), np.nan)
+    return pd.Series(parsed[codes], index=series.index)
+
+
+def filter_rows(df, filters, numbers=None):
+    """Returns the rows matching all of a validated query's filter conditions.
+
+    `numbers` collects the columns parsed as numbers, so each is parsed once per query.
+    """
+    numbers = {} if numbers is None else numbers
+    mask = pd.Series(True, index=df.index)
+    for condition in filters:
+        series = df[condition["column"]]
+        value = condition["value"]
+        if condition["op"] in NUMERIC_OPERATORS:
+            if condition["column"] not in numbers:
+                numbers[condition["column"]] = _as_number(series)
+            series = numbers[condition["column"]]
+            value = pd.to_numeric(value, errors="coerce")
+            if pd.isna(value):
+                raise QueryError(f"Operator {condition['op']!r} needs a number.")
+        mask &= OPERATORS[condition["op"]](series, value).fillna(False).astype(bool)
+    return df[mask]
+
+
+def _execute(df, spec):
+    numbers = {}
+    rows = filter_rows(df, spec["filter"], numbers)
+
+    if spec["aggregate"]:
+        named = {f"{a['func']} of {a['column']}": (a["column"], a["func"]) for a in spec["aggregate"]}
+        values = pd.DataFrame({
+            name: rows[c] if f in ("count", "nunique")
+            else numbers[c].loc[rows.index] if c in numbers else _as_number(rows[c])
+            for name, (c, f) in named.items()
+        }, index=rows.index)
+        funcs = {name: f for name, (c, f) in named.items()}
+        if spec["groupby"]:
+            grouped = values.groupby([rows[c] for c in spec["groupby"]], dropna=False, observed=True)
+            result = grouped.agg(funcs).reset_index()
+        else:
+            result = pd.DataFrame([{name: values[name].agg(f) for name, f in funcs.items()}])
+    elif spec["groupby"]:
+        result = rows.groupby(spec["groupby"], dropna=False, observed=True).size().reset_index(name="count")
+    else:
+        result = rows[spec["columns"]] if spec["columns"] else rows
+
+    if spec["sort"]:
+        if spec["sort"]["column"] not in result.columns:
+            raise QueryError(f"Cannot sort by {spec['sort']['column']!r}, it is not in the result.")
+        result = result.sort_values(spec["sort"]["column"], ascending=not spec["sort"]["descending"])
+
+    return result, len(result)
+
+
+def _columns_read(spec, columns):
+    named = {c["column"] for c in spec["filter"]} | {a["column"] for a in spec["aggregate"]}
+    named |= set(spec["groupby"])
+    if not spec["aggregate"] and not spec["groupby"]:
+        named |= set(spec["columns"] or columns)
+    return len(named)
+
+
+def run(df, spec):
+    """Validates and runs a query within the row and size limits, returning (result, total_rows).
+
+    Queries that would read more than MAX_QUERY_CELLS are refused up front,
+    which keeps every query that runs to a bounded, short time.
+    """
+    spec = validate(spec, set(df.columns))
+    if len(df) > MAX_INPUT_ROWS:
+        raise QueryError(f"The dataset has more than {MAX_INPUT_ROWS} rows.")
+    cells = len(df) * _columns_read(spec, df.columns)
+    if cells > MAX_QUERY_CELLS:
+        raise QueryError(
+            f"The query reads {cells} values, more than {MAX_QUERY_CELLS}; name fewer columns."
+        )
+
+    result, total = _execute(df, spec)
+    return result.head(spec["limit"]), total
+
+
+def run_tool_call(df, arguments):
+    """Runs a query requested by the model and formats the outcome as the tool's answer."""
+    try:
+        result, total = run(df, dict(arguments))
+    except QueryError as e:
+        return f"Query error: {e}"
+    except Exception as e:
+        logging.error(f"Error while running query {arguments}: {e}")
+        return f"Query error: {e}"
+
+    text = result.to_csv(index=False)
+    if total > len(result):
+        text += f"\n(showing {len(result)} of {total} rows)"
+    return text
@@ -0,0 +1,235 @@
+import ast
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+import experiments
+import llm
+import scheduler
+import singleflight
+from constants import (
+    embedding_model, retrieval_min_score, retrieval_refresh_interval, retrieval_top_k, vector_index_dir,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+MAX_CHUNK_CHARS = 1000
+EMBED_BATCH = 32  # texts per embedding request
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+CATALOG_FIELDS = ("experiment_overview", "goals", "significance")
+INVESTIGATION_FIELDS = ("Study Title", "Study Description")
+
+
+class OllamaEmbedder:
+    """Embeds texts with an Ollama embedding model through the LLM gateway.
+
+    Any object with a `name` and an `embed(texts, priority)` method
+    returning one vector per text can be used in its place, e.g. a stub in
+    tests.
+    """
+
+    def __init__(self, model=embedding_model):
+        self.name = model
+
+    def embed(self, texts, priority=scheduler.INTERACTIVE):
+        return llm.embed(texts, model=self.name, priority=priority)
+
+
+def _text(value):
+    """A catalog field as prose; list fields such as the goals become one sentence per item."""
+    if isinstance(value, list):
+        return " ".join(item if item.endswith((".", "!", "?")) else f"{item}." for item in map(str, value))
+    return str(value)
+
+
+def split_text(text, limit=MAX_CHUNK_CHARS):
+    """Splits text into chunks of whole sentences of at most `limit` characters where possible."""
+    chunks, current = [], ""
+    for sentence in SENTENCE_END.split(" ".join(str(text).split())):
+        if current and len(current) + len(sentence) + 1 > limit:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _investigation(path):
+    """Reads an ISA i_Investigation.txt into {field: [values]}."""
+    fields = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            cells = [c.strip().strip('"') for c in line.rstrip("\n").split("\t")]
+            fields.setdefault(cells[0], cells[1:])
+    return fields
+
+
+def _passages(entry):
+    """(source, text) pairs of an experiment's descriptions and protocols."""
+    passages = [(field, _text(entry[field])) for field in CATALOG_FIELDS if entry.get(field)]
+    protocols = entry.get("protocol") or []
+    if isinstance(protocols, str):
+        protocols = ast.literal_eval(protocols)
+    passages += [(f"protocol: {p['name']}", p["description"]) for p in protocols]
+
+    csv_path = entry.get("csv_path")
+    for path in glob.glob(os.path.join(os.path.dirname(csv_path), "i_*.txt")) if csv_path else []:
+        fields = _investigation(path)
+        passages += [(field, fields[field][0]) for field in INVESTIGATION_FIELDS if fields.get(field, [""])[0]]
+        names = fields.get("Study Protocol Name", [])
+        descriptions = fields.get("Study Protocol Description", [])
+        passages += [(f"protocol: {n}", d) for n, d in zip(names, descriptions) if d]
+    return passages
+
+
+def collect_chunks():
+    """Chunks of the catalog text and investigation files, keyed by a hash of their content."""
+    chunks = {}
+    for entry in experiments.load_catalog().values():
+        for source, text in _passages(entry):
+            for part in split_text(text):
+                chunk = {"experiment": entry["value"], "source": source, "text": part}
+                chunk_id = hashlib.sha1(json.dumps(chunk, sort_keys=True).encode()).hexdigest()
+                chunks[chunk_id] = chunk
+    return chunks
+
+
+def _source_paths():
+    paths = [experiments.JSON_FILE_PATH]
+    for entry in experiments.load_catalog().values():
+        if entry.get("csv_path"):
+            paths += glob.glob(os.path.join(os.path.dirname(entry["csv_path"]), "i_*.txt"))
+    return paths
+
+
+class VectorIndex:
+    """Brute-force cosine index over experiment descriptions and protocols, persisted to disk.
+
+    Vectors are normalized once so a search is one matrix-vector product.
+    When the sources change only new chunks are embedded, in batches; the
+    vectors of unchanged chunks are reused from the saved index. Rebuilds
+    are coalesced across workers with singleflight and the result is shared
+    through the saved files.
+
+    The index is kept up to date by a background thread (see `start`), so a
+    question never waits for chunks to be embedded: until the first build
+    finishes, questions are answered from the saved index or without
+    retrieval.
+    """
+
+    def __init__(self, embedder, directory=vector_index_dir):
+        self.embedder = embedder
+        self.directory = directory
+        self.signature = None
+        # (chunks, normalized vectors), replaced as a whole so a search never mixes two versions
+        self.contents = ([], np.zeros((0, 0), dtype=np.float32))
+        self.lock = threading.Lock()
+        self._refresh_pid = None
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{self.embedder.name.replace(':', '_')}.npz")
+
+    def _signature(self):
+        return hashlib.sha1(json.dumps(
+            [self.embedder.name] + [(p, os.path.getmtime(p)) for p in sorted(_source_paths())]
+        ).encode()).hexdigest()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}, [], np.zeros((0, 0), dtype=np.float32)
+        with np.load(self.path, allow_pickle=False) as stored:
+            ids = stored["ids"].tolist()
+            chunks = json.loads(str(stored["chunks"]))
+            return dict(zip(ids, stored["vectors"])), chunks, stored["vectors"]
+
+    def build(self):
+        """Embeds the chunks missing from the saved index and saves it again."""
+        chunks = collect_chunks()
+        known, _, _ = self._read()
+        missing = [i for i in chunks if i not in known]
+        for start in range(0, len(missing), EMBED_BATCH):
+            batch = missing[start:start + EMBED_BATCH]
+            texts = [chunks[i]["text"] for i in batch]
+            vectors = np.asarray(self.embedder.embed(texts, priority=scheduler.BATCH), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+            known.update(zip(batch, vectors))
+        ids = sorted(chunks)
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=np.array(ids),
+            chunks=np.array(json.dumps([chunks[i] for i in ids])),
+            vectors=np.stack([known[i] for i in ids]) if ids else np.zeros((0, 0), dtype=np.float32),
+        )
+        os.replace(tmp_path, self.path)
+        logging.info(f"Vector index has {len(ids)} chunks, {len(missing)} newly embedded.")
+
+    def load(self):
+        """Loads the saved index as it is, possibly out of date with the sources."""
+        _, chunks, vectors = self._read()
+        self.contents = (chunks, vectors)
+
+    def refresh(self):
+        """Brings the index up to date with the catalog and investigation files."""
+        signature = self._signature()
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature == self.signature:
+                return
+            singleflight.do(f"vector-index:{signature}", self.build)
+            self.load()
+            self.signature = signature
+
+    def start(self):
+        """Starts the thread keeping the index up to date, once per process (threads do not survive a fork)."""
+        if self._refresh_pid == os.getpid():
+            return
+        self._refresh_pid = os.getpid()
+        threading.Thread(target=self._refresh_loop, daemon=True, name="vector-index").start()
+
+    def _refresh_loop(self):
+        self.load()
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Vector index refresh failed: {e}")
+            time.sleep(retrieval_refresh_interval)
+
+    def search(self, question, k=retrieval_top_k, experiment=None):
+        """Returns the k chunks most similar to the question, optionally from one experiment only."""
+        chunks, vectors = self.contents
+        if not chunks:
+            return []
+        query = np.asarray(self.embedder.embed([question])[0], dtype=np.float32)
+        scores = vectors @ (query / max(np.linalg.norm(query), 1e-12))
+        if experiment is not None:
+            scores = np.where([c["experiment"] == experiment for c in chunks], scores, -np.inf)
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{**chunks[i], "score": float(scores[i])} for i in top if scores[i] >= retrieval_min_score]
+
+
+index = VectorIndex(OllamaEmbedder())
+
+
+def relevant_passages(question, experiment=None):
+    """Top passages for a chat question, or none when the embedding model is unavailable."""
+    try:
+        return index.search(question, experiment=experiment)
+    except Exception as e:
+        logging.error(f"Retrieval failed, answering without documentation: {e}")
+        return []
@@ -0,0 +1,231 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import compaction
+import experiments
+from autochart import NUMBER_WITH_UNIT
+from constants import arrow_cache_dir
+
+logging.basicConfig(level=logging.INFO)
+
+STORE_VERSION = 1  # bump when the harmonization changes, so the stored table is rebuilt
+ISA_COLUMN = re.compile(r"^(Factor Value|Parameter Value|Characteristics|Comment)\s*:\s*(.+?)(\.\d+)?$")
+UNIT_COLUMN = re.compile(r"^Unit(\.\d+)?$")
+KINDS = {"Factor Value": "factor", "Parameter Value": "parameter", "Characteristics": "characteristic", "Comment": "comment"}
+
+# Unit spellings found in OSDR tables -> (unit, factor to convert values to it)
+UNITS = {
+    "rine": ("RIN", 1), "rin": ("RIN", 1), "rna integrity number": ("RIN", 1),
+    "percent": ("%", 1), "%": ("%", 1),
+    "gram": ("g", 1), "g": ("g", 1), "milligram": ("g", 0.001), "mg": ("g", 0.001), "kilogram": ("g", 1000),
+    "read": ("reads", 1), "reads": ("reads", 1),
+    "base pair": ("bp", 1), "bp": ("bp", 1),
+    "hour": ("h", 1), "day": ("day", 1), "week": ("week", 1),
+    "degree celsius": ("°C", 1),
+}
+# Names that differ by more than case and spacing but mean the same, as normalized names
+NAME_ALIASES = {
+    "euthanasia dates": "euthanasia date",
+}
+AGGREGATES = ["count", "mean", "std", "median", "min", "max"]
+
+
+def _key(name):
+    key = " ".join(name.lower().split())
+    return NAME_ALIASES.get(key, key)
+
+
+def _columns(df, table):
+    """Long rows of every ISA value of one table, with the value's own unit or its 'Unit' column's."""
+    columns = list(df.columns)
+    for i, column in enumerate(columns):
+        match = ISA_COLUMN.match(column)
+        if not match:
+            continue
+        text = df[column].astype("string")
+        parts = text.str.extract(NUMBER_WITH_UNIT)
+        unit = parts[1].str.strip()
+        if i + 1 < len(columns) and UNIT_COLUMN.match(columns[i + 1]):
+            unit = unit.fillna(df[columns[i + 1]].astype("string"))
+        yield pd.DataFrame({
+            "sample": df["Sample Name"].astype("string"),
+            "kind": KINDS[match[1]],
+            "key": _key(match[2]),
+            "label": match[2].strip(),
+            "text": text,
+            "value": pd.to_numeric(parts[0], errors="coerce"),
+            "unit": unit,
+            "table": table,
+        })
+
+
+def _harmonize(long):
+    """Maps units to one spelling and scale per name, and picks one label for each name."""
+    spelled = long["unit"].str.lower().str.strip()
+    known = spelled.map(lambda u: UNITS.get(u) if isinstance(u, str) else None)
+    long["unit"] = known.map(lambda u: u[0] if u else None).fillna(long["unit"])
+    long["value"] = long["value"] * known.map(lambda u: u[1] if u else 1).astype(float)
+    # '10 to 12 week' parses as 10 with unit 'to 12 week', a range is not a number
+    long.loc[long["unit"].str.contains(r"\d", na=False), "value"] = np.nan
+    long.loc[long["value"].isna(), "unit"] = None
+
+    # Values without a unit take the one unit the other experiments give the same name
+    units = long.dropna(subset=["unit"]).groupby("key")["unit"].unique()
+    single = units[units.map(len) == 1].map(lambda u: u[0])
+    missing = long["unit"].isna() & long["value"].notna()
+    long.loc[missing, "unit"] = long.loc[missing, "key"].map(single)
+
+    # The spelling with the most capitals reads best, 'rRNA Contamination' over 'rrna contamination'
+    labels = long.drop_duplicates(["key", "label"])
+    labels = labels.assign(capitals=labels["label"].str.count(r"[A-Z]")).sort_values(["capitals", "label"])
+    long["name"] = long["key"].map(labels.groupby("key")["label"].last())
+    return long
+
+
+def build():
+    """Reads the ISA tables of every experiment into one harmonized long table."""
+    frames = []
+    for experiment_id in experiments.available_experiments():
+        tables = {"samples": experiments.load_samples(experiment_id), "assays": experiments.load_assays(experiment_id)}
+        for table, df in tables.items():
+            for rows in _columns(df, table):
+                frames.append(rows.assign(experiment=experiment_id))
+    long = _harmonize(pd.concat(frames, ignore_index=True))
+    # A value recorded in both the sample and the assay table is kept once, from the sample table
+    long = long.drop_duplicates(["experiment", "sample", "key"])
+    long = long[["experiment", "sample", "kind", "name", "text", "value", "unit"]]
+    long = long.sort_values(["name", "experiment", "sample"], ignore_index=True)
+    return compaction.compact(long)
+
+
+class SampleStore:
+    """All samples of all experiments in long format, indexed for comparisons.
+
+    Every ISA value is one row (experiment, sample, kind, name, text, value,
+    unit). Names are harmonized across experiments ('library selection' and
+    'Library Selection' are one name) and so are units ('RINe' and 'RNA
+    Integrity Number' are both 'RIN'), and numbers are parsed once. The table
+    is stored as an Arrow file next to the experiment tables and rebuilt only
+    when an experiment's tables change, so comparing never reads the CSVs.
+
+    Rows are sorted by name, so a name's rows are one slice. Experiments map
+    to their row positions, and the factors of every sample are a wide table
+    indexed by (experiment, sample) to group observations by.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.signature = None
+        self.values = None
+        self.names = {}  # name -> slice of rows
+        self.by_experiment = {}  # experiment -> row positions
+        self.factors = None  # (experiment, sample) -> factor values
+        self.catalog = None  # one row per name: kind, unit, experiments, samples
+        self.lock = threading.Lock()
+
+    def _signature(self):
+        versions = [f"{e}:{experiments.version(e)}" for e in experiments.available_experiments()]
+        return hashlib.sha1(f"{STORE_VERSION};{';'.join(versions)}".encode()).hexdigest()[:12]
+
+    def _path(self, signature):
+        return os.path.join(self.directory, f"samples.{signature}.arrow")
+
+    def refresh(self):
+        """Loads the stored table, building it first when an experiment changed."""
+        signature = self._signature()
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature == self.signature:
+                return
+            path = self._path(signature)
+            if not os.path.exists(path):
+                os.makedirs(self.directory, exist_ok=True)
+                long = build()
+                experiments.write_arrow(long, path, {"signature": signature})
+                for stale in set(glob.glob(self._path("*"))) - {path}:
+                    os.remove(stale)
+                logging.info(f"Built the sample store, {len(long)} values of {long['sample'].nunique()} samples.")
+            self._index(experiments.map_arrow(path).to_pandas(split_blocks=True))
+            self.signature = signature
+
+    def _index(self, values):
+        names = values["name"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+        stops = np.r_[starts[1:], len(values)]
+        self.names = {names[start]: slice(start, stop) for start, stop in zip(starts, stops)}
+        self.by_experiment = values.groupby("experiment", observed=True).indices
+
+        factors = values[values["kind"] == "factor"]
+        self.factors = factors.pivot_table(
+            index=["experiment", "sample"], columns="name", values="text", aggfunc="first", observed=True
+        )
+        plain = values[["name", "kind", "unit", "experiment", "sample"]].astype(object)
+        grouped = plain.groupby("name")
+        self.catalog = pd.DataFrame({
+            "kind": grouped["kind"].first(),
+            "unit": grouped["unit"].first(),
+            "experiments": plain.drop_duplicates(["name", "experiment"]).groupby("name")["experiment"].agg(sorted),
+            "samples": grouped["sample"].nunique(),
+            "numeric": values["value"].notna().groupby(plain["name"]).mean(),
+        })
+        self.values = values
+
+    def experiments(self):
+        self.refresh()
+        return sorted(self.by_experiment)
+
+    def parameters(self, experiment_ids=None):
+        """The names measured in any of the experiments, those shared by the most experiments first."""
+        self.refresh()
+        catalog = self.catalog[self.catalog["kind"] != "factor"]
+        if experiment_ids:
+            shared = catalog["experiments"].map(lambda e: len(set(e) & set(experiment_ids)))
+            catalog = catalog.assign(shared=shared)[shared > 0].sort_values("shared", ascending=False, kind="stable")
+        return catalog
+
+    def factor_names(self, experiment_ids=None):
+        self.refresh()
+        factors = self.factors
+        if experiment_ids:
+            factors = factors[factors.index.get_level_values("experiment").isin(experiment_ids)]
+        return [c for c in factors.columns if factors[c].notna().any()]
+
+    def observations(self, name, experiment_ids=None, by=None):
+        """The values of one name in the chosen experiments, with the factor `by` of each sample."""
+        self.refresh()
+        if name not in self.names:
+            raise KeyError(f"No experiment records {name!r}.")
+        rows = self.values.iloc[self.names[name]]
+        if experiment_ids:
+            rows = rows[rows["experiment"].isin(experiment_ids)]
+        rows = rows[["experiment", "sample", "text", "value", "unit"]]
+        if by:
+            samples = pd.MultiIndex.from_arrays([rows["experiment"].astype(str), rows["sample"].astype(str)])
+            factor = self.factors[by] if by in self.factors else pd.Series(dtype=object)
+            rows = rows.assign(**{by: factor.reindex(samples).astype(object).fillna("Not recorded").to_numpy()})
+        return rows
+
+    def compare(self, name, experiment_ids=None, by=None):
+        """Aggregates one name across experiments, per value of the factor `by` if given.
+
+        Numbers get count, mean, std, median, min and max; text values are
+        counted instead.
+        """
+        rows = self.observations(name, experiment_ids, by)
+        keys = ["experiment"] + ([by] if by else [])
+        if rows["value"].notna().any():
+            result = rows.groupby(keys, observed=True, dropna=False)["value"].agg(AGGREGATES).reset_index()
+            unit = self.catalog.at[name, "unit"]
+            return result.assign(unit=unit) if unit else result
+        return rows.groupby(keys + ["text"], observed=True, dropna=False).size().reset_index(name="count")
+
+
+store = SampleStore(arrow_cache_dir)
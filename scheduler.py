@@ -0,0 +1,231 @@
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+from constants import llm_queue_limits, llm_timeout, redis_instance
+
+logging.basicConfig(level=logging.INFO)
+
+# Priority classes, lower runs first
+INTERACTIVE = 0  # questions asked in the /ai chat
+VIEW = 1  # summaries rendered while a user waits on a page
+BATCH = 2  # experiment summarization and other background generation
+
+CANCEL_KEY = "llm-cancel:{}"
+CANCEL_TTL = 60 * 60
+CANCEL_POLL_SECONDS = 0.5
+
+# The model slots of all workers: tickets running, and waiting in line by (priority, arrival)
+RUNNING_KEY = "llm-running"  # sorted set of ticket id -> lease expiry
+QUEUE_KEY = "llm-queue"  # sorted set of ticket id -> priority * PRIORITY_SCALE + arrival in ms
+WAITER_KEY = "llm-queue-waiters"  # sorted set of ticket id -> time its worker must have polled again by
+PRIORITY_SCALE = 1e14
+POLL_SECONDS = 0.05
+WAITER_TIMEOUT = 5  # seconds without polling after which a queued ticket is dropped
+LEASE_SLACK = 30  # seconds a running ticket outlives its deadline
+
+
+class LLMBusy(Exception):
+    """Raised immediately when too much work of the same or higher priority is queued."""
+
+
+class LLMCancelled(Exception):
+    """Raised when the Dash callback that asked for the work was superseded or abandoned."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request could not finish before its deadline."""
+
+
+class CancelToken:
+    """Tracks whether the callback behind a request is still wanted.
+
+    Each browser session keeps a Redis hash holding the latest request id per
+    scope (e.g. "chat") and the page currently displayed. A newer request in
+    the same scope supersedes this one, and navigating to another page
+    abandons it. Because the state lives in Redis, a request is cancelled
+    even when the newer callback lands on a different worker.
+    """
+
+    def __init__(self, session_id, scope, page=None):
+        self.key = CANCEL_KEY.format(session_id)
+        self.scope = scope
+        self.page = page
+        self.request_id = str(uuid.uuid4())
+        self._checked_at = 0.0
+        self._cancelled = False
+        try:
+            redis_instance.hset(self.key, scope, self.request_id)
+            redis_instance.expire(self.key, CANCEL_TTL)
+        except Exception as e:
+            logging.error(f"Error registering request {self.request_id}: {e}")
+
+    def cancelled(self):
+        """Checks Redis at most every CANCEL_POLL_SECONDS."""
+        now = time.monotonic()
+        if self._cancelled or now - self._checked_at < CANCEL_POLL_SECONDS:
+            return self._cancelled
+        self._checked_at = now
+
+        try:
+            current, page = redis_instance.hmget(self.key, self.scope, "page")
+        except Exception as e:
+            logging.error(f"Error checking request {self.request_id}: {e}")
+            return False
+
+        superseded = current is not None and current.decode() != self.request_id
+        abandoned = self.page is not None and page is not None and page.decode() != self.page
+        self._cancelled = superseded or abandoned
+        return self._cancelled
+
+
+def navigate(session_id, pathname):
+    """Records the page a browser session is on, abandoning work for other pages."""
+    try:
+        redis_instance.hset(CANCEL_KEY.format(session_id), "page", pathname)
+        redis_instance.expire(CANCEL_KEY.format(session_id), CANCEL_TTL)
+    except Exception as e:
+        logging.error(f"Error recording navigation for session {session_id}: {e}")
+
+
+class Ticket:
+    def __init__(self, priority, deadline, cancel):
+        self.priority = priority
+        self.deadline = deadline
+        self.cancel = cancel
+        self.id = str(uuid.uuid4())
+
+    def check(self):
+        """Raises if the request should stop, whether it is queued or running."""
+        if self.cancel is not None and self.cancel.cancelled():
+            raise LLMCancelled("The request was superseded or abandoned.")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DeadlineExceeded("The request did not finish in time.")
+
+    def lease(self):
+        """Wall-clock time after which a crashed holder's slot is given back."""
+        seconds = llm_timeout if self.deadline is None else max(self.deadline - time.monotonic(), 0)
+        return time.time() + seconds + LEASE_SLACK
+
+
+# Drops slots whose lease ran out and queued tickets whose worker stopped polling
+_CLEAN = """
+local now = tonumber(ARGV[1])
+redis.call("zremrangebyscore", KEYS[3], "-inf", now)
+for _, id in ipairs(redis.call("zrangebyscore", KEYS[2], "-inf", now)) do
+    redis.call("zrem", KEYS[1], id)
+end
+redis.call("zremrangebyscore", KEYS[2], "-inf", now)
+"""
+
+# Runs a ticket at once if a slot is free and nobody waits, else queues it unless too much
+# work of the same or higher priority is queued already: 1 running, 0 queued, -1 busy
+ADMIT_SCRIPT = redis_instance.register_script(_CLEAN + """
+if redis.call("zcard", KEYS[3]) < tonumber(ARGV[3]) and redis.call("zcard", KEYS[1]) == 0 then
+    redis.call("zadd", KEYS[3], ARGV[4], ARGV[2])
+    return 1
+end
+if redis.call("zcount", KEYS[1], "-inf", "(" .. ARGV[6]) >= tonumber(ARGV[7]) then
+    return -1
+end
+redis.call("zadd", KEYS[1], ARGV[5], ARGV[2])
+redis.call("zadd", KEYS[2], ARGV[8], ARGV[2])
+return 0
+""")
+
+# Starts a queued ticket once it is among the first in line for the free slots: 1 running, 0 waiting
+TAKE_SCRIPT = redis_instance.register_script(_CLEAN + """
+local rank = redis.call("zrank", KEYS[1], ARGV[2])
+if not rank then
+    -- Dropped while this worker was not polling, back in line by its original score
+    redis.call("zadd", KEYS[1], ARGV[5], ARGV[2])
+    rank = redis.call("zrank", KEYS[1], ARGV[2])
+end
+if rank < tonumber(ARGV[3]) - redis.call("zcard", KEYS[3]) then
+    redis.call("zrem", KEYS[1], ARGV[2])
+    redis.call("zrem", KEYS[2], ARGV[2])
+    redis.call("zadd", KEYS[3], ARGV[4], ARGV[2])
+    return 1
+end
+redis.call("zadd", KEYS[2], ARGV[6], ARGV[2])
+return 0
+""")
+
+
+class Scheduler:
+    """Hands out the model slots of all workers by priority, then arrival order.
+
+    The running tickets and the waiting line live in Redis, so a question
+    asked on one gunicorn worker overtakes a batch summary queued on another
+    and the queue limits count the work of every worker. Waiting tickets
+    poll for their turn. When Redis is unreachable requests run unscheduled.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    def _keys(self):
+        return [QUEUE_KEY, WAITER_KEY, RUNNING_KEY]
+
+    @staticmethod
+    def _score(ticket):
+        # Priority first, then arrival; milliseconds since the epoch stay well below PRIORITY_SCALE
+        return ticket.priority * PRIORITY_SCALE + time.time() * 1000
+
+    @contextmanager
+    def slot(self, priority, deadline=None, cancel=None):
+        ticket = Ticket(priority, deadline, cancel)
+        scheduled = self._admit(ticket)
+        try:
+            yield ticket
+        finally:
+            if scheduled:
+                try:
+                    redis_instance.zrem(RUNNING_KEY, ticket.id)
+                except redis.RedisError as e:
+                    # The lease runs out on its own
+                    logging.error(f"Error releasing model slot {ticket.id}: {e}")
+
+    def _admit(self, ticket):
+        """Waits for the ticket's turn; returns whether it holds a slot in Redis."""
+        score = self._score(ticket)
+        try:
+            admitted = ADMIT_SCRIPT(keys=self._keys(), args=[
+                time.time(), ticket.id, self.capacity, ticket.lease(), score,
+                (ticket.priority + 1) * PRIORITY_SCALE, llm_queue_limits[ticket.priority],
+                time.time() + WAITER_TIMEOUT,
+            ])
+        except redis.RedisError as e:
+            logging.error(f"Model scheduling unavailable, running unscheduled: {e}")
+            return False
+        if admitted == 1:
+            return True
+        if admitted == -1:
+            raise LLMBusy("The assistant is busy right now, please try again in a moment.")
+
+        poll = POLL_SECONDS
+        try:
+            while True:
+                ticket.check()
+                if TAKE_SCRIPT(keys=self._keys(), args=[
+                    time.time(), ticket.id, self.capacity, ticket.lease(), score, time.time() + WAITER_TIMEOUT,
+                ]):
+                    return True
+                wait = poll
+                if ticket.deadline is not None:
+                    wait = min(wait, max(ticket.deadline - time.monotonic(), 0))
+                time.sleep(wait)
+                poll = min(poll * 2, CANCEL_POLL_SECONDS)
+        except redis.RedisError as e:
+            logging.error(f"Model scheduling unavailable, running unscheduled: {e}")
+            return False
+        except Exception:
+            try:
+                redis_instance.zrem(QUEUE_KEY, ticket.id)
+                redis_instance.zrem(WAITER_KEY, ticket.id)
+            except redis.RedisError:
+                pass
+            raise
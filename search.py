@@ -0,0 +1,136 @@
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
+
+import experiments
+
+logging.basicConfig(level=logging.INFO)
+
+TOKEN = re.compile(r"[a-z0-9]+")
+# Matches in the id count more than in the name, which count more than in the overview
+FIELD_WEIGHTS = {"value": 8.0, "experiment_name": 4.0, "experiment_overview": 1.0}
+EXACT_BONUS = 2.0  # a whole-word match beats a prefix match of the same field
+MAX_RESULTS = 20
+
+
+def tokenize(text):
+    return TOKEN.findall(str(text).lower())
+
+
+def _document_tokens(key, entry):
+    """Weighted tokens of one catalog entry; 'OSD-665' is also indexed as 'osd665'."""
+    weights = defaultdict(float)
+    for field, weight in FIELD_WEIGHTS.items():
+        text = entry.get(field, "")
+        tokens = tokenize(text)
+        if field == "value":
+            tokens.append("".join(tokens))
+        for token in tokens:
+            weights[token] = max(weights[token], weight)
+    return dict(weights)
+
+
+class CatalogIndex:
+    """In-memory inverted index over the experiment catalog for typeahead search.
+
+    Postings map each token to the experiments containing it with a weight,
+    and a sorted token list turns every query word into a prefix range with
+    two binary searches. The catalog file is re-read when its mtime changes,
+    and only experiments whose entry changed are re-indexed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.postings = defaultdict(dict)  # token -> {experiment key: weight}
+        self.tokens = []  # sorted tokens with at least one posting
+        self.documents = {}  # experiment key -> (entry hash, tokens)
+        self.options = {}  # experiment key -> dropdown option
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Re-indexes the experiments that changed since the catalog was last read."""
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            catalog = experiments.load_catalog()
+            changed = 0
+            for key in set(self.documents) - set(catalog):
+                self._remove(key)
+                changed += 1
+            for key, entry in catalog.items():
+                digest = hashlib.sha1(json.dumps(entry, sort_keys=True, default=str).encode()).hexdigest()
+                if key in self.documents and self.documents[key][0] == digest:
+                    continue
+                self._remove(key)
+                self._add(key, entry, digest)
+                changed += 1
+            self.mtime = mtime
+            logging.info(f"Re-indexed {changed} of {len(catalog)} catalog experiments.")
+
+    def _add(self, key, entry, digest):
+        tokens = _document_tokens(key, entry)
+        for token, weight in tokens.items():
+            if not self.postings[token]:
+                bisect.insort(self.tokens, token)
+            self.postings[token][key] = weight
+        self.documents[key] = (digest, tokens)
+        self.options[key] = {"label": key, "value": entry["value"]}
+
+    def _remove(self, key):
+        if key not in self.documents:
+            return
+        for token in self.documents.pop(key)[1]:
+            del self.postings[token][key]
+            if not self.postings[token]:
+                del self.postings[token]
+                self.tokens.pop(bisect.bisect_left(self.tokens, token))
+        del self.options[key]
+
+    def _matches(self, word):
+        """Scores of the experiments with a token starting with `word`."""
+        scores = {}
+        start = bisect.bisect_left(self.tokens, word)
+        end = bisect.bisect_left(self.tokens, word + "\uffff")
+        for token in self.tokens[start:end]:
+            bonus = EXACT_BONUS if token == word else 1.0
+            for key, weight in self.postings[token].items():
+                scores[key] = max(scores.get(key, 0.0), weight * bonus)
+        return scores
+
+    def search(self, text, limit=MAX_RESULTS):
+        """Returns dropdown options of the best matches; every word must prefix-match some token."""
+        self.refresh()
+        words = tokenize(text)
+        with self.lock:
+            if not words:
+                return list(self.options.values())[:limit]
+            scores = None
+            for word in words:
+                matches = self._matches(word)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+                if not scores:
+                    return []
+            ranked = heapq.nsmallest(limit, scores, key=lambda key: (-scores[key], key))
+            return [self.options[key] for key in ranked]
+
+    def option(self, value):
+        """The dropdown option of an experiment id, so a selection stays visible while searching."""
+        self.refresh()
+        with self.lock:
+            return next((o for o in self.options.values() if o["value"] == value), None)
+
+
+index = CatalogIndex(experiments.JSON_FILE_PATH)
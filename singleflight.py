@@ -0,0 +1,96 @@
+import logging
+import pickle
+import time
+import uuid
+
+import redis
+
+from constants import redis_instance, singleflight_lock_ttl, singleflight_result_ttl
+from scheduler import LLMCancelled
+
+logging.basicConfig(level=logging.INFO)
+
+LOCK_KEY = "singleflight:lock:{}"
+RESULT_KEY = "singleflight:result:{}"
+POLL_SECONDS = 0.05
+MAX_POLL_SECONDS = 0.5
+
+# Delete the lock only if this flight still owns it
+RELEASE_SCRIPT = redis_instance.register_script(
+    """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+)
+
+
+class SingleFlightError(Exception):
+    """Raised in waiting callers when the caller that computed the shared result failed."""
+
+
+def do(key, fn, lock_ttl=singleflight_lock_ttl, cancel=None):
+    """Runs `fn` once across all workers for concurrent callers with the same key.
+
+    The first caller takes a Redis lock and computes, the others wait for its
+    result and share it. The lock expires after `lock_ttl` seconds so a
+    crashed worker cannot block the key; waiters then take over. If the
+    computing caller raises, waiters raise SingleFlightError. When Redis is
+    unreachable every caller simply computes on its own.
+
+    `fn` is shared, so it must not stop for one caller's CancelToken. Each
+    caller passes its own `cancel` instead; a waiting caller whose token is
+    cancelled stops waiting with LLMCancelled, the computation goes on.
+    """
+    lock_key = LOCK_KEY.format(key)
+    token = str(uuid.uuid4())
+    leader = None
+    deadline = time.monotonic() + lock_ttl
+    poll = POLL_SECONDS
+
+    while True:
+        try:
+            # The leader releases its lock once its result is published, so
+            # look for the result of the leader we were waiting on first
+            payload = redis_instance.get(RESULT_KEY.format(leader.decode())) if leader else None
+            if payload is None:
+                if redis_instance.set(lock_key, token, nx=True, ex=lock_ttl):
+                    break
+                leader = redis_instance.get(lock_key) or leader
+        except redis.RedisError as e:
+            logging.error(f"Single-flight for {key} unavailable, computing locally: {e}")
+            return fn()
+
+        if payload is not None:
+            status, value = pickle.loads(payload)
+            if status == "error":
+                raise SingleFlightError(f"Shared computation for {key} failed: {value}")
+            return value
+
+        if cancel is not None and cancel.cancelled():
+            raise LLMCancelled(f"Stopped waiting for the shared computation of {key}.")
+
+        if time.monotonic() >= deadline:
+            logging.warning(f"Timed out waiting for shared computation of {key}, computing locally.")
+            return fn()
+
+        time.sleep(poll)
+        poll = min(poll * 2, MAX_POLL_SECONDS)
+
+    try:
+        result = fn()
+    except Exception as e:
+        _finish(key, token, ("error", f"{type(e).__name__}: {e}"))
+        raise
+    _finish(key, token, ("ok", result))
+    return result
+
+
+def _finish(key, token, payload):
+    """Publishes the result for the waiters, then releases the lock."""
+    try:
+        redis_instance.set(RESULT_KEY.format(token), pickle.dumps(payload), ex=singleflight_result_ttl)
+        RELEASE_SCRIPT(keys=[LOCK_KEY.format(key)], args=[token])
+    except redis.RedisError as e:
+        logging.error(f"Error sharing result for {key}: {e}")
@@ -0,0 +1,155 @@
+"""Front-end files served by the app itself, fingerprinted and precompressed.
+
+build() copies the Plotly bundle and the scripts and stylesheets of assets/
+to static_dir under names that carry a hash of their content
+(styles.3f2a9c1b7e4d.css), next to gzip and brotli copies made once at the
+highest levels. /bundles/<name> sends the smallest copy the browser accepts.
+As a name only ever stands for one content, responses are cacheable for a
+year and never revalidated; a changed file gets a new name and so a new URL
+in the page.
+
+    python -m static_assets    # build ahead, e.g. in the image, so the first boot does not
+
+compress() adds on-the-fly compression to all other responses of the server,
+callback JSON included.
+"""
+import glob
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+import brotli
+import flask_compress
+from flask import Blueprint, abort, request, send_file
+from plotly.offline import get_plotlyjs
+
+from constants import static_dir
+
+logging.basicConfig(level=logging.INFO)
+
+ASSETS_DIR = "assets"
+ASSET_PATTERNS = ("*.css", "*.js")  # favicon.ico stays with Dash, browsers ask for it by a fixed name
+IMMUTABLE = 60 * 60 * 24 * 365
+BROTLI_QUALITY = 11  # done once per file version, so spend the time on the smallest download
+GZIP_LEVEL = 9
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]  # in order of preference
+
+blueprint = Blueprint("static_assets", __name__, url_prefix="/bundles")
+
+# Fingerprinted name -> source name, filled by build()
+_files = {}
+_urls = {}
+
+
+def _write(path, data):
+    # Renamed into place, so workers building at the same time never serve half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _add(name, data):
+    stem, ext = name.split(".", 1)
+    fingerprinted = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}.{ext}"
+    path = os.path.join(static_dir, fingerprinted)
+    if not os.path.exists(f"{path}.br"):
+        _write(path, data)
+        _write(f"{path}.gz", gzip.compress(data, GZIP_LEVEL, mtime=0))
+        _write(f"{path}.br", brotli.compress(data, quality=BROTLI_QUALITY))
+        logging.info(f"Built {fingerprinted}, {len(data) / 1e3:.0f} KB -> "
+                     f"{os.path.getsize(f'{path}.br') / 1e3:.0f} KB brotli.")
+    _files[fingerprinted] = name
+    _urls[name] = f"{blueprint.url_prefix}/{fingerprinted}"
+
+
+def _sources():
+    """(name, bytes) of every file to serve, the Plotly bundle first.
+
+    Files are taken in name order, so bootstrap.min.css (Bootstrap 5.3,
+    vendored from its release) loads before the app's own styles.css.
+    """
+    yield "plotly.min.js", get_plotlyjs().encode()
+    for pattern in ASSET_PATTERNS:
+        for path in sorted(glob.glob(os.path.join(ASSETS_DIR, pattern))):
+            with open(path, "rb") as f:
+                yield os.path.basename(path), f.read()
+
+
+def build():
+    """Fingerprints and compresses the front-end files that are not built yet."""
+    os.makedirs(static_dir, exist_ok=True)
+    for name, data in _sources():
+        _add(name, data)
+
+
+def url(name):
+    return _urls[name]
+
+
+def scripts():
+    """URLs of the scripts to load on every page, the Plotly bundle first."""
+    return [u for name, u in _urls.items() if name.endswith(".js")]
+
+
+def stylesheets():
+    return [u for name, u in _urls.items() if name.endswith(".css")]
+
+
+@blueprint.route("/<name>")
+def serve(name):
+    if name not in _files:
+        abort(404)
+    path = os.path.join(static_dir, name)
+    mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings.quality(encoding) > 0 and os.path.exists(path + suffix):
+            response = send_file(path + suffix, mimetype=mimetype, max_age=IMMUTABLE)
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_file(path, mimetype=mimetype, max_age=IMMUTABLE)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.cache_control.immutable = True
+    return response
+
+
+class _SuiteCache:
+    """Keeps the compressed Dash component bundles, which are fingerprinted and never change.
+
+    Flask-Compress asks its cache about every response it compresses; only
+    the component suites get a key, everything else is compressed anew.
+    """
+
+    def __init__(self):
+        self.compressed = {}
+
+    def get(self, key):
+        return self.compressed.get(key)
+
+    def set(self, key, value):
+        if not key.endswith(";"):
+            self.compressed[key] = value
+
+
+def _suite_key(req):
+    if req.method == "GET" and "/_dash-component-suites/" in req.path:
+        return req.full_path
+    return ""
+
+
+def compress(server):
+    """Compresses the server's responses: callbacks, layouts, JSON and the Dash component bundles."""
+    server.config.setdefault("COMPRESS_CACHE_BACKEND", _SuiteCache)
+    server.config.setdefault("COMPRESS_CACHE_KEY", _suite_key)
+    server.config.setdefault("COMPRESS_MIMETYPES", [
+        "text/html", "text/css", "text/plain", "text/javascript", "application/javascript",
+        "application/json", "application/x-ndjson", "image/svg+xml", "image/x-icon",
+    ])
+    flask_compress.Compress(server)
+
+
+if __name__ == "__main__":
+    build()
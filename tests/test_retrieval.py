@@ -0,0 +1,91 @@
+import re
+
+import numpy as np
+import pytest
+
+import experiments
+import retrieval
+import scheduler
+
+VOCABULARY = ["bone", "muscle", "retina", "vessel", "mice", "flight", "ground", "radiation"]
+
+CATALOG = {
+    "Experiment OSD-1": {
+        "value": "OSD-1",
+        "experiment_overview": "Bone loss in mice after flight. Muscle mass was measured as well.",
+        "goals": ["Measure bone density", "Compare flight and ground mice."],
+        "significance": "",
+        "protocol": [{"name": "scan", "description": "Bone was scanned by micro CT."}],
+    },
+    "Experiment OSD-2": {
+        "value": "OSD-2",
+        "experiment_overview": "Retina vessel changes under radiation.",
+        "goals": ["Image the retina vessel network"],
+        "significance": "Radiation damages the retina.",
+        "protocol": "[]",
+    },
+}
+
+
+class CountingEmbedder:
+    """Deterministic bag-of-words embedder over VOCABULARY that records what it was asked to embed."""
+
+    name = "counting"
+
+    def __init__(self):
+        self.calls = []
+
+    def embed(self, texts, priority=scheduler.INTERACTIVE):
+        self.calls.append((list(texts), priority))
+        vectors = []
+        for text in texts:
+            words = re.findall(r"[a-z]+", text.lower())
+            vectors.append([float(words.count(word)) + 0.01 for word in VOCABULARY])
+        return vectors
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(experiments, "load_catalog", lambda: CATALOG)
+    return retrieval.VectorIndex(CountingEmbedder(), directory=str(tmp_path))
+
+
+def test_split_text_keeps_whole_sentences_within_the_limit():
+    text = "One two three. Four five six!   Seven\neight nine? Ten."
+    chunks = retrieval.split_text(text, limit=30)
+    assert chunks == ["One two three. Four five six!", "Seven eight nine? Ten."]
+    assert all(len(chunk) <= 30 for chunk in chunks)
+
+
+def test_list_fields_are_chunked_as_text(index):
+    goals = [c for c in retrieval.collect_chunks().values() if c["experiment"] == "OSD-1" and c["source"] == "goals"]
+    assert [c["text"] for c in goals] == ["Measure bone density. Compare flight and ground mice."]
+
+
+def test_search_returns_the_top_k_most_similar_chunks(index):
+    index.build()
+    index.load()
+    results = index.search("retina vessel", k=2)
+    assert [r["experiment"] for r in results] == ["OSD-2", "OSD-2"]
+    assert results[0]["score"] >= results[1]["score"]
+    assert all("retina" in r["text"].lower() for r in results)
+
+    assert all(r["experiment"] == "OSD-1" for r in index.search("retina vessel bone", k=3, experiment="OSD-1"))
+    assert index.search("bone", k=1, experiment="OSD-1")[0]["text"].startswith("Bone")
+
+
+def test_build_embeds_only_new_chunks_in_the_background(index):
+    index.build()
+    embedded = sum(len(texts) for texts, _ in index.embedder.calls)
+    assert embedded == len(retrieval.collect_chunks())
+    assert {priority for _, priority in index.embedder.calls} == {scheduler.BATCH}
+
+    index.embedder.calls.clear()
+    index.build()
+    assert index.embedder.calls == []
+
+
+def test_search_does_not_build_the_index(index):
+    assert index.search("bone") == []
+    assert index.embedder.calls == []
+    assert np.asarray(index.contents[1]).size == 0
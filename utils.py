@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import io
 
 import dash_ag_grid as dag
@@ -9,22 +10,19 @@ from dash import Input, Output, State, callback, dcc, html
 import plotly.express as px
 import random
 from urllib.parse import parse_qs
-import ollama
-from constants import ollama_model
+import autochart
+import experiments
+import llm
+import scheduler
+import singleflight
+import workspace
 import os
 JSON_FILE_PATH = os.getenv('DATA_JSON_PATH', 'data/data.json')  # Use environment variable for the JSON file path
 import json
 import logging
 
 logging.basicConfig(level=logging.INFO)
-class Data:
-    def __init__(self):
-        self.df = pd.read_csv("data/default.csv")
-        self.DEFAULT_CSV_PATH = "data/default.csv"
 
-    def update(self, df):
-        self.df = df
-data = Data()
 
 def chat_container(text, type_):
     return html.Div(text, id="chat-item", className=type_)
@@ -119,8 +117,8 @@ def upload_modal():
     )
 
 
-def generate_prompt(df, question):
-    # Generate insights
+def generate_insights(df):
+    """Builds the textual dataset summary that is sent to the model as context."""
     insights = []
 
     # Basic DataFrame Information
@@ -147,12 +145,19 @@ def generate_prompt(df, question):
             insights.append(f"- Column '{col}' has {count} missing values.")
 
     # Most Common Values in Categorical Columns
-    categorical_columns = df.select_dtypes(include=["object"]).columns
+    # Compacted tables hold repetitive text as categoricals, pandas 3 reads text as "string"
+    categorical_columns = df.select_dtypes(include=["object", "category", "string"]).columns
     for col in categorical_columns:
-        top_value = df[col].mode().iloc[0]
-        insights.append(f"\nMost common value in '{col}' column: {top_value}")
+        mode = df[col].mode()
+        if mode.empty:
+            continue
+        insights.append(f"\nMost common value in '{col}' column: {mode.iloc[0]}")
+
+    return "\n".join(insights)
+
 
-    insights_text = "\n".join(insights)
+def generate_prompt(df, question):
+    insights_text = generate_insights(df)
 
     # Compliment and Prompt
     prompt = (
@@ -174,15 +179,16 @@ def generate_prompt(df, question):
 @callback(
     Output("chart-editor", "dataSources", True),
     Output("summary", "children"),
+    Output("dataset-switcher", "options", True),
+    Output("dataset-switcher", "value", True),
     Input("upload-data", "contents"),
     State("upload-data", "filename"),
+    State("session-id", "data"),
     prevent_initial_call=True,
 )
-def update_output(contents, filename):
-    content_type, content_string = contents.split(",")
-    decoded = base64.b64decode(content_string)
-    df = pd.read_csv(io.StringIO(decoded.decode("utf-8")))
-    data.update(df)
+def update_output(contents, filename, session_id):
+    df = parse_upload(contents)
+    workspace.add_upload(session_id, filename, df)
 
     preview = html.Div(
         [
@@ -196,7 +202,14 @@ def update_output(contents, filename):
     )
 
 
-    return df.to_dict("list"), preview
+    return df.to_dict("list"), preview, workspace.describe(session_id), workspace.upload_name(filename)
+
+
+def parse_upload(contents):
+    """Reads the CSV behind a dcc.Upload data URL."""
+    content_type, content_string = contents.split(",")
+    decoded = base64.b64decode(content_string)
+    return pd.read_csv(io.StringIO(decoded.decode("utf-8")))
 
 
 @callback(
@@ -215,83 +228,57 @@ def disable_submit(question):
     return not bool(question)
 
 def most_interesting_plot(df):
-    # Generate insights
-    insights = []
-
-    # Basic DataFrame Information
-    insights.append(
-        f"The DataFrame contains {len(df)} rows and {len(df.columns)} columns."
-    )
-    insights.append("Here are the first 5 rows of the DataFrame:\n")
-    insights.append(df.head().to_string(index=False))
-
-    # Summary Statistics
-    insights.append("\nSummary Statistics:")
-    insights.append(df.describe().to_string())
-
-    # Column Information
-    insights.append("\nColumn Information:")
-    for col in df.columns:
-        insights.append(f"- Column '{col}' has {df[col].nunique()} unique values.")
+    """Asks the model for the most interesting chart of df, returned as a plotly figure.
 
-    # Missing Values
-    missing_values = df.isnull().sum()
-    insights.append("\nMissing Values:")
-    for col, count in missing_values.items():
-        if count > 0:
-            insights.append(f"- Column '{col}' has {count} missing values.")
-
-    # Most Common Values in Categorical Columns
-    categorical_columns = df.select_dtypes(include=["object"]).columns
-    for col in categorical_columns:
-        top_value = df[col].mode().iloc[0]
-        insights.append(f"\nMost common value in '{col}' column: {top_value}")
-
-    insights_text = "\n".join(insights)
+    The model answers with a figure as JSON naming columns instead of data,
+    which autochart.figure_from_spec checks and fills in; its reply is never
+    run as code. Raises autochart.ChartSpecError for an unusable answer.
+    """
+    insights_text = generate_insights(df)
 
     # Compliment and Prompt
     prompt = (
         "You are a data analyst and chart design expert helping users build charts and answer "
         "questions about arbitrary datasets. You are using Dash Chart Editor, a product built "
         "by Plotly. Your task is to create the best possible plot using the provided insights "
-        "and the actual data from the dataset. Ensure that the plot is meaningful and accurately "
-        "represents the data. Be sure to include the data and labels. "
-        "Your response should ONLY include the Dash layout of the plot, "
-        "not in a variable. Do not put it in a code block nor Markdown. Only answer "
-        "'html.Div(id='generated-plot', [...])'. Keep it simple and concise."
-        "Here is an example of a Dash layout:\n\n"
+        "about the dataset. Ensure that the plot is meaningful and accurately represents the "
+        "data. Be sure to include labels. "
+        "Your response should ONLY be a Plotly figure as JSON, with 'data' and 'layout'. "
+        "Where a trace takes data ('x', 'y', 'z', 'values', 'labels', 'text'), give the exact "
+        "name of a column of the dataset instead of values. Use only the trace types bar, box, "
+        "heatmap, histogram, pie, scatter and violin. Do not put it in a code block nor Markdown. "
+        "Keep it simple and concise. Here is an example:\n\n"
         """
-        html.Div(id='generated-plot', children=[
-            dcc.Graph(
-                figure={
-                    'data': [
-                        {'x': df['column1'], 'y': df['column2'], 'type': 'bar',
-                        'name': 'Example Bar Plot'},
-                        {'x': df['column3'], 'y': df['column4'], 'type': 'line',
-                        'name': 'Example Line Plot'}
-                    ],
-                    'layout': {
-                        'title': {'text': 'Example Plot Title'},
-                        'xaxis': {'title': {'text': 'X Axis Title'}, 'type': 'category'},
-                        'yaxis': {'title': {'text': 'Y Axis Title'}, 'type': 'linear'},
-                        'legend': {'orientation': 'h'}
-                    }
-                }
-            )
-        ])
+        {
+            "data": [
+                {"type": "bar", "x": "column1", "y": "column2", "name": "Example Bar Plot"},
+                {"type": "scatter", "x": "column3", "y": "column4", "name": "Example Line Plot"}
+            ],
+            "layout": {
+                "title": {"text": "Example Plot Title"},
+                "xaxis": {"title": {"text": "X Axis Title"}, "type": "category"},
+                "yaxis": {"title": {"text": "Y Axis Title"}, "type": "linear"},
+                "legend": {"orientation": "h"}
+            }
+        }
         """
     )
 
     prompt = f"{prompt}\n\nContext:\n\n{insights_text}"
 
-    response = ollama.chat(
-        model=ollama_model, messages=[{"role": "user", "content": prompt}]
-    )
+    def generate_spec():
+        response = llm.chat(
+            messages=[{"role": "user", "content": prompt}], priority=scheduler.VIEW
+        )
+        return response["message"]["content"]
 
-    code = response["message"]["content"]
+    # Workers booting together ask for the same plot, only one of them generates it
+    reply = singleflight.do(f"plot:{hashlib.sha1(prompt.encode()).hexdigest()}", generate_spec)
+    return autochart.figure_from_spec(reply, df)
 
-    # print(code)
 
+def plot_layout_parts():
+    """Returns the /ai layout template that goes around the plot code."""
     part1 = """dmc.MantineProvider(
     [
         html.P(
@@ -304,6 +291,12 @@ def most_interesting_plot(df):
                         "margin-left": "10px",
                     },
                 ),
+                dcc.Dropdown(
+                    id="dataset-switcher",
+                    clearable=False,
+                    placeholder="Switch dataset",
+                    style={"width": "400px", "margin-left": "10px"},
+                ),
             ],
             className="lead",
             style={"display": "flex"},
@@ -336,6 +329,11 @@ def most_interesting_plot(df):
                                     id="chat-submit",
                                     disabled=True,
                                 ),
+                                dmc.Switch(
+                                    id="compute-mode",
+                                    label="Compute answers on the data",
+                                    checked=True,
+                                ),
                             ],
                             # position="right",
                         ),
@@ -344,7 +342,15 @@ def most_interesting_plot(df):
                             loading_overlay,
                             html.Div(
                                 id="chat-output",
+                                children=[],
+                            ),
+                            dmc.Button(
+                                "Show older messages",
+                                id="chat-history-more",
+                                variant="subtle",
+                                style={"display": "none"},
                             ),
+                            dcc.Store(id="chat-history-loaded", data=0),
                         ],
                         ),
                     ],
@@ -374,8 +380,8 @@ def most_interesting_plot(df):
                         ),
                     ],
                 )"""
-    
-    return code, default_code, part1, part2
+
+    return default_code, part1, part2
 
 
 ###         create_body_weight_chart(merged_df_665),
@@ -383,8 +389,8 @@ def most_interesting_plot(df):
 ###        create_habitat_chart(merged_df_665),
 
 
-df_665 = pd.read_csv("data/OSD-665_metadata_OSD-665-ISA/OSD-665-assays.csv")
-samples_665 = pd.read_csv("data/OSD-665_metadata_OSD-665-ISA/OSD-665-samples.csv")
+df_665 = experiments.load_assays("OSD-665")
+samples_665 = experiments.load_samples("OSD-665")
 
 merged_df_665 = pd.merge(df_665, samples_665, on='Sample Name')
 
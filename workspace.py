@@ -0,0 +1,183 @@
+import hmac
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+import compaction
+import experiments
+from constants import chat_session_ttl, redis_instance, workspace_dir, workspace_memory_budget
+
+logging.basicConfig(level=logging.INFO)
+
+WORKSPACE_KEY = "workspace:{}"  # hash of upload file name -> dataset id
+ACTIVE_KEY = "workspace-active:{}"
+UPLOAD_KEY = "workspace-upload:{}"  # exists while a workspace refers to the upload
+OWNER_KEY = "workspace-owner:{}"  # browser token of the session, checked by the data API
+EXPERIMENT_PREFIX = "experiment:"
+UPLOAD_NAME_PREFIX = "upload:"  # uploads are named apart, so a file called 'OSD-665' shadows nothing
+SPILL_GRACE_SECONDS = 60 * 60  # age before an unreferenced spill file is deleted, covers uploads in progress
+DEFAULT_DATASET = "OSD-665"
+
+
+class FrameCache:
+    """Process-wide LRU of loaded DataFrames kept under a memory budget.
+
+    Uploaded datasets are spilled to disk when they are added, and
+    experiments can always be re-read from their ISA tables, so evicting a
+    frame only drops it from memory.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.frames = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+    def get(self, dataset_id, load):
+        with self.lock:
+            if dataset_id in self.frames:
+                self.frames.move_to_end(dataset_id)
+                return self.frames[dataset_id]
+        df = load()
+        self.put(dataset_id, df)
+        return df
+
+    def put(self, dataset_id, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self.lock:
+            self.frames[dataset_id] = df
+            self.frames.move_to_end(dataset_id)
+            self.sizes[dataset_id] = size
+            # Always keep the frame just added, even if it alone is over budget
+            while sum(self.sizes.values()) > self.budget and len(self.frames) > 1:
+                evicted, _ = self.frames.popitem(last=False)
+                logging.info(f"Evicted dataset {evicted} ({self.sizes.pop(evicted)} bytes) from memory.")
+
+    def resident_bytes(self):
+        with self.lock:
+            return dict(self.sizes)
+
+
+cache = FrameCache(workspace_memory_budget)
+
+
+def _spill_path(dataset_id):
+    return os.path.join(workspace_dir, f"{dataset_id}.pkl")
+
+
+def _load(dataset_id):
+    if dataset_id.startswith(EXPERIMENT_PREFIX):
+        return experiments.load_merged(dataset_id[len(EXPERIMENT_PREFIX):])
+    return pd.read_pickle(_spill_path(dataset_id))
+
+
+def load(dataset_id):
+    """Returns a dataset's frame, from memory when resident."""
+    return cache.get(dataset_id, lambda: _load(dataset_id))
+
+
+def preload():
+    """Loads every experiment into the cache, so forked workers start with them in memory."""
+    for experiment_id in experiments.available_experiments():
+        load(EXPERIMENT_PREFIX + experiment_id)
+
+
+def upload_name(filename):
+    """The workspace name of an uploaded file."""
+    return UPLOAD_NAME_PREFIX + filename
+
+
+def _touch(session_id):
+    """Keeps a session's workspace and every upload it refers to for another chat_session_ttl."""
+    stored = redis_instance.hgetall(WORKSPACE_KEY.format(session_id))
+    pipe = redis_instance.pipeline()
+    pipe.expire(WORKSPACE_KEY.format(session_id), chat_session_ttl)
+    pipe.expire(OWNER_KEY.format(session_id), chat_session_ttl)
+    for dataset_id in stored.values():
+        pipe.set(UPLOAD_KEY.format(dataset_id.decode()), session_id, ex=chat_session_ttl)
+    pipe.execute()
+
+
+def claim(session_id, browser):
+    """Records the browser a session belongs to; the first browser to claim it keeps it."""
+    if browser:
+        redis_instance.set(OWNER_KEY.format(session_id), browser, ex=chat_session_ttl, nx=True)
+
+
+def owns(session_id, browser):
+    """Whether the session was claimed by this browser."""
+    owner = redis_instance.get(OWNER_KEY.format(session_id))
+    return bool(owner and browser) and hmac.compare_digest(owner.decode(), browser)
+
+
+def add_upload(session_id, filename, df):
+    """Adds an uploaded table to the session's workspace and makes it active."""
+    dataset_id = str(uuid.uuid4())
+    df = compaction.compact(df)
+    os.makedirs(workspace_dir, exist_ok=True)
+    df.to_pickle(_spill_path(dataset_id))
+    cache.put(dataset_id, df)
+    redis_instance.hset(WORKSPACE_KEY.format(session_id), filename, dataset_id)
+    activate(session_id, upload_name(filename))
+    _remove_expired_spills()
+    return dataset_id
+
+
+def datasets(session_id):
+    """Returns the datasets a session can switch between as {name: dataset id}."""
+    named = {e: EXPERIMENT_PREFIX + e for e in experiments.available_experiments()}
+    if session_id:
+        stored = redis_instance.hgetall(WORKSPACE_KEY.format(session_id))
+        named.update({upload_name(k.decode()): v.decode() for k, v in stored.items()})
+    return named
+
+
+def activate(session_id, name):
+    redis_instance.set(ACTIVE_KEY.format(session_id), name, ex=chat_session_ttl)
+    # Working with the workspace keeps its uploads, however long ago they were added
+    _touch(session_id)
+
+
+def active(session_id):
+    """Returns (name, dataset id, frame) of the session's active dataset."""
+    named = datasets(session_id)
+    name = redis_instance.get(ACTIVE_KEY.format(session_id)) if session_id else None
+    name = name.decode() if name else DEFAULT_DATASET
+    if name not in named:
+        name = DEFAULT_DATASET
+    dataset_id = named[name]
+    if not dataset_id.startswith(EXPERIMENT_PREFIX):
+        _touch(session_id)
+    return name, dataset_id, load(dataset_id)
+
+
+def describe(session_id):
+    """Dropdown options for the session's datasets, with the memory each one currently uses."""
+    resident = cache.resident_bytes()
+    options = []
+    for name, dataset_id in datasets(session_id).items():
+        if dataset_id in resident:
+            usage = f"{resident[dataset_id] / 1e6:.1f} MB in memory"
+        else:
+            usage = "not loaded"
+        options.append({"label": f"{name} ({usage})", "value": name})
+    return options
+
+
+def _remove_expired_spills():
+    """Deletes spilled uploads no workspace refers to any more.
+
+    An upload is referred to while its UPLOAD_KEY lives, which every use of
+    its workspace renews, so the age of the file itself does not matter.
+    """
+    cutoff = time.time() - SPILL_GRACE_SECONDS
+    for entry in os.scandir(workspace_dir):
+        if not entry.name.endswith(".pkl") or entry.stat().st_mtime >= cutoff:
+            continue
+        if not redis_instance.exists(UPLOAD_KEY.format(entry.name[:-len(".pkl")])):
+            os.remove(entry.path)